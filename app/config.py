@@ -0,0 +1,30 @@
+import os
+from functools import lru_cache
+from dotenv import load_dotenv
+
+
+@lru_cache(maxsize=None)
+def load_env():
+    """
+    Load the .env file once per process.
+    """
+    load_dotenv()
+
+
+def env(name, default=None, cast=str):
+    """
+    Read a setting from the environment, or `default` if it is unset.
+    """
+    load_env()
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    return cast(value)
+
+
+def as_bool(value):
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def as_list(value):
+    return [item.strip() for item in value.split(",") if item.strip()]
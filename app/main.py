@@ -1,15 +1,54 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-import http3
 from fastapi.middleware.cors import CORSMiddleware
 from .routers import login, signup, users, voyage_passenger
 from .routers import voyage_driver, admin, metrics
+from .services.upstream_services import users_api, close_upstreams
+from .services.rabbit_services import publisher, aggregator
+from .services.rabbit_services import close_connection
+from .services.pricing_services import warm_pricing_constants
+from .services.location_services import location_hub
+from .services.ingestion_services import location_buffer
+from .services.ingestion_services import LOCATION_INGEST_BUFFERED
+from .services.thumbnail_services import thumbnail_pool
+from .services.json_services import FastJSONResponse
+from .services.resilience_services import DeadlineMiddleware
+from .services.loader_services import LoaderMiddleware
 
-app = FastAPI()
-client = http3.AsyncClient()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    External resources live between startup and shutdown: upstream pools
+    are opened on first use and the broker on the first published batch.
+    """
+    publisher.start()
+    warmup = asyncio.create_task(warm_pricing_constants())
+    if aggregator is not None:
+        flusher = asyncio.create_task(aggregator.run())
+    if LOCATION_INGEST_BUFFERED:
+        ingestion = asyncio.create_task(location_buffer.run())
+    yield
+    if aggregator is not None:
+        flusher.cancel()
+    if LOCATION_INGEST_BUFFERED:
+        # Let a flush in progress finish, so its failed sends are queued
+        # again, then send whatever is left.
+        location_buffer.stop()
+        await ingestion
+        await location_buffer.flush()
+    warmup.cancel()
+    location_hub.close()
+    thumbnail_pool.close()
+    await asyncio.to_thread(close_connection)
+    await close_upstreams()
 
-async def call_api(url: str):
-    r = await client.get(url)
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+
+
+async def call_api(path: str):
+    r = await users_api.get(path)
     return r.text
 
 origins = [
@@ -31,6 +70,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(DeadlineMiddleware)
+app.add_middleware(LoaderMiddleware)
 
 app.include_router(login.router)
 app.include_router(signup.router)
@@ -43,5 +84,5 @@ app.include_router(metrics.router)
 
 @app.get("/")
 async def root():
-    result = await call_api('https://fiuber-users.herokuapp.com/')
+    result = await call_api('/')
     return {"Msg from users": result}
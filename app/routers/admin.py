@@ -1,19 +1,18 @@
 from fastapi import APIRouter, Header
 from fastapi.exceptions import HTTPException
 from fastapi.encoders import jsonable_encoder
-from dotenv import load_dotenv
 from app.services.validation_services import validate_req_admin_and_get_uid
+from app.services.validation_services import invalidate_user
+from app.services.card_services import invalidate_driver_card
 from typing import Optional
-import requests
-import os
 from app.services.rabbit_services import push_metric
+from app.services.pricing_services import get_pricing_constants
+from app.services.pricing_services import set_pricing_constants
 from ..schemas.pricing import ConstantsBase
-
-
-load_dotenv()
-USERS_URL = os.getenv("USERS_URL")
-PRICING_URL = os.getenv("PRICING_URL")
-VOYAGE_URL = os.getenv("VOYAGE_URL")
+from app.services.upstream_services import pricing_api, users_api, voyage_api
+from app.services.proxy_services import proxy
+from app.services.listing_services import listing_page, listing_export
+from app.services.listing_services import LISTING_PAGE_SIZE
 
 
 router = APIRouter(
@@ -32,12 +31,13 @@ async def register_admin(user_id: str,
     """
     Add Admin rol to user
     """
-    caller_id = validate_req_admin_and_get_uid(token)
-    req = requests.post(USERS_URL+f"/users/admin/{user_id}/{caller_id}")
+    caller_id = await validate_req_admin_and_get_uid(token)
+    req = await users_api.post(f"/users/admin/{user_id}/{caller_id}")
     data = req.json()
     if (not is_status_correct(req.status_code)):
         raise HTTPException(detail=data["detail"],
                             status_code=req.status_code)
+    invalidate_user(user_id)
     return data
 
 
@@ -47,14 +47,16 @@ async def block_user(user_id: str,
     """
     Block User
     """
-    caller_id = validate_req_admin_and_get_uid(token)
-    req = requests.post(USERS_URL+f"/users/block/{user_id}/{caller_id}")
+    caller_id = await validate_req_admin_and_get_uid(token)
+    req = await users_api.post(f"/users/block/{user_id}/{caller_id}")
     data = req.json()
     push_metric({"event": "Block"})
 
     if (not is_status_correct(req.status_code)):
         raise HTTPException(detail=data["detail"],
                             status_code=req.status_code)
+    invalidate_user(user_id)
+    invalidate_driver_card(user_id)
     return data
 
 
@@ -64,13 +66,15 @@ async def unblock_user(user_id: str,
     """
     Unblock User
     """
-    caller_id = validate_req_admin_and_get_uid(token)
-    req = requests.post(USERS_URL+f"/users/unblock/{user_id}/{caller_id}")
+    caller_id = await validate_req_admin_and_get_uid(token)
+    req = await users_api.post(f"/users/unblock/{user_id}/{caller_id}")
     push_metric({"event": "Unblock"})
     data = req.json()
     if (not is_status_correct(req.status_code)):
         raise HTTPException(detail=data["detail"],
                             status_code=req.status_code)
+    invalidate_user(user_id)
+    invalidate_driver_card(user_id)
     return data
 
 
@@ -79,13 +83,29 @@ async def get_users(token: Optional[str] = Header(None)):
     """
     Get Info From All The Users In Database
     """
-    caller_id = validate_req_admin_and_get_uid(token)
-    req = requests.get(USERS_URL+f"/users/all/{caller_id}")
-    data = req.json()
-    if (not is_status_correct(req.status_code)):
-        raise HTTPException(detail=data["detail"],
-                            status_code=req.status_code)
-    return data
+    caller_id = await validate_req_admin_and_get_uid(token)
+    return await proxy(users_api, "GET", f"/users/all/{caller_id}")
+
+
+@router.get('/users/page')
+async def get_users_page(cursor: Optional[str] = None,
+                         limit: int = LISTING_PAGE_SIZE,
+                         token: Optional[str] = Header(None)):
+    """
+    Get One Page Of Users, Starting At Cursor
+    """
+    caller_id = await validate_req_admin_and_get_uid(token)
+    return await listing_page(users_api, f"/users/all/{caller_id}",
+                              cursor, limit)
+
+
+@router.get('/users/export')
+async def export_users(token: Optional[str] = Header(None)):
+    """
+    Stream All The Users As NDJSON
+    """
+    caller_id = await validate_req_admin_and_get_uid(token)
+    return await listing_export(users_api, f"/users/all/{caller_id}")
 
 
 @router.get('/complaints')
@@ -93,13 +113,29 @@ async def get_complaints(token: Optional[str] = Header(None)):
     """
     Get Info From All The Complaints In Database
     """
-    validate_req_admin_and_get_uid(token)
-    req = requests.get(VOYAGE_URL+"/voyage/complaints")
-    data = req.json()
-    if (not is_status_correct(req.status_code)):
-        raise HTTPException(detail=data["detail"],
-                            status_code=req.status_code)
-    return data
+    await validate_req_admin_and_get_uid(token)
+    return await proxy(voyage_api, "GET", "/voyage/complaints")
+
+
+@router.get('/complaints/page')
+async def get_complaints_page(cursor: Optional[str] = None,
+                              limit: int = LISTING_PAGE_SIZE,
+                              token: Optional[str] = Header(None)):
+    """
+    Get One Page Of Complaints, Starting At Cursor
+    """
+    await validate_req_admin_and_get_uid(token)
+    return await listing_page(voyage_api, "/voyage/complaints",
+                              cursor, limit)
+
+
+@router.get('/complaints/export')
+async def export_complaints(token: Optional[str] = Header(None)):
+    """
+    Stream All The Complaints As NDJSON
+    """
+    await validate_req_admin_and_get_uid(token)
+    return await listing_export(voyage_api, "/voyage/complaints")
 
 
 @router.get('/constants')
@@ -107,13 +143,8 @@ async def get_constants(token: Optional[str] = Header(None)):
     """
     Get Pricing Constants
     """
-    validate_req_admin_and_get_uid(token)
-    req = requests.get(f"{PRICING_URL}/admin")
-    data = req.json()
-    if (not is_status_correct(req.status_code)):
-        raise HTTPException(detail=data["detail"],
-                            status_code=req.status_code)
-    return data
+    await validate_req_admin_and_get_uid(token)
+    return await get_pricing_constants()
 
 
 @router.put('/constants')
@@ -122,11 +153,12 @@ async def put_constants(new_constants: ConstantsBase,
     """
     Get Pricing Constants
     """
-    validate_req_admin_and_get_uid(token)
-    req = requests.put(f"{PRICING_URL}/admin",
-                       json=jsonable_encoder(new_constants))
+    await validate_req_admin_and_get_uid(token)
+    constants = jsonable_encoder(new_constants)
+    req = await pricing_api.put("/admin", json=constants)
     data = req.json()
     if (not is_status_correct(req.status_code)):
         raise HTTPException(detail=data["detail"],
                             status_code=req.status_code)
+    set_pricing_constants(constants)
     return data
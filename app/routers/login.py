@@ -4,13 +4,8 @@ from fastapi.exceptions import HTTPException
 from ..schemas.users_schema import LoginAuthBase, RecoveryEmailBase
 from ..schemas.users_schema import DeviceToken
 from fastapi.encoders import jsonable_encoder
-import requests
-from dotenv import load_dotenv
-import os
 from app.services.rabbit_services import push_metric
-
-load_dotenv()
-USERS_URL = os.getenv("USERS_URL")
+from app.services.upstream_services import users_api
 
 router = APIRouter(
     prefix="/login",
@@ -20,8 +15,8 @@ router = APIRouter(
 
 @router.post('/password-recovery', status_code=status.HTTP_200_OK)
 async def send_recover_email(email: RecoveryEmailBase):
-    req = requests.post(USERS_URL+"/login/password-recovery",
-                        json=jsonable_encoder(email))
+    req = await users_api.post("/login/password-recovery",
+                               json=jsonable_encoder(email))
     data = req.json()
     push_metric({"event": "Reset"})
     if (req.status_code != status.HTTP_200_OK):
@@ -30,7 +25,7 @@ async def send_recover_email(email: RecoveryEmailBase):
 
 @router.post('/')
 async def login(params: LoginAuthBase):
-    req = requests.post(USERS_URL+"/login/", json=jsonable_encoder(params))
+    req = await users_api.post("/login/", json=jsonable_encoder(params))
 
     data = req.json()
 
@@ -49,8 +44,8 @@ async def login_google(device_token: DeviceToken,
                        token: Optional[str] = Header(None)):
     params = jsonable_encoder(device_token)
     params["token"] = token
-    req = requests.post(USERS_URL+"/login/google",
-                        json=params)
+    req = await users_api.post("/login/google",
+                               json=params)
 
     data = req.json()
 
@@ -1,14 +1,26 @@
 from fastapi import APIRouter, Header
 from fastapi.exceptions import HTTPException
 from app.services.validation_services import validate_req_admin_and_get_uid
-import requests
+from app.services.validation_services import token_cache
+from app.services.rabbit_services import publisher, aggregator
 from typing import Optional
-from dotenv import load_dotenv
-import os
+from app.services.upstream_services import metrics_api, UPSTREAMS
+from app.services.cache_services import RefreshingCache
+from app.services.pricing_services import constants_cache
+from app.services.location_services import location_hub
+from app.services.ingestion_services import location_buffer
+from app.services.geo_services import driver_index
+from app.services.picture_services import pictures
+from app.services.thumbnail_services import thumbnail_pool
+from app.services.card_services import driver_cards
+from app.services import loader_services
+from app.services.saga_services import saga_log
+from app.config import env
 
-load_dotenv()
-USERS_URL = os.getenv("USERS_URL")
-METRICS_URL = os.getenv("METRICS_URL")
+METRICS_CACHE_TTL = env("METRICS_CACHE_TTL", 30.0, float)
+METRICS_CACHE_STALE_TTL = env("METRICS_CACHE_STALE_TTL", 300.0, float)
+
+metrics_cache = RefreshingCache(METRICS_CACHE_TTL, METRICS_CACHE_STALE_TTL)
 
 
 router = APIRouter(
@@ -21,10 +33,8 @@ def is_status_correct(status_code):
     return status_code//100 == 2
 
 
-@router.get('/voyages')
-async def get_voyages_metrics(token: Optional[str] = Header(None)):
-    validate_req_admin_and_get_uid(token)
-    resp = requests.get(METRICS_URL+"/metrics/voyages")
+async def fetch_metrics(path):
+    resp = await metrics_api.get(path)
     data = resp.json()
     if (not is_status_correct(resp.status_code)):
         raise HTTPException(detail=data["detail"],
@@ -32,23 +42,42 @@ async def get_voyages_metrics(token: Optional[str] = Header(None)):
     return data
 
 
+@router.get('/voyages')
+async def get_voyages_metrics(token: Optional[str] = Header(None)):
+    await validate_req_admin_and_get_uid(token)
+    return await metrics_cache.get("/metrics/voyages", fetch_metrics)
+
+
 @router.get('/payments')
 async def get_payments_metrics(token: Optional[str] = Header(None)):
-    validate_req_admin_and_get_uid(token)
-    resp = requests.get(METRICS_URL+"/metrics/payments")
-    data = resp.json()
-    if (not is_status_correct(resp.status_code)):
-        raise HTTPException(detail=data["detail"],
-                            status_code=resp.status_code)
-    return data
+    await validate_req_admin_and_get_uid(token)
+    return await metrics_cache.get("/metrics/payments", fetch_metrics)
 
 
 @router.get('/users')
 async def get_users_metrics(token: Optional[str] = Header(None)):
-    validate_req_admin_and_get_uid(token)
-    resp = requests.get(METRICS_URL+"/metrics/users")
-    data = resp.json()
-    if (not is_status_correct(resp.status_code)):
-        raise HTTPException(detail=data["detail"],
-                            status_code=resp.status_code)
-    return data
+    await validate_req_admin_and_get_uid(token)
+    return await metrics_cache.get("/metrics/users", fetch_metrics)
+
+
+@router.get('/gateway')
+async def get_gateway_metrics(token: Optional[str] = Header(None)):
+    """
+    Internal Counters Of The Gateway
+    """
+    await validate_req_admin_and_get_uid(token)
+    return {"upstreams": {upstream.name: upstream.stats()
+                          for upstream in UPSTREAMS},
+            "token_cache": token_cache.stats(),
+            "metrics_cache": metrics_cache.stats(),
+            "pricing_constants": constants_cache.stats(),
+            "location_streams": location_hub.stats(),
+            "location_ingestion": location_buffer.stats(),
+            "driver_index": driver_index.stats(),
+            "driver_cards": driver_cards.stats(),
+            "pictures": pictures.stats(),
+            "thumbnail_pool": thumbnail_pool.stats(),
+            "user_loaders": loader_services.stats(),
+            "sagas": saga_log.stats(),
+            "metrics_publisher": publisher.stats(),
+            "metrics_aggregator": aggregator and aggregator.stats()}
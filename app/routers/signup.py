@@ -1,14 +1,9 @@
 from fastapi import APIRouter
 from ..schemas.users_schema import AuthBase
 from fastapi.exceptions import HTTPException
-import requests
-from dotenv import load_dotenv
-import os
 from fastapi.encoders import jsonable_encoder
 from app.services.rabbit_services import push_metric
-
-load_dotenv()
-USERS_URL = os.getenv("USERS_URL")
+from app.services.upstream_services import users_api
 
 router = APIRouter(
     prefix="/signup",
@@ -18,7 +13,7 @@ router = APIRouter(
 
 @router.post('/')
 async def signup(params: AuthBase):
-    req = requests.post(USERS_URL+"/signup/", json=jsonable_encoder(params))
+    req = await users_api.post("/signup/", json=jsonable_encoder(params))
 
     data = req.json()
 
@@ -1,22 +1,23 @@
 from fastapi import APIRouter, Header
 from fastapi.exceptions import HTTPException
+from fastapi.responses import JSONResponse, Response
 
 from app.services.validation_services import validate_req_passenger_and_get_uid
 from app.services.validation_services import validate_token
 from app.services.validation_services import validate_req_driver_and_get_uid
+from app.services.validation_services import invalidate_user
+from app.services.concurrency_services import Aggregation
+from app.services.picture_services import pictures, matches
+from app.services.thumbnail_services import snap_size
+from app.services.card_services import invalidate_driver_card
+from app.services.loader_services import load_user
+from app.services.saga_services import Saga, SagaStep
 from ..schemas.users_schema import Roles, PassengerBase, DriverBase
 from ..schemas.users_schema import ProfilePictureBase
 from ..schemas.users_schema import WithdrawBase
 from fastapi.encoders import jsonable_encoder
-import requests
 from typing import Optional, Union
-from dotenv import load_dotenv
-import os
-
-load_dotenv()
-USERS_URL = os.getenv("USERS_URL")
-VOYAGE_URL = os.getenv("VOYAGE_URL")
-PAYMENTS_URL = os.getenv("PAYMENTS_URL")
+from app.services.upstream_services import payments_api, users_api, voyage_api
 
 
 router = APIRouter(
@@ -29,108 +30,163 @@ def is_status_correct(status_code):
     return status_code//100 == 2
 
 
+async def checked(request):
+    resp = await request
+    if (not is_status_correct(resp.status_code)):
+        data = resp.json()
+        raise HTTPException(detail=data["detail"],
+                            status_code=resp.status_code)
+    return resp
+
+
+def passenger_signup(id):
+    """
+    Saga steps making a user usable as a passenger. They don't depend on
+    each other and neither can be undone upstream.
+    """
+    return (SagaStep("voyage_signup",
+                     lambda: checked(voyage_api.post(
+                         "/voyage/passenger/signup/" + id))),
+            SagaStep("wallet",
+                     lambda: checked(payments_api.post(
+                         "/wallet", json={"user_id": id}))))
+
+
+def driver_signup(id):
+    return (SagaStep("voyage_signup",
+                     lambda: checked(voyage_api.post(
+                         "/voyage/driver/signup/" + id))),)
+
+
 @router.post('/')
 async def create_user(user: Union[PassengerBase, DriverBase],
                       token: Optional[str] = Header(None)):
-    id = validate_token(token)
+    id = await validate_token(token)
     user = jsonable_encoder(user)
     user["id"] = id
     user["is_blocked"] = False
-    req = requests.post(USERS_URL+"/users", json=user)
-    if (not is_status_correct(req.status_code)):
-        data = req.json()
-        raise HTTPException(detail=data["detail"],
-                            status_code=req.status_code)
+    saga = Saga("create_user").stage(
+        SagaStep("user",
+                 lambda: checked(users_api.post("/users", json=user)),
+                 lambda: checked(users_api.delete("/users/" + id + "/" +
+                                                  id))))
     if (Roles.PASSENGER.value in user.get("roles")):
-        resp = requests.post(VOYAGE_URL+"/voyage/passenger/signup/"+id)
-        data = resp.json()
-        if (not is_status_correct(resp.status_code)):
-            raise HTTPException(detail=data["detail"],
-                                status_code=resp.status_code)
-        req = requests.post(PAYMENTS_URL+"/wallet", json={"user_id": id})
-        data = req.json()
-        if (not is_status_correct(req.status_code)):
-            raise HTTPException(detail=data["detail"],
-                                status_code=req.status_code)
+        saga.stage(*passenger_signup(id))
     elif (Roles.DRIVER.value in user.get("roles")):
-        resp = requests.post(VOYAGE_URL+"/voyage/driver/signup/"+id)
-        data = resp.json()
-        if (not is_status_correct(resp.status_code)):
-            raise HTTPException(detail=data["detail"],
-                                status_code=resp.status_code)
+        saga.stage(*driver_signup(id))
+    await saga.run()
 
 
 @router.post('/profile/picture')
 async def post_picture(user: ProfilePictureBase,
                        token: Optional[str] = Header(None)):
-    id = validate_token(token)
-    resp = requests.post(USERS_URL+"/users/"+id+"/profile/picture",
-                         json=jsonable_encoder(user))
+    id = await validate_token(token)
+    resp = await users_api.post("/users/"+id+"/profile/picture",
+                                json=jsonable_encoder(user))
     data = resp.json()
     if (not is_status_correct(resp.status_code)):
         raise HTTPException(detail=data["detail"],
                             status_code=resp.status_code)
+    pictures.invalidate(id)
+    invalidate_driver_card(id)
+
+
+@router.get('/{id_user}/profile/picture')
+async def get_picture(id_user: str, size: Optional[int] = None,
+                      token: Optional[str] = Header(None),
+                      if_none_match: Optional[str] = Header(None)):
+    """
+    Profile picture of a user, as a thumbnail of the closest fixed size
+    covering `size` if given. Answers 304 when If-None-Match already has
+    the current ETag.
+    """
+    await validate_token(token)
+    etag, img = await pictures.get(id_user, snap_size(size))
+    headers = {"ETag": '"' + etag + '"',
+               "Cache-Control": "private, no-cache"}
+    if matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse({"img": img}, headers=headers)
 
 
 @router.delete('/{id_user}')
 async def delete_user(id_user: str,
                       token: Optional[str] = Header(None)):
-    caller_id = validate_token(token)
-    req = requests.delete(USERS_URL + "/users/" +
-                          id_user + "/" + caller_id)
+    caller_id = await validate_token(token)
+    req = await users_api.delete("/users/" +
+                                 id_user + "/" + caller_id)
     if (not is_status_correct(req.status_code)):
         data = req.json()
         raise HTTPException(detail=data["detail"],
                             status_code=req.status_code)
+    invalidate_user(id_user)
+    pictures.invalidate(id_user)
+    invalidate_driver_card(id_user)
 
 
-def get_user_info(caller_id, id_user):
-    req = requests.get(USERS_URL + "/users/" +
-                       id_user + "/" + caller_id)
-    data = req.json()
-    if (not is_status_correct(req.status_code)):
-        raise HTTPException(detail=data["detail"],
-                            status_code=req.status_code)
-    req = requests.get(USERS_URL+"/users/"+id_user+"/profile/picture")
-    if is_status_correct(req.status_code):
-        data["profile_picture"] = req.json().get("img")
-    return data
-
-
-@router.get('/{id_user}')
-async def find_user(id_user: str, token: Optional[str] = Header(None)):
-    caller_id = validate_token(token)
-    data = get_user_info(caller_id, id_user)
-
-    req = requests.get(VOYAGE_URL +
-                       "/voyage/calification/"+id_user+"/false")
-    if is_status_correct(req.status_code):
-        score = req.json().get("calification")
+def set_score(key):
+    def merge(data, body):
+        score = body.get("calification")
         if score != "No Calification":
-            data["passenger_score"] = score
+            data[key] = score
+    return merge
 
-    req = requests.get(VOYAGE_URL +
-                       "/voyage/calification/"+id_user+"/true")
-    if is_status_correct(req.status_code):
-        score = req.json().get("calification")
-        if score != "No Calification":
-            data["driver_score"] = score
 
-    return data
+def user_info_parts(caller_id, id_user):
+    return (Aggregation()
+            .required(load_user(id_user, caller_id), parsed=True)
+            .optional(pictures.reference(id_user), parsed=True))
 
 
-def request_modifications(id_user, user, caller_id):
+@router.get('/{id_user}')
+async def find_user(id_user: str, token: Optional[str] = Header(None)):
+    caller_id = await validate_token(token)
+    return await (
+        user_info_parts(caller_id, id_user)
+        .optional(voyage_api.get("/voyage/calification/"+id_user+"/false",
+                                 idempotent=True),
+                  set_score("passenger_score"))
+        .optional(voyage_api.get("/voyage/calification/"+id_user+"/true",
+                                 idempotent=True),
+                  set_score("driver_score"))
+        .run())
+
+
+async def request_modifications(id_user, user, caller_id):
     _user = jsonable_encoder(user)
     _user["is_blocked"] = False
     _user["id"] = id_user
 
-    req = requests.put(USERS_URL + "/users/" + id_user
-                       + "/" + caller_id,
-                       json=_user)
+    req = await users_api.put("/users/" + id_user
+                              + "/" + caller_id,
+                              json=_user)
     if (not is_status_correct(req.status_code)):
         data = req.json()
         raise HTTPException(detail=data["detail"],
                             status_code=req.status_code)
+    invalidate_user(id_user)
+
+
+async def restore_user(id_user, previous, caller_id):
+    await checked(users_api.put("/users/" + id_user + "/" + caller_id,
+                                json=previous))
+    invalidate_user(id_user)
+
+
+async def attach_role(name, id_user, user, caller_id, signup):
+    """
+    Save the user with a new role and sign it up for that role, putting
+    the previous user back if the signup fails.
+    """
+    previous = await load_user(id_user, caller_id)
+    await (Saga(name)
+           .stage(SagaStep("user",
+                           lambda: request_modifications(id_user, user,
+                                                         caller_id),
+                           lambda: restore_user(id_user, previous,
+                                                caller_id)))
+           .stage(*signup)
+           .run())
 
 
 @router.put('/passenger/{id_user}')
@@ -139,8 +195,8 @@ async def modify_passenger(id_user: str, user: PassengerBase,
     """
     Modify a Passenger
     """
-    caller_id = validate_req_passenger_and_get_uid(token)
-    request_modifications(id_user, user, caller_id)
+    caller_id = await validate_req_passenger_and_get_uid(token)
+    await request_modifications(id_user, user, caller_id)
 
 
 @router.post('/driver/withdraw')
@@ -149,13 +205,14 @@ async def withdraw(withdraw: WithdrawBase,
     """
     Withdraw money for driver
     """
-    driver_id = validate_token(token)
-
-    resp = requests.post(PAYMENTS_URL+'/withdraw',
-                         json={"userId": driver_id,
-                               "receiverAddress": withdraw.receiver_address,
-                               "amountInEthers": withdraw.amount_in_ethers
-                               })
+    driver_id = await validate_token(token)
+
+    resp = await payments_api.post(
+        '/withdraw',
+        json={"userId": driver_id,
+              "receiverAddress": withdraw.receiver_address,
+              "amountInEthers": withdraw.amount_in_ethers
+              })
     data = resp.json()
 
     if (not is_status_correct(resp.status_code)):
@@ -170,8 +227,9 @@ async def modify_driver(id_user: str, user: DriverBase,
     """
     Modify a Driver
     """
-    caller_id = validate_req_driver_and_get_uid(token)
-    request_modifications(id_user, user, caller_id)
+    caller_id = await validate_req_driver_and_get_uid(token)
+    await request_modifications(id_user, user, caller_id)
+    invalidate_driver_card(id_user)
 
 
 @router.post('/driver/{id_user}')
@@ -180,47 +238,28 @@ async def add_driver_role(id_user: str, user: DriverBase,
     """
     Add a driver role to an user
     """
-    caller_id = validate_token(token)
-    request_modifications(id_user, user, caller_id)
-    resp = requests.post(VOYAGE_URL+"/voyage/driver/signup/"+id_user)
-    data = resp.json()
-    if (not is_status_correct(resp.status_code)):
-        raise HTTPException(detail=data["detail"],
-                            status_code=resp.status_code)
+    caller_id = await validate_token(token)
+    await attach_role("add_driver_role", id_user, user, caller_id,
+                      driver_signup(id_user))
 
 
-def get_public_profile(id: str, token: str, is_driver: bool):
-    caller_id = validate_token(token)
-    data = get_user_info(caller_id, id)
-    resp = requests.get(VOYAGE_URL +
-                        "/voyage/calification/"+id+"/"+str(is_driver))
-    if (not is_status_correct(resp.status_code)):
-        raise HTTPException(detail=resp.json()["detail"],
-                            status_code=resp.status_code)
-    data.update(resp.json())
+def set_vip(data, body):
+    data.update({"is_vip": body})
 
-    resp = requests.get(VOYAGE_URL +
-                        "/voyage/count/"+id+"/"+str(is_driver))
-    if (not is_status_correct(resp.status_code)):
-        raise HTTPException(detail=resp.json()["detail"],
-                            status_code=resp.status_code)
-    data.update(resp.json())
-
-    resp = requests.get(VOYAGE_URL +
-                        "/voyage/review/"+id+"/"+str(is_driver))
-    if (not is_status_correct(resp.status_code)):
-        raise HTTPException(detail=resp.json()["detail"],
-                            status_code=resp.status_code)
-    data.update(resp.json())
-
-    resp = requests.get(VOYAGE_URL +
-                        "/voyage/vip/"+id+"/"+str(is_driver))
-    if (not is_status_correct(resp.status_code)):
-        raise HTTPException(detail=resp.json()["detail"],
-                            status_code=resp.status_code)
-    data.update({"is_vip": resp.json()})
 
-    return data
+async def get_public_profile(id: str, token: str, is_driver: bool):
+    caller_id = await validate_token(token)
+    suffix = id + "/" + str(is_driver)
+    return await (
+        user_info_parts(caller_id, id)
+        .required(voyage_api.get("/voyage/calification/" + suffix,
+                                 idempotent=True))
+        .required(voyage_api.get("/voyage/count/" + suffix,
+                                 idempotent=True))
+        .required(voyage_api.get("/voyage/review/" + suffix,
+                                 idempotent=True))
+        .required(voyage_api.get("/voyage/vip/" + suffix), set_vip)
+        .run())
 
 
 @router.get('/driver/balance')
@@ -228,8 +267,8 @@ async def get_driver_balance(token: Optional[str] = Header(None)):
     """
     Ask for driver balance
     """
-    driver_id = validate_token(token)
-    resp = requests.get(PAYMENTS_URL+"/payments/"+driver_id)
+    driver_id = await validate_token(token)
+    resp = await payments_api.get("/payments/"+driver_id)
     data = resp.json()
     if (not is_status_correct(resp.status_code)):
         raise HTTPException(detail=data["detail"],
@@ -244,8 +283,8 @@ async def get_passenger_balance(token: Optional[str] = Header(None)):
     """
     Ask for passenger balance
     """
-    passenger_id = validate_token(token)
-    resp = requests.get(PAYMENTS_URL+"/balance/"+passenger_id)
+    passenger_id = await validate_token(token)
+    resp = await payments_api.get("/balance/"+passenger_id)
     data = resp.json()
     if (not is_status_correct(resp.status_code)):
         raise HTTPException(detail=data["detail"],
@@ -261,7 +300,7 @@ async def get_driver_profile(id_driver: str,
     """
     Ask for drivers public information
     """
-    return get_public_profile(id_driver, token, True)
+    return await get_public_profile(id_driver, token, True)
 
 
 @router.get('/passenger/{id_passenger}')
@@ -270,7 +309,7 @@ async def get_passenger_profile(id_passenger: str,
     """
     Ask for passengers public information
     """
-    return get_public_profile(id_passenger, token, False)
+    return await get_public_profile(id_passenger, token, False)
 
 
 @router.post('/passenger/{id_user}')
@@ -279,24 +318,15 @@ async def add_passenger_role(id_user: str, user: DriverBase,
     """
     Add a passenger role to an user
     """
-    caller_id = validate_token(token)
-    request_modifications(id_user, user, caller_id)
-    resp = requests.post(VOYAGE_URL+"/voyage/passenger/signup/"+id_user)
-    data = resp.json()
-    if (not is_status_correct(resp.status_code)):
-        raise HTTPException(detail=data["detail"],
-                            status_code=resp.status_code)
-    req = requests.post(PAYMENTS_URL+"/wallet", json={"user_id": id_user})
-    data = req.json()
-    if (not is_status_correct(req.status_code)):
-        raise HTTPException(detail=data["detail"],
-                            status_code=req.status_code)
+    caller_id = await validate_token(token)
+    await attach_role("add_passenger_role", id_user, user, caller_id,
+                      passenger_signup(id_user))
 
 
 @router.post("/status")
 async def get_user_status(token: Optional[str] = Header(None)):
-    caller_id = validate_token(token)
-    resp = requests.get(VOYAGE_URL+"/voyage/status/"+caller_id)
+    caller_id = await validate_token(token)
+    resp = await voyage_api.get("/voyage/status/"+caller_id)
     data = resp.json()
     if (not is_status_correct(resp.status_code)):
         raise HTTPException(detail=data["detail"],
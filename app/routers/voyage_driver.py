@@ -1,20 +1,19 @@
 from typing import Optional
 from fastapi import APIRouter, Header
 from fastapi.exceptions import HTTPException
-from dotenv import load_dotenv
-import os
+from fastapi.responses import StreamingResponse
 from app.schemas.complaint import ReviewBase
 from app.schemas.voyage_schema import Point
-import requests
 from fastapi.encoders import jsonable_encoder
 from ..services.validation_services import validate_req_driver_and_get_uid
 from ..services.validation_services import validate_token
 from app.services.rabbit_services import push_metric
-
-
-load_dotenv()
-VOYAGE_URL = os.getenv("VOYAGE_URL")
-PAYMENTS_URL = os.getenv("PAYMENTS_URL")
+from app.services.location_services import location_hub, fetch_location
+from app.services.ingestion_services import location_buffer
+from app.services.ingestion_services import LOCATION_INGEST_BUFFERED
+from app.services.upstream_services import payments_api, voyage_api
+from app.services.proxy_services import proxy
+from app.services.geo_services import driver_index
 
 
 router = APIRouter(
@@ -28,43 +27,45 @@ def is_status_correct(status_code):
 
 
 @router.post('/searching')
-def activate_driver(location: Point,
-                    token: Optional[str] = Header(None)):
+async def activate_driver(location: Point,
+                          token: Optional[str] = Header(None)):
     """
     Add Driver To Is Searching List
     """
-    uid = validate_req_driver_and_get_uid(token)
+    uid = await validate_req_driver_and_get_uid(token)
     location_body = jsonable_encoder(location)
-    resp = requests.post(VOYAGE_URL+"/voyage/driver/searching/"+uid,
-                         json=location_body)
+    resp = await voyage_api.post("/voyage/driver/searching/"+uid,
+                                 json=location_body)
     data = resp.json()
     if (not is_status_correct(resp.status_code)):
         raise HTTPException(detail=data["detail"],
                             status_code=resp.status_code)
+    driver_index.update(uid, location.latitude, location.longitude)
     return data
 
 
 @router.post('/offline')
-def deactivate_driver(token: Optional[str] = Header(None)):
+async def deactivate_driver(token: Optional[str] = Header(None)):
     """
     A Seaching driver is set to Offline.
     """
-    uid = validate_req_driver_and_get_uid(token)
-    resp = requests.post(VOYAGE_URL+"/voyage/driver/offline/"+uid)
+    uid = await validate_req_driver_and_get_uid(token)
+    resp = await voyage_api.post("/voyage/driver/offline/"+uid)
     data = resp.json()
     if (not is_status_correct(resp.status_code)):
         raise HTTPException(detail=data["detail"],
                             status_code=resp.status_code)
+    driver_index.remove(uid)
     return data
 
 
 @router.post('/vip/subscription')
-def driver_subscribes_to_vip(token: Optional[str] = Header(None)):
+async def driver_subscribes_to_vip(token: Optional[str] = Header(None)):
     """
     A Driver subscribes to VIP Package.
     """
-    uid = validate_req_driver_and_get_uid(token)
-    resp = requests.post(VOYAGE_URL+"/voyage/driver/vip/"+uid+"/true")
+    uid = await validate_req_driver_and_get_uid(token)
+    resp = await voyage_api.post("/voyage/driver/vip/"+uid+"/true")
     data = resp.json()
     if (not is_status_correct(resp.status_code)):
         raise HTTPException(detail=data["detail"],
@@ -73,12 +74,12 @@ def driver_subscribes_to_vip(token: Optional[str] = Header(None)):
 
 
 @router.post('/vip/unsubscription')
-def driver_unsubscribes_vip(token: Optional[str] = Header(None)):
+async def driver_unsubscribes_vip(token: Optional[str] = Header(None)):
     """
     A Driver leaves VIP Package.
     """
-    uid = validate_req_driver_and_get_uid(token)
-    resp = requests.post(VOYAGE_URL+"/voyage/driver/vip/"+uid+"/false")
+    uid = await validate_req_driver_and_get_uid(token)
+    resp = await voyage_api.post("/voyage/driver/vip/"+uid+"/false")
     data = resp.json()
     if (not is_status_correct(resp.status_code)):
         raise HTTPException(detail=data["detail"],
@@ -87,28 +88,34 @@ def driver_unsubscribes_vip(token: Optional[str] = Header(None)):
 
 
 @router.post('/location')
-def update_location(location: Point, token: Optional[str] = Header(None)):
+async def update_location(location: Point,
+                          token: Optional[str] = Header(None)):
     """
     Updates the Driver location in real time.
     """
     location_body = jsonable_encoder(location)
-    uid = validate_req_driver_and_get_uid(token)
-    resp = requests.post(VOYAGE_URL+"/voyage/driver/location/"+uid,
-                         json=location_body)
+    uid = await validate_req_driver_and_get_uid(token)
+    if LOCATION_INGEST_BUFFERED:
+        location_buffer.put(uid, location_body)
+        driver_index.update(uid, location.latitude, location.longitude)
+        return {"status": "accepted"}
+    resp = await voyage_api.post("/voyage/driver/location/"+uid,
+                                 json=location_body)
     data = resp.json()
     if (not is_status_correct(resp.status_code)):
         raise HTTPException(detail=data["detail"],
                             status_code=resp.status_code)
+    driver_index.update(uid, location.latitude, location.longitude)
     return data
 
 
 @router.get('/location/{voyage_id}')
-def get_location(voyage_id: str, token: Optional[str] = Header(None)):
+async def get_location(voyage_id: str, token: Optional[str] = Header(None)):
     """
     Get Drivers location in real time.
     """
-    uid = validate_token(token)
-    resp = requests.get(VOYAGE_URL+"/voyage/location/"+voyage_id+'/'+uid)
+    uid = await validate_token(token)
+    resp = await voyage_api.get("/voyage/location/"+voyage_id+'/'+uid)
     data = resp.json()
     if (not is_status_correct(resp.status_code)):
         raise HTTPException(detail=data["detail"],
@@ -116,15 +123,28 @@ def get_location(voyage_id: str, token: Optional[str] = Header(None)):
     return data
 
 
+@router.get('/location/{voyage_id}/stream')
+async def stream_location(voyage_id: str,
+                          token: Optional[str] = Header(None)):
+    """
+    Stream Drivers location as Server-Sent Events, only sending changes.
+    """
+    uid = await validate_token(token)
+    first = await fetch_location(voyage_id, uid)
+    return StreamingResponse(location_hub.stream(voyage_id, uid, first),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+
 @router.post('/reply/{id_voyage}/{status}')
-def reply_voyage_solicitation(id_voyage: str, status: bool,
-                              token: Optional[str] = Header(None)):
+async def reply_voyage_solicitation(id_voyage: str, status: bool,
+                                    token: Optional[str] = Header(None)):
     """
     Driver Acepts (True) / Declines (False) passenger solicitation
     """
-    uid = validate_req_driver_and_get_uid(token)
-    resp = requests.post(VOYAGE_URL+"/voyage/driver/reply/"
-                         + id_voyage + "/" + str(status) + "/" + uid)
+    uid = await validate_req_driver_and_get_uid(token)
+    resp = await voyage_api.post("/voyage/driver/reply/"
+                                 + id_voyage + "/" + str(status) + "/" + uid)
     data = resp.json()
     if (not is_status_correct(resp.status_code)):
         raise HTTPException(detail=data["detail"],
@@ -133,14 +153,14 @@ def reply_voyage_solicitation(id_voyage: str, status: bool,
 
 
 @router.post('/start/{voyage_id}')
-def inform_start_voyage(voyage_id: str,
-                        token: Optional[str] = Header(None)):
+async def inform_start_voyage(voyage_id: str,
+                              token: Optional[str] = Header(None)):
     """
     Driver Informs Arrived at Initial Point.
     """
-    uid = validate_req_driver_and_get_uid(token)
-    resp = requests.post(VOYAGE_URL+"/voyage/driver/start/" +
-                         voyage_id + "/" + uid)
+    uid = await validate_req_driver_and_get_uid(token)
+    resp = await voyage_api.post("/voyage/driver/start/" +
+                                 voyage_id + "/" + uid)
     data = resp.json()
     if (not is_status_correct(resp.status_code)):
         raise HTTPException(detail=data["detail"],
@@ -149,20 +169,19 @@ def inform_start_voyage(voyage_id: str,
 
 
 @router.post('/end/{voyage_id}')
-def inform_finish_voyage(voyage_id: str,
-                         token: Optional[str] = Header(None)):
+async def inform_finish_voyage(voyage_id: str,
+                               token: Optional[str] = Header(None)):
     """
     Driver Informs Voyage Has Finished.
     """
-    uid = validate_req_driver_and_get_uid(token)
-    resp = requests.post(VOYAGE_URL+"/voyage/driver/end/"
-                         + voyage_id + "/" + uid)
+    uid = await validate_req_driver_and_get_uid(token)
+    resp = await voyage_api.post("/voyage/driver/end/"
+                                 + voyage_id + "/" + uid)
     data = resp.json()
     if (not is_status_correct(resp.status_code)):
         raise HTTPException(detail=data["detail"],
                             status_code=resp.status_code)
-    resp = requests.get(VOYAGE_URL
-                        + "/voyage/info/" + voyage_id + '/' + uid)
+    resp = await voyage_api.get("/voyage/info/" + voyage_id + '/' + uid)
     data = resp.json()
     if (not is_status_correct(resp.status_code)):
         raise HTTPException(detail=data["detail"],
@@ -177,8 +196,8 @@ def inform_finish_voyage(voyage_id: str,
               "receiverId": data["driver_id"],
               "amountInEthers": str(data['price'])}
 
-    resp = requests.post(PAYMENTS_URL+"/deposit",
-                         json=params)
+    resp = await payments_api.post("/deposit",
+                                   json=params)
     status = resp.status_code == 200
     push_metric({"event": "Payment",
                 "status": str(status),
@@ -191,14 +210,13 @@ def inform_finish_voyage(voyage_id: str,
 
 
 @router.delete('/voyage/{voyage_id}')
-def cancel_confirmed_voyage(voyage_id: str,
-                            token: Optional[str] = Header(None)):
+async def cancel_confirmed_voyage(voyage_id: str,
+                                  token: Optional[str] = Header(None)):
     """
     Cancel Voyage Previously Confirmed By Passenger
     """
-    uid = validate_req_driver_and_get_uid(token)
-    resp = requests.delete(VOYAGE_URL
-                           + "/voyage/" + voyage_id + "/" + uid)
+    uid = await validate_req_driver_and_get_uid(token)
+    resp = await voyage_api.delete("/voyage/" + voyage_id + "/" + uid)
     data = resp.json()
     if (not is_status_correct(resp.status_code)):
         raise HTTPException(detail=data["detail"],
@@ -207,32 +225,25 @@ def cancel_confirmed_voyage(voyage_id: str,
 
 
 @router.get('/last')
-def get_lasts_voyages(token: Optional[str] = Header(None)):
+async def get_lasts_voyages(token: Optional[str] = Header(None)):
     """
     Get last voyages made by passenger
     """
-    uid = validate_req_driver_and_get_uid(token)
-    resp = requests.get(VOYAGE_URL
-                        + "/voyage/last/" + uid + "/true")
-    data = resp.json()
-    if (not is_status_correct(resp.status_code)):
-        raise HTTPException(detail=data["detail"],
-                            status_code=resp.status_code)
-    return data
+    uid = await validate_req_driver_and_get_uid(token)
+    return await proxy(voyage_api, "GET", "/voyage/last/" + uid + "/true")
 
 
 @router.post('/review/{voyage_id}')
-def add_review(voyage_id: str, review: ReviewBase,
-               token: Optional[str] = Header(None)):
+async def add_review(voyage_id: str, review: ReviewBase,
+                     token: Optional[str] = Header(None)):
     """
     Add a review from driver to passenger.
     """
-    uid = validate_req_driver_and_get_uid(token)
+    uid = await validate_req_driver_and_get_uid(token)
     rev = jsonable_encoder(review)
     rev["by_driver"] = True
-    resp = requests.post(VOYAGE_URL
-                         + "/voyage/review/" + voyage_id + "/" + uid,
-                         json=rev)
+    resp = await voyage_api.post("/voyage/review/" + voyage_id + "/" + uid,
+                                 json=rev)
     data = resp.json()
     if (not is_status_correct(resp.status_code)):
         raise HTTPException(detail=data["detail"],
@@ -241,15 +252,10 @@ def add_review(voyage_id: str, review: ReviewBase,
 
 
 @router.get("/info/{voyage_id}")
-def get_voyage_info(voyage_id: str, token: Optional[str] = Header(None)):
+async def get_voyage_info(voyage_id: str, token: Optional[str] = Header(None)):
     """
     Return The info of voyage asked
     """
-    caller_id = validate_token(token)
-    resp = requests.get(VOYAGE_URL
-                        + "/voyage/info/" + voyage_id + '/' + caller_id)
-    data = resp.json()
-    if (not is_status_correct(resp.status_code)):
-        raise HTTPException(detail=data["detail"],
-                            status_code=resp.status_code)
-    return data
+    caller_id = await validate_token(token)
+    return await proxy(voyage_api, "GET",
+                       "/voyage/info/" + voyage_id + '/' + caller_id)
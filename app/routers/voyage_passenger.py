@@ -1,21 +1,22 @@
 from typing import Optional
 from fastapi import APIRouter, Header
 from fastapi.exceptions import HTTPException
-from dotenv import load_dotenv
-import os
+from app.config import env
 from app.schemas.complaint import ComplaintBase, ReviewBase
 from app.schemas.voyage_schema import SearchVoyageBase
-import requests
 from fastapi.encoders import jsonable_encoder
 from ..services.validation_services import validate_req_passenger_and_get_uid
 from ..services.validation_services import validate_token
 from app.services.rabbit_services import push_metric
+from app.services.concurrency_services import map_bounded, Aggregation
+from app.services.upstream_services import payments_api, voyage_api
+from app.services.proxy_services import proxy
+from app.services.geo_services import driver_index
+from app.services.card_services import driver_card
+from app.services.ranking_services import califications, price_of, rank
 
-
-load_dotenv()
-VOYAGE_URL = os.getenv("VOYAGE_URL")
-USERS_URL = os.getenv("USERS_URL")
-PAYMENTS_URL = os.getenv("PAYMENTS_URL")
+SEARCH_CONCURRENCY = env("SEARCH_CONCURRENCY", 10, int)
+SEARCH_DRIVER_TIMEOUT = env("SEARCH_DRIVER_TIMEOUT", 2.0, float)
 
 
 router = APIRouter(
@@ -29,13 +30,12 @@ def is_status_correct(status_code):
 
 
 @router.post('/vip/subscription')
-def passenger_subscribes_to_vip(token: Optional[str] = Header(None)):
+async def passenger_subscribes_to_vip(token: Optional[str] = Header(None)):
     """
     A Passenger subscribes to VIP Package.
     """
-    uid = validate_req_passenger_and_get_uid(token)
-    resp = requests.post(VOYAGE_URL
-                         + "/voyage/passenger/vip/"+uid+"/true")
+    uid = await validate_req_passenger_and_get_uid(token)
+    resp = await voyage_api.post("/voyage/passenger/vip/"+uid+"/true")
     data = resp.json()
     if (not is_status_correct(resp.status_code)):
         raise HTTPException(detail=data["detail"],
@@ -44,13 +44,12 @@ def passenger_subscribes_to_vip(token: Optional[str] = Header(None)):
 
 
 @router.post('/vip/unsubscription')
-def passenger_unsubscribes_to_vip(token: Optional[str] = Header(None)):
+async def passenger_unsubscribes_to_vip(token: Optional[str] = Header(None)):
     """
     A Passenger unsubscribes to VIP Package.
     """
-    uid = validate_req_passenger_and_get_uid(token)
-    resp = requests.post(VOYAGE_URL
-                         + "/voyage/passenger/vip/"+uid+"/false")
+    uid = await validate_req_passenger_and_get_uid(token)
+    resp = await voyage_api.post("/voyage/passenger/vip/"+uid+"/false")
     data = resp.json()
     if (not is_status_correct(resp.status_code)):
         raise HTTPException(detail=data["detail"],
@@ -58,53 +57,70 @@ def passenger_unsubscribes_to_vip(token: Optional[str] = Header(None)):
     return data
 
 
+def set_location(data, body):
+    data["location"] = body['location']
+
+
+async def get_driver_card(id_driver, caller_id, prices):
+    """
+    Driver card with prices and location added. Returns None when the
+    driver can't be offered.
+
+    The location comes from the gateway index when the driver reported it
+    recently, and from the voyage service otherwise.
+    """
+    location = driver_index.point(id_driver)
+    parts = Aggregation().required(driver_card(id_driver, caller_id),
+                                   parsed=True)
+    if location is None:
+        parts.required(voyage_api.get("/voyage/driver/location/" + id_driver),
+                       set_location)
+    try:
+        driver_profile = await parts.run()
+    except HTTPException:
+        return None
+    if driver_profile["is_blocked"]:
+        return None
+    if location is not None:
+        driver_profile["location"] = location
+    if "calification" in driver_profile:
+        califications.set(id_driver, driver_profile["calification"])
+    driver_profile["prices"] = prices
+    return driver_profile
+
+
 @router.post('/search')
 async def start_searching(voyage: SearchVoyageBase,
                           token: Optional[str] = Header(None)):
     """
-    Passenger Search For All Nearest Drivers
+    Passenger Search For All Nearest Drivers, best ranked first
     """
-    caller_id = validate_req_passenger_and_get_uid(token)
+    caller_id = await validate_req_passenger_and_get_uid(token)
 
     voyage_body = jsonable_encoder(voyage)
 
     voyage_body["passenger_id"] = caller_id
 
-    resp = requests.post(VOYAGE_URL+"/voyage/passenger/search",
-                         json=voyage_body)
+    resp = await voyage_api.post("/voyage/passenger/search",
+                                 json=voyage_body)
     data = resp.json()
     if (not is_status_correct(resp.status_code)):
         raise HTTPException(detail=data["detail"],
                             status_code=resp.status_code)
 
-    response = {}
-
-    for id_driver in data:
-        if (id_driver == caller_id):
-            continue
-        req0 = requests.get(USERS_URL + "/users/" +
-                            id_driver + "/" + caller_id)
-        driver_profile = req0.json()
-        if (not is_status_correct(req0.status_code) or
-                driver_profile["is_blocked"]):
-            continue
-        req1 = requests.get(USERS_URL+"/users/"+id_driver+"/profile/picture")
-        if is_status_correct(req1.status_code):
-            driver_profile["profile_picture"] = req1.json().get("img")
-        calification = requests.get(VOYAGE_URL + "/voyage/calification/" +
-                                    id_driver + "/true")
-        if is_status_correct(calification.status_code):
-            calification_res = calification.json()['calification']
-            if (calification_res == 'No Calification'):
-                driver_profile["calification"] = 4.5
-            else:
-                driver_profile["calification"] = calification_res
-        driver_profile["prices"] = data.get(id_driver)
-        loc = requests.get(VOYAGE_URL + "/voyage/driver/location/" + id_driver)
-        driver_profile["location"] = loc.json()['location']
-        response[id_driver] = driver_profile
-
-    return response
+    async def enrich(id_driver):
+        return await get_driver_card(id_driver, caller_id,
+                                     data.get(id_driver))
+
+    init = voyage.init
+    drivers = rank([(id_driver, driver_index.point(id_driver),
+                     califications.get(id_driver),
+                     price_of(data.get(id_driver)))
+                    for id_driver in data if id_driver != caller_id],
+                   init.latitude, init.longitude)
+    cards = await map_bounded(enrich, drivers, SEARCH_CONCURRENCY,
+                              SEARCH_DRIVER_TIMEOUT)
+    return dict(cards)
 
 
 @router.post('/search/{id_driver}')
@@ -113,14 +129,14 @@ async def ask_for_voyage(id_driver: str, voyage: SearchVoyageBase,
     """
     Passenger Chose a Driver.
     """
-    uid = validate_req_passenger_and_get_uid(token)
+    uid = await validate_req_passenger_and_get_uid(token)
 
     voyage_body = jsonable_encoder(voyage)
 
     voyage_body["passenger_id"] = uid
 
-    resp = requests.post(VOYAGE_URL+"/voyage/passenger/search/"+id_driver,
-                         json=voyage_body)
+    resp = await voyage_api.post("/voyage/passenger/search/"+id_driver,
+                                 json=voyage_body)
     data = resp.json()
     if (not is_status_correct(resp.status_code)):
         raise HTTPException(detail=data["detail"],
@@ -128,7 +144,7 @@ async def ask_for_voyage(id_driver: str, voyage: SearchVoyageBase,
 
     price = float(data.get("final_price"))
     voyage_id = data.get("voyage_id")
-    resp = requests.get(PAYMENTS_URL+"/balance/"+uid)
+    resp = await payments_api.get("/balance/"+uid)
     balance_data = resp.json()
     if (not is_status_correct(resp.status_code)):
         raise HTTPException(detail=balance_data["detail"],
@@ -136,15 +152,13 @@ async def ask_for_voyage(id_driver: str, voyage: SearchVoyageBase,
     current = float(balance_data['balance'])
 
     if price > current:
-        resp = requests.post(VOYAGE_URL
-                             + "/voyage/passenger/confirm/" + voyage_id
-                             + "/" + uid + "/false")
+        resp = await voyage_api.post("/voyage/passenger/confirm/" + voyage_id
+                                     + "/" + uid + "/false")
         raise HTTPException(detail="Not Enough Money",
                             status_code=400)
 
-    resp = requests.post(VOYAGE_URL
-                         + "/voyage/passenger/confirm/" + voyage_id
-                         + "/" + uid + "/true")
+    resp = await voyage_api.post("/voyage/passenger/confirm/" + voyage_id
+                                 + "/" + uid + "/true")
 
     confirm_data = resp.json()
     if (not is_status_correct(resp.status_code)):
@@ -155,13 +169,12 @@ async def ask_for_voyage(id_driver: str, voyage: SearchVoyageBase,
 
 
 @router.delete('/search')
-def cancel_search(token: Optional[str] = Header(None)):
+async def cancel_search(token: Optional[str] = Header(None)):
     """
     Client Cancels Voyage Search
     """
-    uid = validate_req_passenger_and_get_uid(token)
-    resp = requests.delete(VOYAGE_URL
-                           + "/voyage/passenger/search/" + uid)
+    uid = await validate_req_passenger_and_get_uid(token)
+    resp = await voyage_api.delete("/voyage/passenger/search/" + uid)
     data = resp.json()
     if (not is_status_correct(resp.status_code)):
         raise HTTPException(detail=data["detail"],
@@ -170,16 +183,15 @@ def cancel_search(token: Optional[str] = Header(None)):
 
 
 @router.post('/complaint/{voyage_id}')
-def add_passanger_complaint(voyage_id: str, complaint: ComplaintBase,
-                            token: Optional[str] = Header(None)):
+async def add_passanger_complaint(voyage_id: str, complaint: ComplaintBase,
+                                  token: Optional[str] = Header(None)):
     """
     Passenger Load A Complaint Of Voyage
     """
-    uid = validate_req_passenger_and_get_uid(token)
-    resp = requests.post(VOYAGE_URL
-                         + "/voyage/passenger/complaint/" +
-                         voyage_id + "/" + uid,
-                         json=jsonable_encoder(complaint))
+    uid = await validate_req_passenger_and_get_uid(token)
+    resp = await voyage_api.post("/voyage/passenger/complaint/" +
+                                 voyage_id + "/" + uid,
+                                 json=jsonable_encoder(complaint))
     data = resp.json()
     if (not is_status_correct(resp.status_code)):
         raise HTTPException(detail=data["detail"],
@@ -188,14 +200,13 @@ def add_passanger_complaint(voyage_id: str, complaint: ComplaintBase,
 
 
 @router.delete('/{voyage_id}')
-def cancel_confirmed_voyage(voyage_id: str,
-                            token: Optional[str] = Header(None)):
+async def cancel_confirmed_voyage(voyage_id: str,
+                                  token: Optional[str] = Header(None)):
     """
     Cancel Voyage Previously Confirmed By Passenger
     """
-    uid = validate_req_passenger_and_get_uid(token)
-    resp = requests.delete(VOYAGE_URL
-                           + "/voyage/" + voyage_id + "/" + uid)
+    uid = await validate_req_passenger_and_get_uid(token)
+    resp = await voyage_api.delete("/voyage/" + voyage_id + "/" + uid)
     data = resp.json()
     if (not is_status_correct(resp.status_code)):
         raise HTTPException(detail=data["detail"],
@@ -203,8 +214,8 @@ def cancel_confirmed_voyage(voyage_id: str,
     if data:
         price = data["amountInEthers"]
         data.update({"amountInEthers": str(price)})
-        resp = requests.post(PAYMENTS_URL+"/deposit",
-                             json=data)
+        resp = await payments_api.post("/deposit",
+                                       json=data)
         status = resp.status_code == 200
         push_metric({"event": "Payment",
                     "status": str(status),
@@ -219,32 +230,25 @@ def cancel_confirmed_voyage(voyage_id: str,
 
 
 @router.get('/last')
-def get_lasts_voyages(token: Optional[str] = Header(None)):
+async def get_lasts_voyages(token: Optional[str] = Header(None)):
     """
     Get last voyages made by passenger
     """
-    uid = validate_req_passenger_and_get_uid(token)
-    resp = requests.get(VOYAGE_URL
-                        + "/voyage/last/" + uid + "/false")
-    data = resp.json()
-    if (not is_status_correct(resp.status_code)):
-        raise HTTPException(detail=data["detail"],
-                            status_code=resp.status_code)
-    return data
+    uid = await validate_req_passenger_and_get_uid(token)
+    return await proxy(voyage_api, "GET", "/voyage/last/" + uid + "/false")
 
 
 @router.post('/review/{voyage_id}')
-def add_review(voyage_id: str, review: ReviewBase,
-               token: Optional[str] = Header(None)):
+async def add_review(voyage_id: str, review: ReviewBase,
+                     token: Optional[str] = Header(None)):
     """
     Add a review from passenger to driver.
     """
-    uid = validate_req_passenger_and_get_uid(token)
+    uid = await validate_req_passenger_and_get_uid(token)
     rev = jsonable_encoder(review)
     rev["by_driver"] = False
-    resp = requests.post(VOYAGE_URL
-                         + "/voyage/review/" + voyage_id + "/" + uid,
-                         json=rev)
+    resp = await voyage_api.post("/voyage/review/" + voyage_id + "/" + uid,
+                                 json=rev)
     data = resp.json()
     if (not is_status_correct(resp.status_code)):
         raise HTTPException(detail=data["detail"],
@@ -253,15 +257,10 @@ def add_review(voyage_id: str, review: ReviewBase,
 
 
 @router.get("/info/{voyage_id}")
-def get_voyage_info(voyage_id: str, token: Optional[str] = Header(None)):
+async def get_voyage_info(voyage_id: str, token: Optional[str] = Header(None)):
     """
     Return The info of voyage asked
     """
-    caller_id = validate_token(token)
-    resp = requests.get(VOYAGE_URL
-                        + "/voyage/info/" + voyage_id + '/' + caller_id)
-    data = resp.json()
-    if (not is_status_correct(resp.status_code)):
-        raise HTTPException(detail=data["detail"],
-                            status_code=resp.status_code)
-    return data
+    caller_id = await validate_token(token)
+    return await proxy(voyage_api, "GET",
+                       "/voyage/info/" + voyage_id + '/' + caller_id)
@@ -0,0 +1,148 @@
+import asyncio
+import threading
+import time
+from bisect import bisect_left
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+
+class Histogram:
+    """
+    Count, sum, min, max and bucket counts of a numeric field.
+    """
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * (len(bounds) + 1)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.buckets[bisect_left(self.bounds, value)] += 1
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+            "bounds": list(self.bounds),
+            "buckets": self.buckets
+        }
+
+
+class MetricsAggregator:
+    """
+    Folds repetitive metric events into one summary message.
+
+    Events are keyed by their "event" name and the rest of their fields as
+    labels, and counted. Fields listed in `value_fields` (e.g. the payment
+    price) feed a histogram instead of becoming labels. Events named in
+    `passthrough` are not folded and keep their own message. A summary is
+    emitted every `interval` seconds, or earlier once `max_events` events
+    were folded.
+    """
+
+    def __init__(self, emit, interval=10.0, max_events=10000,
+                 passthrough=("Voyage",), value_fields=("price",),
+                 bounds=DEFAULT_BUCKETS, clock=time.time):
+        self.emit = emit
+        self.interval = interval
+        self.max_events = max_events
+        self.passthrough = set(passthrough)
+        self.value_fields = set(value_fields)
+        self.bounds = tuple(sorted(bounds))
+        self.clock = clock
+        self.folded = 0
+        self.summaries = 0
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._start = self.clock()
+        self._events = 0
+        self._counters = {}
+        self._histograms = {}
+
+    def add(self, data):
+        """
+        Fold an event. Returns False if it must be sent on its own.
+        """
+        event = data.get("event")
+        if event is None or event in self.passthrough:
+            return False
+        labels = []
+        values = []
+        for field, value in data.items():
+            if field == "event":
+                continue
+            if field in self.value_fields:
+                try:
+                    values.append((field, float(value)))
+                    continue
+                except (TypeError, ValueError):
+                    pass
+            labels.append((field, str(value)))
+        key = (event, tuple(sorted(labels)))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            for field, value in values:
+                histogram = self._histograms.get((key, field))
+                if histogram is None:
+                    histogram = Histogram(self.bounds)
+                    self._histograms[(key, field)] = histogram
+                histogram.observe(value)
+            self._events += 1
+            self.folded += 1
+            full = self._events >= self.max_events
+        if full:
+            self.flush()
+        return True
+
+    def flush(self):
+        """
+        Emit the summary of what was folded since the last flush.
+        """
+        with self._lock:
+            if not self._events:
+                self._start = self.clock()
+                return None
+            summary = {
+                "event": "Summary",
+                "start_time": self._start,
+                "end_time": self.clock(),
+                "counters": [
+                    {"event": event, "labels": dict(labels), "count": count}
+                    for (event, labels), count in self._counters.items()],
+                "histograms": [
+                    {"event": event, "labels": dict(labels), "field": field,
+                     **histogram.to_dict()}
+                    for ((event, labels), field), histogram
+                    in self._histograms.items()]
+            }
+            self._reset()
+            self.summaries += 1
+        self.emit(summary)
+        return summary
+
+    async def run(self):
+        """
+        Flush every `interval` seconds until cancelled.
+        """
+        while True:
+            await asyncio.sleep(self.interval)
+            self.flush()
+
+    def stats(self):
+        return {
+            "folded": self.folded,
+            "summaries": self.summaries,
+            "pending": self._events,
+            "keys": len(self._counters)
+        }
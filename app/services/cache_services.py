@@ -0,0 +1,182 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Bounded in-process cache with per-entry expiry and LRU eviction.
+
+    Entries older than `ttl` seconds are treated as missing. When the
+    cache holds `maxsize` entries the least recently used one is evicted.
+    """
+
+    def __init__(self, maxsize, ttl, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        entry = self._data.get(key)
+        return entry is not None and entry[0] > self.clock()
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        expires, value = entry
+        if expires <= self.clock():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        if self.maxsize <= 0:
+            return
+        expires = self.clock() + (self.ttl if ttl is None else ttl)
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def invalidate_if(self, predicate):
+        """
+        Drop every entry whose value matches `predicate`.
+        """
+        keys = [key for key, (_, value) in self._data.items()
+                if predicate(value)]
+        for key in keys:
+            del self._data[key]
+        return len(keys)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0
+        }
+
+
+class RefreshingCache:
+    """
+    Async cache of loaded values with stale-while-revalidate.
+
+    A value is fresh for `ttl` seconds and then served stale for up to
+    `stale_ttl` more seconds while a single background reload runs.
+    Concurrent misses for a key share one call to the loader. Failed loads
+    are never cached: waiters get the exception and a stale value is kept.
+    A load that was running when its key got invalidated or set isn't
+    cached either. With `maxsize` the oldest loaded keys are dropped first.
+    """
+
+    def __init__(self, ttl, stale_ttl=0, maxsize=None, clock=time.monotonic):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.maxsize = maxsize
+        self.clock = clock
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.refreshes = 0
+        self.errors = 0
+        self._entries = {}
+        self._inflight = {}
+
+    async def get(self, key, loader):
+        entry = self._entries.get(key)
+        now = self.clock()
+        if entry is not None:
+            loaded_at, value = entry
+            if now < loaded_at + self.ttl:
+                self.hits += 1
+                return value
+            if now < loaded_at + self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                self._load(key, loader)
+                return value
+        self.misses += 1
+        return await asyncio.shield(self._load(key, loader))
+
+    def set(self, key, value):
+        # A load already running must not overwrite what is written here.
+        self._inflight.pop(key, None)
+        self._store(key, value)
+
+    def _store(self, key, value):
+        self._entries.pop(key, None)
+        self._entries[key] = (self.clock(), value)
+        if self.maxsize is not None:
+            while len(self._entries) > self.maxsize:
+                del self._entries[next(iter(self._entries))]
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+        self._inflight.pop(key, None)
+
+    def _load(self, key, loader):
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return task
+        task = asyncio.ensure_future(self._reload(key, loader))
+        self._inflight[key] = task
+        task.add_done_callback(self._done)
+        return task
+
+    async def _reload(self, key, loader):
+        task = asyncio.current_task()
+        try:
+            value = await loader(key)
+        finally:
+            current = self._inflight.get(key) is task
+            if current:
+                del self._inflight[key]
+        self.refreshes += 1
+        if current:
+            self._store(key, value)
+        return value
+
+    def _done(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            self.errors += 1
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "stale_ttl": (self.stale_ttl if math.isfinite(self.stale_ttl)
+                          else None),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "refreshes": self.refreshes,
+            "errors": self.errors
+        }
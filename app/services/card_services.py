@@ -0,0 +1,47 @@
+from app.config import env
+from app.services.cache_services import RefreshingCache
+from app.services.concurrency_services import Aggregation
+from app.services.picture_services import pictures
+from app.services.upstream_services import voyage_api
+from app.services.loader_services import load_user
+
+DRIVER_CARD_TTL = env("DRIVER_CARD_TTL", 15.0, float)
+DRIVER_CARD_MAXSIZE = env("DRIVER_CARD_MAXSIZE", 10000, int)
+
+# Driver profile, picture and calification as offered in searches. Price
+# and location depend on the search and are added on top of a copy.
+driver_cards = RefreshingCache(DRIVER_CARD_TTL, maxsize=DRIVER_CARD_MAXSIZE)
+
+
+def set_calification(data, body):
+    calification_res = body['calification']
+    if (calification_res == 'No Calification'):
+        data["calification"] = 4.5
+    else:
+        data["calification"] = calification_res
+
+
+async def load_driver_card(id_driver, caller_id):
+    return await (
+        Aggregation()
+        .required(load_user(id_driver, caller_id), parsed=True)
+        .optional(pictures.reference(id_driver), parsed=True)
+        .optional(voyage_api.get("/voyage/calification/" +
+                                 id_driver + "/true", idempotent=True),
+                  set_calification)
+        .run())
+
+
+async def driver_card(id_driver, caller_id):
+    """
+    Cached card of a driver, including the blocked flag. The copy
+    returned can be extended freely.
+    """
+    async def load(key):
+        return await load_driver_card(key, caller_id)
+
+    return dict(await driver_cards.get(id_driver, load))
+
+
+def invalidate_driver_card(id_driver):
+    driver_cards.invalidate(id_driver)
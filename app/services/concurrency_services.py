@@ -0,0 +1,124 @@
+import asyncio
+from fastapi.exceptions import HTTPException
+
+
+async def map_bounded(func, items, limit, timeout=None):
+    """
+    Await func(item) for every item, running at most `limit` at once.
+
+    Each call gets its own `timeout` in seconds, counted from the moment it
+    starts running. Calls that fail, time out or return None are left out.
+    Returns a list of (item, result) pairs in the order of `items`.
+    """
+    items = list(items)
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def run(item):
+        async with semaphore:
+            return await asyncio.wait_for(func(item), timeout)
+
+    results = await asyncio.gather(*(run(item) for item in items),
+                                   return_exceptions=True)
+    return [(item, result) for item, result in zip(items, results)
+            if result is not None and not isinstance(result, BaseException)]
+
+
+class SingleFlight:
+    """
+    Concurrent calls with the same key share one run of the first
+    caller's function, and all get its result or exception.
+
+    The shared run happens in the first caller's context, e.g. under its
+    request deadline. Followers don't take on errors for which
+    `shared(error)` is false: they call again, one of them becoming the
+    new leader. The run is not cancelled when its waiters are, so it
+    always completes, even if nobody is left to get the result.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.collapsed = 0
+        self._inflight = {}
+
+    async def do(self, key, func, shared=None):
+        while True:
+            task = self._inflight.get(key)
+            leader = task is None
+            if leader:
+                self.calls += 1
+                task = asyncio.ensure_future(func())
+                self._inflight[key] = task
+                task.add_done_callback(lambda done: self._done(key, done))
+            else:
+                self.collapsed += 1
+            try:
+                return await asyncio.shield(task)
+            except Exception as e:
+                if leader or shared is None or shared(e):
+                    raise
+
+    def _done(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Retrieved here too, in case every waiter was cancelled.
+            task.exception()
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "collapsed": self.collapsed,
+            "in_flight": len(self._inflight)
+        }
+
+
+def is_status_correct(status_code):
+    return status_code//100 == 2
+
+
+def update(data, body):
+    data.update(body)
+
+
+class Aggregation:
+    """
+    Independent upstream reads that make up one response.
+
+    Parts are requested concurrently and merged into the response in the
+    order they were added. A required part that fails raises the same
+    HTTPException the sequential code did; an optional one is skipped.
+    A part added with `parsed=True` is awaited for the body itself rather
+    than an upstream response, e.g. a cached lookup.
+    """
+
+    def __init__(self):
+        self._parts = []
+
+    def required(self, request, merge=update, parsed=False):
+        self._parts.append((request, merge, True, parsed))
+        return self
+
+    def optional(self, request, merge=update, parsed=False):
+        self._parts.append((request, merge, False, parsed))
+        return self
+
+    async def run(self, data=None):
+        data = {} if data is None else data
+        parts, self._parts = self._parts, []
+        responses = await asyncio.gather(*(part[0] for part in parts),
+                                         return_exceptions=True)
+        for (_, merge, required, parsed), resp in zip(parts, responses):
+            if isinstance(resp, BaseException):
+                if required:
+                    raise resp
+                continue
+            if parsed:
+                merge(data, resp)
+                continue
+            if not is_status_correct(resp.status_code):
+                if required:
+                    raise HTTPException(detail=resp.json()["detail"],
+                                        status_code=resp.status_code)
+                continue
+            merge(data, resp.json())
+        return data
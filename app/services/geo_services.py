@@ -0,0 +1,187 @@
+import heapq
+import math
+import time
+from app.config import env
+
+EARTH_RADIUS_M = 6371000.0
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180
+
+DRIVER_INDEX_TTL = env("DRIVER_INDEX_TTL", 120.0, float)
+DRIVER_INDEX_CELL = env("DRIVER_INDEX_CELL", 0.01, float)
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Distance in meters between two points given in degrees.
+    """
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+class DriverIndex:
+    """
+    Latest position of every active driver, bucketed in a lat/lon grid.
+
+    Cells are `cell` degrees wide, so a radius or nearest query only looks
+    at drivers in the cells around the point. Positions older than `ttl`
+    seconds are ignored and swept out from time to time.
+    """
+
+    def __init__(self, cell=DRIVER_INDEX_CELL, ttl=DRIVER_INDEX_TTL,
+                 clock=time.monotonic):
+        self.cell = cell
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._drivers = {}
+        self._cells = {}
+        self._last_sweep = clock()
+
+    def __len__(self):
+        return len(self._drivers)
+
+    def _key(self, latitude, longitude):
+        return (math.floor(latitude / self.cell),
+                math.floor(longitude / self.cell))
+
+    def update(self, uid, latitude, longitude):
+        self.remove(uid)
+        key = self._key(latitude, longitude)
+        self._drivers[uid] = (latitude, longitude, self.clock(), key)
+        self._cells.setdefault(key, set()).add(uid)
+        if self.clock() - self._last_sweep > self.ttl:
+            self.expire()
+
+    def remove(self, uid):
+        entry = self._drivers.pop(uid, None)
+        if entry is None:
+            return
+        members = self._cells.get(entry[3])
+        members.discard(uid)
+        if not members:
+            del self._cells[entry[3]]
+
+    def get(self, uid):
+        """
+        (latitude, longitude) of a driver, or None if unknown or stale.
+        """
+        entry = self._drivers.get(uid)
+        if entry is None or self._stale(entry):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0], entry[1]
+
+    def point(self, uid):
+        """
+        Location of a driver shaped like the voyage service returns it.
+        """
+        position = self.get(uid)
+        if position is None:
+            return None
+        return {"longitude": position[1], "latitude": position[0]}
+
+    def expire(self):
+        self._last_sweep = self.clock()
+        stale = [uid for uid, entry in self._drivers.items()
+                 if self._stale(entry)]
+        for uid in stale:
+            self.remove(uid)
+        return len(stale)
+
+    def _stale(self, entry):
+        return self.clock() - entry[2] > self.ttl
+
+    def _ring(self, center, ring):
+        """
+        Cells at Chebyshev distance `ring` from `center`.
+        """
+        row, col = center
+        if ring == 0:
+            yield center
+            return
+        for d in range(-ring, ring + 1):
+            yield (row - ring, col + d)
+            yield (row + ring, col + d)
+        for d in range(-ring + 1, ring):
+            yield (row + d, col - ring)
+            yield (row + d, col + ring)
+
+    def _scan(self, cells, latitude, longitude):
+        for key in cells:
+            for uid in self._cells.get(key, ()):
+                entry = self._drivers[uid]
+                if not self._stale(entry):
+                    yield uid, haversine(latitude, longitude,
+                                         entry[0], entry[1])
+
+    def _cell_meters(self, latitude):
+        """
+        Smallest side of a cell around `latitude`, in meters.
+        """
+        cos = max(math.cos(math.radians(abs(latitude) + self.cell)), 1e-6)
+        return self.cell * METERS_PER_DEGREE * cos
+
+    def within(self, latitude, longitude, radius):
+        """
+        Drivers within `radius` meters, closest first, as (uid, meters).
+        """
+        rings = math.ceil(radius / self._cell_meters(latitude))
+        center = self._key(latitude, longitude)
+        cells = (key for ring in range(rings + 1)
+                 for key in self._ring(center, ring))
+        found = [(uid, distance) for uid, distance
+                 in self._scan(cells, latitude, longitude)
+                 if distance <= radius]
+        return sorted(found, key=lambda item: item[1])
+
+    def nearest(self, latitude, longitude, k, max_radius=None):
+        """
+        Up to `k` closest drivers as (uid, meters), searching rings of
+        cells outwards until no closer driver can appear.
+        """
+        if k <= 0 or not self._drivers:
+            return []
+        cell_meters = self._cell_meters(latitude)
+        max_rings = math.ceil(max_radius / cell_meters) \
+            if max_radius is not None else None
+        center = self._key(latitude, longitude)
+        best = []
+        ring = 0
+        visited = 0
+        while True:
+            cells = [key for key in self._ring(center, ring)
+                     if key in self._cells]
+            visited += len(cells)
+            for uid, distance in self._scan(cells, latitude, longitude):
+                if max_radius is not None and distance > max_radius:
+                    continue
+                if len(best) < k:
+                    heapq.heappush(best, (-distance, uid))
+                elif distance < -best[0][0]:
+                    heapq.heapreplace(best, (-distance, uid))
+            covered = ring * cell_meters
+            if len(best) == k and -best[0][0] <= covered:
+                break
+            if max_rings is not None and ring >= max_rings:
+                break
+            if visited >= len(self._cells):
+                break
+            ring += 1
+        return sorted(((uid, -distance) for distance, uid in best),
+                      key=lambda item: item[1])
+
+    def stats(self):
+        return {
+            "drivers": len(self._drivers),
+            "cells": len(self._cells),
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+driver_index = DriverIndex()
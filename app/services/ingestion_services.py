@@ -0,0 +1,130 @@
+import asyncio
+import time
+from fastapi.exceptions import HTTPException
+from app.config import env, as_bool
+from app.services.concurrency_services import map_bounded
+from app.services.upstream_services import voyage_api
+
+LOCATION_INGEST_BUFFERED = env("LOCATION_INGEST_BUFFERED", False, as_bool)
+LOCATION_FLUSH_INTERVAL = env("LOCATION_FLUSH_INTERVAL", 1.0, float)
+LOCATION_FLUSH_BATCH = env("LOCATION_FLUSH_BATCH", 500, int)
+LOCATION_FLUSH_CONCURRENCY = env("LOCATION_FLUSH_CONCURRENCY", 20, int)
+
+
+class LocationBuffer:
+    """
+    Coalesces driver location updates before they reach the voyage service.
+
+    `put` only keeps the newest location per driver and returns right away.
+    Pending locations are sent every `interval` seconds, or as soon as
+    `max_batch` drivers are waiting, with at most `concurrency` requests in
+    flight. A location superseded before its flush is never sent; one whose
+    send fails is retried on the next flush unless a newer one arrived.
+    """
+
+    def __init__(self, send, interval=1.0, max_batch=500, concurrency=20,
+                 clock=time.monotonic):
+        self.send = send
+        self.interval = interval
+        self.max_batch = max_batch
+        self.concurrency = concurrency
+        self.clock = clock
+        self.received = 0
+        self.coalesced = 0
+        self.sent = 0
+        self.failed = 0
+        self.flushes = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._pending = {}
+        self._full = None
+        self._stopping = False
+
+    def __len__(self):
+        return len(self._pending)
+
+    def put(self, uid, location):
+        self.received += 1
+        if uid in self._pending:
+            self.coalesced += 1
+        self._pending[uid] = (location, self.clock())
+        if len(self._pending) >= self.max_batch and self._full is not None:
+            self._full.set()
+
+    async def flush(self):
+        batch, self._pending = self._pending, {}
+        if self._full is not None:
+            self._full.clear()
+        if not batch:
+            return 0
+
+        async def send(uid):
+            await self.send(uid, batch[uid][0])
+            return True
+
+        done = dict(await map_bounded(send, batch, self.concurrency))
+        now = self.clock()
+        self.last_lag = 0.0
+        for uid, (location, received_at) in batch.items():
+            if uid in done:
+                self.sent += 1
+                self.last_lag = max(self.last_lag, now - received_at)
+            else:
+                self.failed += 1
+                self._pending.setdefault(uid, (location, received_at))
+        self.max_lag = max(self.max_lag, self.last_lag)
+        self.flushes += 1
+        return len(done)
+
+    async def run(self):
+        """
+        Flush on the fixed cadence, or early when the buffer fills up,
+        until `stop` is called. The flush in progress is always finished.
+        """
+        self._full = asyncio.Event()
+        if self._stopping:
+            self._full.set()
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+            if self._stopping:
+                return
+
+    def stop(self):
+        """
+        Make `run` return after one last flush.
+        """
+        self._stopping = True
+        if self._full is not None:
+            self._full.set()
+
+    def stats(self):
+        return {
+            "pending": len(self._pending),
+            "received": self.received,
+            "coalesced": self.coalesced,
+            "sent": self.sent,
+            "failed": self.failed,
+            "flushes": self.flushes,
+            "last_flush_lag": self.last_lag,
+            "max_flush_lag": self.max_lag
+        }
+
+
+async def send_location(uid, location):
+    """
+    Forward one location. Only server errors are worth retrying.
+    """
+    resp = await voyage_api.post("/voyage/driver/location/" + uid,
+                                 json=location)
+    if resp.status_code // 100 == 5:
+        raise HTTPException(detail=resp.reason_phrase,
+                            status_code=resp.status_code)
+
+
+location_buffer = LocationBuffer(send_location, LOCATION_FLUSH_INTERVAL,
+                                 LOCATION_FLUSH_BATCH,
+                                 LOCATION_FLUSH_CONCURRENCY)
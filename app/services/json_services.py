@@ -0,0 +1,39 @@
+import json
+from fastapi.responses import JSONResponse
+from app.config import env
+
+# "orjson" or "stdlib"; by default orjson is used when it is installed.
+JSON_BACKEND = env("JSON_BACKEND", "orjson")
+
+try:
+    if JSON_BACKEND != "orjson":
+        raise ImportError(JSON_BACKEND)
+    import orjson
+except ImportError:
+    orjson = None
+
+
+if orjson is not None:
+    BACKEND = "orjson"
+
+    def dumps(obj):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+    loads = orjson.loads
+else:
+    BACKEND = "stdlib"
+
+    def dumps(obj):
+        return json.dumps(obj, ensure_ascii=False, allow_nan=False,
+                          separators=(",", ":")).encode("utf-8")
+
+    loads = json.loads
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    Default response class, rendered with the configured JSON backend.
+    """
+
+    def render(self, content):
+        return dumps(content)
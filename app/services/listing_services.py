@@ -0,0 +1,126 @@
+import base64
+import binascii
+import re
+from fastapi.exceptions import HTTPException
+from fastapi.responses import Response, StreamingResponse
+from app.config import env
+from app.services.json_services import dumps
+from app.services.proxy_services import open_checked
+
+LISTING_PAGE_SIZE = env("LISTING_PAGE_SIZE", 50, int)
+LISTING_MAX_PAGE_SIZE = env("LISTING_MAX_PAGE_SIZE", 500, int)
+
+STRING = rb'"[^"\\]*(?:\\.[^"\\]*)*"'
+# Skip plain values and whole strings up to the next character that
+# matters: brackets, a string cut at the end of the buffer and, between
+# top-level elements only, commas.
+TOP_LEVEL = re.compile(rb'(?:[^"\[\]{},]|' + STRING + rb')*([\[\]{},"])',
+                       re.DOTALL)
+NESTED = re.compile(rb'(?:[^"\[\]{}]|' + STRING + rb')*([\[\]{}"])',
+                    re.DOTALL)
+
+
+async def iter_array(chunks):
+    """
+    Raw bytes of every element of a top-level JSON array, read from an
+    async iterator of byte chunks. Only the element being read is kept in
+    memory.
+    """
+    buf = bytearray()
+    pos = 0
+    depth = 0
+    start = None
+    async for chunk in chunks:
+        buf += chunk
+        while True:
+            match = (NESTED if depth > 1 else TOP_LEVEL).match(buf, pos)
+            if match is None or match.group(1) == b'"':
+                break
+            char = match.group(1)
+            pos = match.end()
+            if char in b'[{':
+                if depth == 0:
+                    if char != b'[':
+                        raise ValueError("listing is not a JSON array")
+                    start = pos
+                depth += 1
+            elif char in b']}':
+                depth -= 1
+                if depth == 0:
+                    item = bytes(buf[start:match.start(1)]).strip()
+                    if item:
+                        yield item
+                    return
+            elif depth == 1:
+                yield bytes(buf[start:match.start(1)]).strip()
+                start = pos
+        if start:
+            del buf[:start]
+            pos -= start
+            start = 0
+    raise ValueError("listing ended before the array was closed")
+
+
+def encode_cursor(offset):
+    return base64.urlsafe_b64encode(str(offset).encode()).decode()
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return 0
+    try:
+        offset = int(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, ValueError):
+        offset = -1
+    if offset < 0:
+        raise HTTPException(detail="Invalid Cursor", status_code=400)
+    return offset
+
+
+async def listing_page(upstream, path, cursor=None, limit=LISTING_PAGE_SIZE):
+    """
+    One page of an upstream listing as {"items": [...], "next_cursor"}.
+
+    The cursor is an opaque position in the listing. The upstream body is
+    read only up to the end of the page, so memory grows with `limit` and
+    not with the collection.
+    """
+    offset = decode_cursor(cursor)
+    limit = max(1, min(limit, LISTING_MAX_PAGE_SIZE))
+    resp = await open_checked(upstream, "GET", path)
+    items = []
+    more = False
+    try:
+        index = 0
+        async for item in iter_array(resp.aiter_bytes()):
+            if index >= offset + limit:
+                more = True
+                break
+            if index >= offset:
+                items.append(item)
+            index += 1
+    except ValueError as e:
+        raise HTTPException(detail=str(e), status_code=502)
+    finally:
+        await resp.aclose()
+    next_cursor = encode_cursor(offset + limit) if more else None
+    body = (b'{"items":[' + b','.join(items) + b'],"next_cursor":' +
+            dumps(next_cursor) + b'}')
+    return Response(body, media_type="application/json")
+
+
+async def listing_export(upstream, path):
+    """
+    Whole upstream listing as NDJSON, one element per line, sent as the
+    upstream body arrives.
+    """
+    resp = await open_checked(upstream, "GET", path)
+
+    async def lines():
+        try:
+            async for item in iter_array(resp.aiter_bytes()):
+                yield item + b"\n"
+        finally:
+            await resp.aclose()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
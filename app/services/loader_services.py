@@ -0,0 +1,179 @@
+import asyncio
+from contextvars import ContextVar
+from fastapi.exceptions import HTTPException
+from app.config import env
+from app.services.upstream_services import users_api
+
+# "request": batch and memoize lookups within one request.
+# "global": batch lookups from all concurrent requests, without memoizing.
+USER_BATCH_SCOPE = env("USER_BATCH_SCOPE", "request")
+USER_BATCH_SIZE = env("USER_BATCH_SIZE", 50, int)
+USER_BATCH_WINDOW = env("USER_BATCH_WINDOW", 0.0, float)
+USER_BATCH_CONCURRENCY = env("USER_BATCH_CONCURRENCY", 10, int)
+
+_loaders = ContextVar("loaders", default=None)
+_shared = {}
+totals = {}
+
+
+def is_status_correct(status_code):
+    return status_code//100 == 2
+
+
+class BatchLoader:
+    """
+    Loads keys in batches, DataLoader style.
+
+    Keys asked for during the same event-loop tick, or within `window`
+    seconds of the first one, are handed together to `batch(keys)`, at
+    most `max_batch` at a time. `batch` returns {key: value}, where the
+    value may be the exception to raise for that key. A key asked for
+    twice in a batch is loaded once. With `cache` every key is loaded at
+    most once for the life of the loader, unless its load failed.
+    """
+
+    def __init__(self, name, batch, max_batch=USER_BATCH_SIZE,
+                 window=USER_BATCH_WINDOW, cache=False):
+        self.name = name
+        self.batch = batch
+        self.max_batch = max(1, max_batch)
+        self.window = window
+        self._cache = {} if cache else None
+        self._queue = {}
+        self._handle = None
+        self._stats = totals.setdefault(
+            name, {"loads": 0, "batches": 0, "keys": 0})
+
+    async def load(self, key):
+        self._stats["loads"] += 1
+        future = None
+        if self._cache is not None:
+            future = self._cache.get(key)
+        if future is None:
+            future = self._queue.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._queue[key] = future
+            if self._cache is not None:
+                self._cache[key] = future
+            self._schedule()
+        return await asyncio.shield(future)
+
+    def _schedule(self):
+        if self._handle is not None:
+            return
+        loop = asyncio.get_running_loop()
+        if self.window > 0:
+            self._handle = loop.call_later(self.window, self._dispatch)
+        else:
+            self._handle = loop.call_soon(self._dispatch)
+
+    def _dispatch(self):
+        self._handle = None
+        queue, self._queue = self._queue, {}
+        keys = list(queue)
+        for start in range(0, len(keys), self.max_batch):
+            chunk = keys[start:start + self.max_batch]
+            self._stats["batches"] += 1
+            self._stats["keys"] += len(chunk)
+            asyncio.ensure_future(self._run(chunk, queue))
+
+    async def _run(self, keys, futures):
+        try:
+            results = await self.batch(keys)
+        except Exception as e:
+            results = {key: e for key in keys}
+        for key in keys:
+            future = futures[key]
+            if future.done():
+                continue
+            value = results.get(key, KeyError(key))
+            if not isinstance(value, BaseException):
+                future.set_result(value)
+                continue
+            future.set_exception(value)
+            # Retrieved here too, in case every waiter was cancelled.
+            future.exception()
+            if self._cache is not None and self._cache.get(key) is future:
+                del self._cache[key]
+
+
+def loader(name, batch):
+    """
+    The `name` loader of the current request, or the one shared by all
+    requests with USER_BATCH_SCOPE=global and outside requests.
+    """
+    scope = _loaders.get()
+    if scope is None or USER_BATCH_SCOPE == "global":
+        scope = _shared
+    found = scope.get(name)
+    if found is None:
+        found = scope[name] = BatchLoader(name, batch,
+                                          cache=scope is not _shared)
+    return found
+
+
+async def each_bounded(fetch, keys, limit=USER_BATCH_CONCURRENCY):
+    """
+    Batch made of single calls, at most `limit` at once, for upstreams
+    without a bulk read.
+    """
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def run(key):
+        async with semaphore:
+            return await fetch(key)
+
+    results = await asyncio.gather(*(run(key) for key in keys),
+                                   return_exceptions=True)
+    return dict(zip(keys, results))
+
+
+async def fetch_user(key):
+    id_user, caller_id = key
+    resp = await users_api.get("/users/" + id_user + "/" + caller_id)
+    data = resp.json()
+    if (not is_status_correct(resp.status_code)):
+        raise HTTPException(detail=data["detail"],
+                            status_code=resp.status_code)
+    return data
+
+
+async def fetch_users(keys):
+    # The users service reads one user per call.
+    return await each_bounded(fetch_user, keys)
+
+
+async def load_user(id_user, caller_id):
+    """
+    User body as seen by `caller_id`, batched with the other lookups made
+    at the same time.
+    """
+    return await loader("users", fetch_users).load((id_user, caller_id))
+
+
+class LoaderMiddleware:
+    """
+    Give every incoming HTTP request its own set of loaders.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        token = _loaders.set({})
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _loaders.reset(token)
+
+
+def stats():
+    return {
+        "scope": USER_BATCH_SCOPE,
+        "max_batch": USER_BATCH_SIZE,
+        "window": USER_BATCH_WINDOW,
+        "loaders": totals
+    }
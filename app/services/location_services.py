@@ -0,0 +1,172 @@
+import asyncio
+from fastapi.exceptions import HTTPException
+from app.config import env
+from app.services.json_services import dumps
+from app.services.resilience_services import budget
+from app.services.upstream_services import voyage_api
+
+LOCATION_POLL_INTERVAL = env("LOCATION_POLL_INTERVAL", 2.0, float)
+LOCATION_KEEPALIVE = env("LOCATION_KEEPALIVE", 15.0, float)
+
+END = object()
+
+
+def sse(event, data):
+    return "event: " + event + "\ndata: " + dumps(data).decode() + "\n\n"
+
+
+def diff(previous, current):
+    """
+    Top-level keys of `current` whose value changed since `previous`.
+    """
+    if not isinstance(previous, dict) or not isinstance(current, dict):
+        return current if current != previous else None
+    return {key: value for key, value in current.items()
+            if previous.get(key) != value} or None
+
+
+class VoyageFeed:
+    """
+    Polls the location of one voyage and hands every change to the
+    subscribers' queues. Each queue only keeps the latest location.
+    """
+
+    def __init__(self, hub, voyage_id, uid, last):
+        self.hub = hub
+        self.voyage_id = voyage_id
+        self.uid = uid
+        self.last = last
+        self.subscribers = set()
+        self.task = None
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=1)
+        self.subscribers.add(queue)
+        if self.task is None:
+            self.task = asyncio.ensure_future(self._poll())
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+        if not self.subscribers:
+            self.stop()
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        self.detach()
+
+    def detach(self):
+        if self.hub._feeds.get(self.voyage_id) is self:
+            del self.hub._feeds[self.voyage_id]
+
+    def publish(self, item):
+        for queue in self.subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(item)
+
+    async def _poll(self):
+        with budget(None):
+            await self._watch()
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.hub.interval)
+            self.hub.polls += 1
+            try:
+                data = await self.hub.fetch(self.voyage_id, self.uid)
+            except HTTPException as e:
+                if e.status_code // 100 == 4:
+                    self.publish(END)
+                    self.detach()
+                    return
+                continue
+            except Exception:
+                continue
+            if data != self.last:
+                self.last = data
+                self.publish(data)
+
+
+class LocationHub:
+    """
+    Streams driver locations of active voyages to any number of clients.
+
+    There is at most one upstream poller per voyage, shared by all of its
+    subscribers, and it stops when the last subscriber leaves or the voyage
+    service stops answering for the voyage (4xx). Subscribers get the full
+    location first and then only the fields that changed.
+    """
+
+    def __init__(self, fetch, interval=2.0, keepalive=15.0):
+        self.fetch = fetch
+        self.interval = interval
+        self.keepalive = keepalive
+        self.polls = 0
+        self.events = 0
+        self._feeds = {}
+
+    async def stream(self, voyage_id, uid, first):
+        """
+        Server-Sent Events for `voyage_id`, starting from the already
+        authorized location `first`.
+        """
+        feed = self._feeds.get(voyage_id)
+        if feed is None:
+            feed = VoyageFeed(self, voyage_id, uid, first)
+            self._feeds[voyage_id] = feed
+        queue = feed.subscribe()
+        last = first
+        try:
+            self.events += 1
+            yield sse("location", first)
+            while True:
+                try:
+                    item = await asyncio.wait_for(queue.get(),
+                                                  self.keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if item is END:
+                    yield sse("end", {"voyage_id": voyage_id})
+                    return
+                delta = diff(last, item)
+                last = item
+                if delta is not None:
+                    self.events += 1
+                    yield sse("location", delta)
+        finally:
+            feed.unsubscribe(queue)
+
+    def close(self):
+        for feed in list(self._feeds.values()):
+            feed.publish(END)
+            feed.stop()
+
+    def stats(self):
+        return {
+            "voyages": len(self._feeds),
+            "subscribers": sum(len(feed.subscribers)
+                               for feed in self._feeds.values()),
+            "polls": self.polls,
+            "events": self.events
+        }
+
+
+def is_status_correct(status_code):
+    return status_code//100 == 2
+
+
+async def fetch_location(voyage_id, uid):
+    resp = await voyage_api.get("/voyage/location/" + voyage_id + '/' + uid)
+    data = resp.json()
+    if (not is_status_correct(resp.status_code)):
+        raise HTTPException(detail=data["detail"],
+                            status_code=resp.status_code)
+    return data
+
+
+location_hub = LocationHub(fetch_location, LOCATION_POLL_INTERVAL,
+                           LOCATION_KEEPALIVE)
@@ -0,0 +1,263 @@
+import os
+import threading
+
+SEGMENT_SUFFIX = ".log"
+CURSOR_FILE = "cursor"
+
+
+class Outbox:
+    """
+    Durable, append-only log of message bodies split in segment files.
+
+    Bodies are stored one per line. `read` returns the oldest records that
+    were not committed yet and `commit` moves the persisted cursor past
+    them, so after a restart or a broker outage the backlog is replayed
+    in order. Appends are flushed to the OS right away and fsynced in
+    batches by `sync`, called from the publisher thread. Segments that are
+    fully committed are deleted; when the log grows past `max_bytes` the
+    oldest segments are dropped even if they were not delivered.
+
+    Safe to share between the threads that append and the one that reads.
+    The file reads of `read` and the fsyncs of `sync` run outside the
+    internal lock, so they never hold up an `append`.
+    """
+
+    durable = True
+
+    def __init__(self, directory, segment_bytes=1024 * 1024,
+                 max_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max(max_bytes, segment_bytes)
+        self.dropped = 0
+        self.syncs = 0
+        self._segments = None
+        self._sizes = {}
+        self._file = None
+        self._cursor = (0, 0)
+        self._read_end = None
+        self._pending = 0
+        self._dirty = False
+        self._unsynced = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            self._open()
+            return self._pending
+
+    def full(self):
+        with self._lock:
+            self._open()
+            return sum(self._sizes.values()) >= self.max_bytes
+
+    def append(self, body):
+        with self._lock:
+            self._open()
+            if self._sizes[self._segments[-1]] >= self.segment_bytes:
+                self._rotate()
+            data = (body + "\n").encode()
+            self._file.write(data)
+            self._file.flush()
+            self._sizes[self._segments[-1]] += len(data)
+            self._pending += 1
+            self._dirty = True
+
+    def read(self, count):
+        """
+        Up to `count` uncommitted bodies, oldest first.
+        """
+        with self._lock:
+            self._open()
+            seq, offset = self._cursor
+            # Only what was appended so far is read, so the files can be
+            # read without the lock while appends go on.
+            plan = [(segment, offset if segment == seq else 0,
+                     self._sizes[segment])
+                    for segment in self._segments if segment >= seq]
+        bodies = []
+        read_end = None
+        for segment, start, end in plan:
+            if len(bodies) >= count:
+                break
+            try:
+                f = open(self._path(segment), "rb")
+            except FileNotFoundError:
+                # Dropped in the meantime to make room.
+                break
+            with f:
+                f.seek(start)
+                while len(bodies) < count and f.tell() < end:
+                    line = f.readline()
+                    if not line.endswith(b"\n"):
+                        break
+                    bodies.append(line[:-1].decode())
+                read_end = (segment, f.tell())
+        with self._lock:
+            self._read_end = read_end
+        return bodies
+
+    def commit(self, count):
+        """
+        Mark the `count` bodies returned by the last `read` as delivered.
+        """
+        with self._lock:
+            if self._read_end is None:
+                return
+            if self._read_end > self._cursor:
+                self._cursor = self._read_end
+                self._pending = max(0, self._pending - count)
+                self._save_cursor()
+            self._read_end = None
+            self._compact()
+
+    def drop_oldest(self):
+        """
+        Delete the oldest segment to make room, returning how many
+        undelivered records were lost.
+        """
+        with self._lock:
+            self._open()
+            if len(self._segments) == 1:
+                self._rotate()
+            segment = self._segments[0]
+            lost = self._count(segment, self._cursor) \
+                if segment >= self._cursor[0] else 0
+            self._remove(segment)
+            if self._cursor[0] <= segment:
+                self._cursor = (self._segments[0], 0)
+                self._save_cursor()
+            self._pending = max(0, self._pending - lost)
+            self.dropped += lost
+            return lost
+
+    def sync(self):
+        """
+        fsync the appends made since the last call.
+        """
+        with self._lock:
+            fds, self._unsynced = self._unsynced, []
+            if self._file is not None and self._dirty:
+                self._dirty = False
+                fds.append(os.dup(self._file.fileno()))
+        if not fds:
+            return
+        try:
+            for fd in fds:
+                os.fsync(fd)
+        finally:
+            for fd in fds:
+                os.close(fd)
+        self.syncs += 1
+
+    def close(self):
+        self.sync()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                self._segments = None
+
+    def stats(self):
+        with self._lock:
+            self._open()
+            return {
+                "pending": self._pending,
+                "segments": len(self._segments),
+                "bytes": sum(self._sizes.values()),
+                "max_bytes": self.max_bytes,
+                "dropped": self.dropped,
+                "syncs": self.syncs
+            }
+
+    def _path(self, segment):
+        return os.path.join(self.directory,
+                            "%020d%s" % (segment, SEGMENT_SUFFIX))
+
+    def _open(self):
+        if self._segments is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._segments = sorted(
+            int(name[:-len(SEGMENT_SUFFIX)])
+            for name in os.listdir(self.directory)
+            if name.endswith(SEGMENT_SUFFIX))
+        self._cursor = self._load_cursor()
+        if self._cursor[0] not in self._segments:
+            later = [seq for seq in self._segments if seq > self._cursor[0]]
+            if not later:
+                later = [max(1, self._cursor[0])]
+                self._segments.append(later[0])
+            self._cursor = (later[0], 0)
+        for segment in self._segments:
+            self._sizes[segment] = self._repair(segment)
+        self._file = open(self._path(self._segments[-1]), "ab")
+        self._pending = sum(self._count(segment, self._cursor)
+                            for segment in self._segments
+                            if segment >= self._cursor[0])
+
+    def _repair(self, segment):
+        """
+        Cut a record left half written by a crash.
+        """
+        path = self._path(segment)
+        with open(path, "ab+") as f:
+            f.seek(0)
+            data = f.read()
+            end = data.rfind(b"\n") + 1
+            if end != len(data):
+                f.truncate(end)
+        return end
+
+    def _count(self, segment, cursor):
+        seq, offset = cursor
+        with open(self._path(segment), "rb") as f:
+            if segment == seq:
+                f.seek(offset)
+            return f.read().count(b"\n")
+
+    def _rotate(self):
+        # The closed segment is fsynced by the next `sync`, not here on
+        # the appending thread.
+        if self._dirty:
+            self._unsynced.append(os.dup(self._file.fileno()))
+            self._dirty = False
+        self._file.close()
+        segment = self._segments[-1] + 1
+        self._segments.append(segment)
+        self._sizes[segment] = 0
+        self._file = open(self._path(segment), "ab")
+
+    def _remove(self, segment):
+        self._segments.remove(segment)
+        self._sizes.pop(segment, None)
+        try:
+            os.remove(self._path(segment))
+        except FileNotFoundError:
+            pass
+
+    def _compact(self):
+        seq, offset = self._cursor
+        for segment in list(self._segments[:-1]):
+            done = segment < seq or (
+                segment == seq and offset >= self._sizes[segment])
+            if not done:
+                break
+            self._remove(segment)
+        if self._cursor[0] < self._segments[0]:
+            self._cursor = (self._segments[0], 0)
+
+    def _load_cursor(self):
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE)) as f:
+                seq, offset = f.read().split()
+                return (int(seq), int(offset))
+        except (FileNotFoundError, ValueError):
+            return (0, 0)
+
+    def _save_cursor(self):
+        path = os.path.join(self.directory, CURSOR_FILE)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write("%d %d" % self._cursor)
+        os.replace(tmp, path)
@@ -0,0 +1,194 @@
+import hashlib
+import time
+from collections import OrderedDict
+from concurrent.futures.process import BrokenProcessPool
+from fastapi.exceptions import HTTPException
+from app.config import env, as_bool
+from app.services.cache_services import TTLCache
+from app.services.upstream_services import users_api
+from app.services.loader_services import each_bounded, loader
+from app.services.thumbnail_services import make_thumbnail, snap_size
+
+PICTURE_CACHE_BYTES = env("PICTURE_CACHE_BYTES", 32 * 1024 * 1024, int)
+PICTURE_CACHE_USERS = env("PICTURE_CACHE_USERS", 100000, int)
+PICTURE_CACHE_TTL = env("PICTURE_CACHE_TTL", 300.0, float)
+PICTURE_INLINE = env("PICTURE_INLINE", True, as_bool)
+PICTURE_INLINE_SIZE = env("PICTURE_INLINE_SIZE", None, int)
+
+
+def is_status_correct(status_code):
+    return status_code//100 == 2
+
+
+def etag_of(img):
+    return hashlib.sha256(img.encode()).hexdigest()[:32]
+
+
+def picture_url(uid):
+    return "/users/" + uid + "/profile/picture"
+
+
+def matches(if_none_match, etag):
+    """
+    Whether an If-None-Match header value covers `etag`.
+    """
+    if if_none_match is None:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag.strip('"') == etag:
+            return True
+    return False
+
+
+class PictureCache:
+    """
+    Profile pictures by content hash, within a budget of `max_bytes`.
+
+    Users map to the hash of their picture for `ttl` seconds, and each
+    distinct picture is stored once however many users point to it. When
+    the stored pictures go over budget the least recently used ones are
+    evicted; a user whose picture was evicted is fetched again.
+
+    Thumbnails made by `resize` share the same budget, keyed by the hash
+    of the original and the size. Pictures `resize` can't handle are
+    remembered and served full size.
+    """
+
+    def __init__(self, fetch, max_bytes, max_users=100000, ttl=300.0,
+                 resize=None, clock=time.monotonic):
+        self.fetch = fetch
+        self.resize = resize
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.thumbnails = 0
+        self.resize_errors = 0
+        self._owners = TTLCache(max_users, ttl, clock)
+        self._unresizable = TTLCache(max_users, ttl, clock)
+        self._blobs = OrderedDict()
+
+    def _put(self, key, img):
+        if key in self._blobs:
+            self._blobs.move_to_end(key)
+            return
+        size = len(img)
+        if size > self.max_bytes:
+            return
+        self._blobs[key] = img
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, evicted = self._blobs.popitem(last=False)
+            self.bytes -= len(evicted)
+            self.evictions += 1
+
+    def _cached(self, key):
+        if key is None or key not in self._blobs:
+            return None
+        self._blobs.move_to_end(key)
+        return self._blobs[key]
+
+    async def _original(self, uid):
+        etag = self._owners.get(uid)
+        img = self._cached(etag)
+        if img is not None:
+            self.hits += 1
+            return etag, img
+        self.misses += 1
+        img = await self.fetch(uid)
+        etag = etag_of(img)
+        self._put(etag, img)
+        self._owners.set(uid, etag)
+        return etag, img
+
+    async def get(self, uid, size=None):
+        """
+        (etag, img) of the user's picture, downscaled to fit in a `size`
+        square when one is given.
+        """
+        etag, img = await self._original(uid)
+        if size is None or self.resize is None or etag in self._unresizable:
+            return etag, img
+        key = etag + "-" + str(size)
+        thumbnail = self._cached(key)
+        if thumbnail is not None:
+            return key, thumbnail
+        try:
+            thumbnail = await self.resize(img, size)
+        except BrokenProcessPool:
+            # The workers died, not the picture's fault: the next request
+            # gets a new pool.
+            return etag, img
+        except Exception:
+            self.resize_errors += 1
+            self._unresizable.set(etag, True)
+            return etag, img
+        self.thumbnails += 1
+        self._put(key, thumbnail)
+        return key, thumbnail
+
+    async def reference(self, uid):
+        """
+        Picture fields for a profile: where to download it and its ETag,
+        plus the image itself when PICTURE_INLINE is set, as a thumbnail
+        if PICTURE_INLINE_SIZE is.
+        """
+        etag, img = await self.get(uid)
+        fields = {"profile_picture_url": picture_url(uid),
+                  "profile_picture_etag": etag}
+        if PICTURE_INLINE:
+            size = snap_size(PICTURE_INLINE_SIZE)
+            if size is not None:
+                _, img = await self.get(uid, size)
+            fields["profile_picture"] = img
+        return fields
+
+    def invalidate(self, uid):
+        self._owners.pop(uid)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "users": len(self._owners),
+            "pictures": len(self._blobs),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "thumbnails": self.thumbnails,
+            "resize_errors": self.resize_errors,
+            "hit_ratio": self.hits / lookups if lookups else 0.0
+        }
+
+
+async def fetch_one_picture(uid):
+    resp = await users_api.get(picture_url(uid), idempotent=True)
+    data = resp.json()
+    if (not is_status_correct(resp.status_code)):
+        raise HTTPException(detail=data["detail"],
+                            status_code=resp.status_code)
+    if data.get("img") is None:
+        raise HTTPException(detail="Profile Picture Not Found",
+                            status_code=404)
+    return data["img"]
+
+
+async def fetch_pictures(uids):
+    # The users service reads one picture per call.
+    return await each_bounded(fetch_one_picture, uids)
+
+
+async def fetch_picture(uid):
+    return await loader("pictures", fetch_pictures).load(uid)
+
+
+pictures = PictureCache(fetch_picture, PICTURE_CACHE_BYTES,
+                        PICTURE_CACHE_USERS, PICTURE_CACHE_TTL,
+                        make_thumbnail)
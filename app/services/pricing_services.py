@@ -0,0 +1,46 @@
+from fastapi.exceptions import HTTPException
+from app.config import env
+from app.services.cache_services import RefreshingCache
+from app.services.upstream_services import pricing_api
+
+PRICING_CONSTANTS_TTL = env("PRICING_CONSTANTS_TTL", 600.0, float)
+
+CONSTANTS_KEY = "/admin"
+
+# Constants only change through put_constants, so once loaded they are
+# served forever and refreshed in the background every TTL.
+constants_cache = RefreshingCache(PRICING_CONSTANTS_TTL, float("inf"))
+
+
+def is_status_correct(status_code):
+    return status_code//100 == 2
+
+
+async def fetch_constants(path=CONSTANTS_KEY):
+    resp = await pricing_api.get(path)
+    data = resp.json()
+    if (not is_status_correct(resp.status_code)):
+        raise HTTPException(detail=data["detail"],
+                            status_code=resp.status_code)
+    return data
+
+
+async def get_pricing_constants():
+    """
+    Current pricing constants (ConstantsBase fields).
+    """
+    return await constants_cache.get(CONSTANTS_KEY, fetch_constants)
+
+
+def set_pricing_constants(constants):
+    """
+    Write-through after the pricing service accepted new constants.
+    """
+    constants_cache.set(CONSTANTS_KEY, constants)
+
+
+async def warm_pricing_constants():
+    try:
+        await get_pricing_constants()
+    except Exception:
+        pass
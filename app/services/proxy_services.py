@@ -0,0 +1,52 @@
+from fastapi.exceptions import HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from app.services.json_services import loads
+
+# Upstream headers that still describe the body once it is relayed as is.
+FORWARDED_HEADERS = ("content-type", "content-length", "content-encoding",
+                     "etag", "last-modified", "cache-control")
+
+
+def is_status_correct(status_code):
+    return status_code//100 == 2
+
+
+def forwarded_headers(headers):
+    return {name: headers[name] for name in FORWARDED_HEADERS
+            if name in headers}
+
+
+async def open_checked(upstream, method, path, **kwargs):
+    """
+    Open a streamed upstream response, raising the usual HTTPException
+    when it isn't a 2xx.
+    """
+    resp = await upstream.open(method, path, **kwargs)
+    if (not is_status_correct(resp.status_code)):
+        try:
+            data = loads(await resp.aread())
+        finally:
+            await resp.aclose()
+        raise HTTPException(detail=data["detail"],
+                            status_code=resp.status_code)
+    return resp
+
+
+async def proxy(upstream, method, path, **kwargs):
+    """
+    Relay an upstream response without parsing it: the body bytes are
+    streamed to the client with the upstream status and content headers.
+    Non-2xx responses are translated to HTTPException as usual.
+
+    The body is asked for uncompressed: the client never negotiated the
+    encodings httpx would otherwise accept on its behalf.
+    """
+    headers = dict(kwargs.pop("headers", None) or {})
+    headers["Accept-Encoding"] = "identity"
+    resp = await open_checked(upstream, method, path, headers=headers,
+                              **kwargs)
+    return StreamingResponse(resp.aiter_raw(),
+                             status_code=resp.status_code,
+                             headers=forwarded_headers(resp.headers),
+                             background=BackgroundTask(resp.aclose))
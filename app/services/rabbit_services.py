@@ -1,33 +1,372 @@
-import pika
-from dotenv import load_dotenv
-import os
-import json
+import asyncio
+from collections import deque
+from app.config import env, as_bool, as_list
+from app.services.outbox_services import Outbox
+from app.services.aggregator_services import MetricsAggregator
+from app.services.json_services import dumps
+import threading
 
-load_dotenv()
+METRICS_BUFFER_SIZE = env("METRICS_BUFFER_SIZE", 10000, int)
+METRICS_BATCH_SIZE = env("METRICS_BATCH_SIZE", 100, int)
+METRICS_FLUSH_INTERVAL = env("METRICS_FLUSH_INTERVAL", 0.5, float)
+METRICS_OVERFLOW = env("METRICS_OVERFLOW", "drop-oldest")
+METRICS_BLOCK_TIMEOUT = env("METRICS_BLOCK_TIMEOUT", 0.05, float)
+METRICS_OUTBOX_DIR = env("METRICS_OUTBOX_DIR")
+METRICS_OUTBOX_SEGMENT_BYTES = env("METRICS_OUTBOX_SEGMENT_BYTES",
+                                   1024 * 1024, int)
+METRICS_OUTBOX_MAX_BYTES = env("METRICS_OUTBOX_MAX_BYTES",
+                               64 * 1024 * 1024, int)
+METRICS_AGGREGATE = env("METRICS_AGGREGATE", False, as_bool)
+METRICS_AGGREGATE_INTERVAL = env("METRICS_AGGREGATE_INTERVAL", 10.0, float)
+METRICS_AGGREGATE_MAX_EVENTS = env("METRICS_AGGREGATE_MAX_EVENTS", 10000, int)
+METRICS_PASSTHROUGH_EVENTS = env("METRICS_PASSTHROUGH_EVENTS", ["Voyage"],
+                                 as_list)
 
-# Parse CLODUAMQP_URL (fallback to localhost)
-URL = os.getenv("CLOUDAMQP_URL")
-METRICS_QUEUE = os.getenv("METRICS_QUEUE")
+DROP_OLDEST = "drop-oldest"
+BLOCK = "block"
 
-params = pika.URLParameters(URL)
-# params = pika.ConnectionParameters(heartbeat=0,
-#                                    host=URL)
-params.socket_timeout = 5
-params.heartbeat = 0
 
+class PikaTransport:
+    """
+    Publishes message bodies to a queue over a pika BlockingConnection.
 
-connection = pika.BlockingConnection(params)  # Connect to CloudAMQP
-channel = connection.channel()  # start a channel
-channel.queue_declare(queue=METRICS_QUEUE)  # Declare a queue
-# send a message
+    The broker url and queue default to CLOUDAMQP_URL and METRICS_QUEUE,
+    read when the first connection is opened.
+    """
+
+    def __init__(self, url=None, queue=None, heartbeat=60, socket_timeout=5):
+        self.url = url
+        self.queue = queue
+        self.heartbeat = heartbeat
+        self.socket_timeout = socket_timeout
+        self.connection = None
+        self.channel = None
+
+    def connect(self):
+        import pika
+        # Parse CLODUAMQP_URL (fallback to localhost)
+        self.url = self.url or env("CLOUDAMQP_URL", "amqp://localhost")
+        self.queue = self.queue or env("METRICS_QUEUE")
+        params = pika.URLParameters(self.url)
+        params.socket_timeout = self.socket_timeout
+        params.heartbeat = self.heartbeat
+        self.connection = pika.BlockingConnection(params)
+        self.channel = self.connection.channel()
+        self.channel.queue_declare(queue=self.queue)
+
+    def publish(self, bodies):
+        for body in bodies:
+            self.channel.basic_publish(exchange='',
+                                       routing_key=self.queue,
+                                       body=body)
+
+    def idle(self):
+        """
+        Serve heartbeats while there is nothing to publish.
+        """
+        if self.connection is not None:
+            self.connection.process_data_events(0)
+
+    def close(self):
+        connection, self.connection, self.channel = self.connection, None, None
+        if connection is not None and connection.is_open:
+            connection.close()
+
+
+class MemoryBuffer:
+    """
+    Bounded in-memory buffer of message bodies, lost on restart.
+    """
+
+    durable = False
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._queue = deque()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def full(self):
+        return len(self._queue) >= self.maxsize
+
+    def append(self, body):
+        self._queue.append(body)
+
+    def read(self, count):
+        bodies = []
+        while self._queue and len(bodies) < count:
+            bodies.append(self._queue.popleft())
+        return bodies
+
+    def commit(self, count):
+        pass
+
+    def drop_oldest(self):
+        if not self._queue:
+            return 0
+        self._queue.popleft()
+        return 1
+
+    def sync(self):
+        pass
+
+    def close(self):
+        pass
+
+    def stats(self):
+        return {"pending": len(self._queue), "maxsize": self.maxsize}
+
+
+class MetricsPublisher:
+    """
+    Publishes metric events from a background thread.
+
+    Request handlers only append the serialized event to a bounded
+    buffer, in memory or a durable Outbox. The worker drains it in batches
+    of `batch_size` (or every `flush_interval` seconds) and reconnects with
+    exponential backoff when the broker is unreachable. When the buffer is
+    full the `overflow` policy applies: "drop-oldest" discards the oldest
+    events, "block" waits up to `block_timeout` seconds for room and then
+    drops the new event. Calls made on an event loop thread, i.e. from
+    request handlers, never wait: with "block" they drop the new event
+    right away.
+
+    Disk errors of the outbox never reach the caller: they are counted in
+    `disk_errors` and the event is dropped. The worker reads and fsyncs
+    the outbox without holding the lock `put` takes.
+    """
+
+    def __init__(self, transport, maxsize=METRICS_BUFFER_SIZE,
+                 buffer=None, batch_size=METRICS_BATCH_SIZE,
+                 flush_interval=METRICS_FLUSH_INTERVAL,
+                 overflow=METRICS_OVERFLOW,
+                 block_timeout=METRICS_BLOCK_TIMEOUT,
+                 retry_delay=1.0, max_retry_delay=30.0):
+        if overflow not in (DROP_OLDEST, BLOCK):
+            raise ValueError("Unknown overflow policy: " + str(overflow))
+        self.transport = transport
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.published = 0
+        self.batches = 0
+        self.dropped = 0
+        self.failures = 0
+        self.disk_errors = 0
+        self.buffer = MemoryBuffer(maxsize) if buffer is None else buffer
+        self._cond = threading.Condition()
+        self._stopping = threading.Event()
+        self._connected = False
+        self._thread = None
+
+    def put(self, data):
+        """
+        Queue an event for publishing. Returns False if it was dropped.
+        """
+        body = dumps(data).decode()
+        with self._cond:
+            try:
+                if self.buffer.full():
+                    if self.overflow == BLOCK:
+                        self._cond.wait_for(lambda: not self.buffer.full(),
+                                            self._block_timeout())
+                        if self.buffer.full():
+                            self.dropped += 1
+                            return False
+                    else:
+                        self.dropped += self.buffer.drop_oldest()
+                self.buffer.append(body)
+                if len(self.buffer) >= self.batch_size:
+                    self._cond.notify_all()
+            except OSError:
+                self.disk_errors += 1
+                self.dropped += 1
+                return False
+        self.start()
+        return True
+
+    def _block_timeout(self):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return self.block_timeout
+        # Waiting here would stall every request of the worker.
+        return 0
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run,
+                                            name="metrics-publisher",
+                                            daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        """
+        Flush what is buffered, then close the broker connection.
+        """
+        self._stopping.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def pending(self):
+        with self._cond:
+            return len(self.buffer)
+
+    def stats(self):
+        try:
+            stats = self.buffer.stats()
+        except OSError:
+            self.disk_errors += 1
+            stats = {}
+        stats.update({
+            "overflow": self.overflow,
+            "published": self.published,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "failures": self.failures,
+            "disk_errors": self.disk_errors,
+            "connected": self._connected
+        })
+        return stats
+
+    def _take_batch(self):
+        # Disk work is done without the lock: put() takes it on the event
+        # loop thread.
+        try:
+            with self._cond:
+                if not len(self.buffer) and not self._stopping.is_set():
+                    self._cond.wait(self.flush_interval)
+            self.buffer.sync()
+            batch = self.buffer.read(self.batch_size)
+        except OSError:
+            self.disk_errors += 1
+            if self._stopping.wait(self.flush_interval):
+                return None
+            return []
+        if not batch:
+            return None if self._stopping.is_set() else []
+        with self._cond:
+            self._cond.notify_all()
+        return batch
+
+    def _commit(self, batch):
+        try:
+            self.buffer.commit(len(batch))
+        except OSError:
+            self.disk_errors += 1
+        with self._cond:
+            self._cond.notify_all()
+
+    def _sync(self):
+        try:
+            self.buffer.sync()
+        except OSError:
+            self.disk_errors += 1
+
+    def _wait(self, delay):
+        """
+        Sleep between reconnects, still syncing the buffer. Returns True
+        if the publisher is stopping.
+        """
+        while delay > 0:
+            step = min(delay, self.flush_interval)
+            if self._stopping.wait(step):
+                return True
+            self._sync()
+            delay -= step
+        return False
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                break
+            if batch:
+                if not self._publish(batch):
+                    break
+            elif self._connected:
+                try:
+                    self.transport.idle()
+                except Exception:
+                    self._disconnect()
+        self._disconnect()
+        try:
+            self.buffer.close()
+        except OSError:
+            self.disk_errors += 1
+
+    def _publish(self, batch):
+        """
+        Publish a batch, retrying until it is delivered. Returns False if
+        the publisher was stopped first.
+        """
+        delay = self.retry_delay
+        while True:
+            try:
+                if not self._connected:
+                    self.transport.connect()
+                    self._connected = True
+                self.transport.publish(batch)
+            except Exception:
+                self.failures += 1
+                self._disconnect()
+                if self._wait(delay):
+                    if not self.buffer.durable:
+                        self.dropped += len(batch)
+                    return False
+                delay = min(delay * 2, self.max_retry_delay)
+                continue
+            self._commit(batch)
+            self.published += len(batch)
+            self.batches += 1
+            return True
+
+    def _disconnect(self):
+        self._connected = False
+        try:
+            self.transport.close()
+        except Exception:
+            pass
+
+
+def build_buffer():
+    """
+    Durable outbox when METRICS_OUTBOX_DIR is set, memory otherwise.
+    """
+    if not METRICS_OUTBOX_DIR:
+        return None
+    return Outbox(METRICS_OUTBOX_DIR, METRICS_OUTBOX_SEGMENT_BYTES,
+                  METRICS_OUTBOX_MAX_BYTES)
+
+
+publisher = MetricsPublisher(PikaTransport(), buffer=build_buffer())
+
+aggregator = MetricsAggregator(
+    publisher.put, interval=METRICS_AGGREGATE_INTERVAL,
+    max_events=METRICS_AGGREGATE_MAX_EVENTS,
+    passthrough=METRICS_PASSTHROUGH_EVENTS) if METRICS_AGGREGATE else None
 
 
 def push_metric(data):
-    channel.basic_publish(exchange='',
-                          routing_key=METRICS_QUEUE,
-                          body=json.dumps(data))
-    # print("[x] Message sent to consumer")
+    if aggregator is not None and aggregator.add(data):
+        return
+    publisher.put(data)
 
 
 def close_connection():
-    connection.close()
+    if aggregator is not None:
+        aggregator.flush()
+    publisher.stop()
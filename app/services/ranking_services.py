@@ -0,0 +1,93 @@
+import numpy as np
+from app.config import env
+from app.services.cache_services import TTLCache
+from app.services.geo_services import EARTH_RADIUS_M
+
+SEARCH_TOP_K = env("SEARCH_TOP_K", 20, int)
+SEARCH_WEIGHT_DISTANCE = env("SEARCH_WEIGHT_DISTANCE", 1.0, float)
+SEARCH_WEIGHT_CALIFICATION = env("SEARCH_WEIGHT_CALIFICATION", 0.5, float)
+SEARCH_WEIGHT_PRICE = env("SEARCH_WEIGHT_PRICE", 0.5, float)
+CALIFICATION_CACHE_MAXSIZE = env("CALIFICATION_CACHE_MAXSIZE", 10000, int)
+CALIFICATION_CACHE_TTL = env("CALIFICATION_CACHE_TTL", 600.0, float)
+
+califications = TTLCache(CALIFICATION_CACHE_MAXSIZE, CALIFICATION_CACHE_TTL)
+
+
+def haversine_many(latitude, longitude, latitudes, longitudes):
+    """
+    Distance in meters from one point to arrays of points, in degrees.
+    """
+    lat1, lon1 = np.radians(latitude), np.radians(longitude)
+    lat2, lon2 = np.radians(latitudes), np.radians(longitudes)
+    a = (np.sin((lat2 - lat1) / 2) ** 2 +
+         np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def normalize(values):
+    """
+    Scale to [0, 1] over the known values; unknown ones land at 0.5.
+    """
+    known = ~np.isnan(values)
+    scaled = np.full(values.shape, 0.5)
+    if known.any():
+        low, high = values[known].min(), values[known].max()
+        span = high - low
+        scaled[known] = (values[known] - low) / span if span else 0.0
+    return scaled
+
+
+def price_of(prices):
+    """
+    Comparable price out of what the voyage service returns per driver.
+    """
+    if isinstance(prices, (int, float)):
+        return float(prices)
+    if isinstance(prices, dict):
+        if "final_price" in prices:
+            return price_of(prices["final_price"])
+        numbers = [value for value in prices.values()
+                   if isinstance(value, (int, float))]
+        return float(min(numbers)) if numbers else None
+    try:
+        return float(prices)
+    except (TypeError, ValueError):
+        return None
+
+
+def rank(candidates, latitude, longitude, k=SEARCH_TOP_K,
+         weights=(SEARCH_WEIGHT_DISTANCE, SEARCH_WEIGHT_CALIFICATION,
+                  SEARCH_WEIGHT_PRICE)):
+    """
+    Best `k` candidates for a search starting at (latitude, longitude).
+
+    `candidates` are (id, location, calification, price) tuples where any
+    of the last three may be None. Distance, calification and price are
+    scaled over all candidates at once and combined with `weights`; a
+    missing value counts as average. Returns ids, best first. A `k` of 0
+    or less keeps every candidate.
+    """
+    if not candidates:
+        return []
+    ids = [candidate[0] for candidate in candidates]
+    columns = np.array([
+        (location["latitude"], location["longitude"])
+        if location is not None else (np.nan, np.nan)
+        for _, location, _, _ in candidates], dtype=float)
+    scores = np.array([
+        (calification, price) for _, _, calification, price in candidates],
+        dtype=float)
+
+    distance = haversine_many(latitude, longitude,
+                              columns[:, 0], columns[:, 1])
+    weight_distance, weight_calification, weight_price = weights
+    score = (weight_distance * normalize(distance) +
+             weight_calification * (1 - normalize(scores[:, 0])) +
+             weight_price * normalize(scores[:, 1]))
+
+    if 0 < k < len(ids):
+        best = np.argpartition(score, k - 1)[:k]
+    else:
+        best = np.arange(len(ids))
+    best = best[np.argsort(score[best], kind="stable")]
+    return [ids[i] for i in best]
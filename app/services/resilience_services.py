@@ -0,0 +1,220 @@
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from fastapi.exceptions import HTTPException
+from app.config import env
+
+REQUEST_DEADLINE = env("REQUEST_DEADLINE", 15.0, float)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+_deadline = ContextVar("deadline", default=None)
+
+
+def remaining():
+    """
+    Seconds left on the current request budget, or None without one.
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+@contextmanager
+def budget(seconds):
+    """
+    Run the block under a deadline `seconds` from now, never later than
+    an enclosing one. With `seconds` None the block has no deadline, e.g.
+    for background work started from a request.
+    """
+    deadline = None
+    if seconds is not None:
+        deadline = time.monotonic() + seconds
+        outer = _deadline.get()
+        if outer is not None:
+            deadline = min(deadline, outer)
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+class DeadlineExceeded(HTTPException):
+    """
+    504 caused by the caller's request deadline rather than by the
+    upstream service.
+    """
+
+    def __init__(self, detail):
+        super().__init__(detail=detail, status_code=504)
+
+
+def check_deadline(name):
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded("Deadline exceeded before calling " + name)
+    return left
+
+
+def backoff(attempt, base, cap, rng=random.random):
+    """
+    Delay before retry number `attempt` (from 1): exponential, capped at
+    `cap` and with full jitter so that clients do not retry in lockstep.
+    """
+    return rng() * min(cap, base * 2 ** (attempt - 1))
+
+
+class DeadlineMiddleware:
+    """
+    Give every incoming HTTP request REQUEST_DEADLINE seconds for all the
+    upstream calls it makes, however many hops it takes.
+    """
+
+    def __init__(self, app, seconds=REQUEST_DEADLINE):
+        self.app = app
+        self.seconds = seconds if seconds and seconds > 0 else None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        with budget(self.seconds):
+            await self.app(scope, receive, send)
+
+
+class CircuitBreaker:
+    """
+    Fails calls fast while an upstream is unhealthy.
+
+    After `failures` consecutive failures the breaker opens and rejects
+    calls for `reset` seconds. Then a single trial call is let through
+    (half-open): success closes the breaker, failure opens it again.
+    """
+
+    def __init__(self, name, failures=5, reset=30.0, clock=time.monotonic):
+        self.name = name
+        self.threshold = failures
+        self.reset = reset
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self._opened_at = None
+        self._trial = False
+
+    def before(self):
+        """
+        Raise HTTPException 503 if the call must not be attempted.
+        """
+        if self.state == OPEN:
+            if self.clock() - self._opened_at >= self.reset:
+                self.state = HALF_OPEN
+                self._trial = False
+            else:
+                self._reject()
+        if self.state == HALF_OPEN:
+            if self._trial:
+                self._reject()
+            self._trial = True
+
+    def _reject(self):
+        self.rejected += 1
+        raise HTTPException(detail=self.name + " service unavailable",
+                            status_code=503)
+
+    def abandon(self):
+        """
+        The call was cancelled before it said anything about the service.
+        """
+        if self.state == HALF_OPEN:
+            self._trial = False
+
+    def success(self):
+        self.state = CLOSED
+        self.failures = 0
+        self._trial = False
+
+    def failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.threshold:
+            if self.state != OPEN:
+                self.opened += 1
+            self.state = OPEN
+            self._opened_at = self.clock()
+            self._trial = False
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "opened": self.opened,
+            "rejected": self.rejected
+        }
+
+
+class RetryBudget:
+    """
+    Caps retries and hedges to a fraction of the calls being made.
+
+    Every call deposits `ratio` tokens and every extra attempt spends a
+    whole one. `per_second` tokens are added over time so that a quiet
+    service can still retry, and at most `cap` can be saved up.
+    """
+
+    def __init__(self, ratio=0.1, per_second=1.0, cap=10.0,
+                 clock=time.monotonic):
+        self.ratio = ratio
+        self.per_second = per_second
+        self.cap = cap
+        self.clock = clock
+        self.tokens = cap
+        self.exhausted = 0
+        self._updated = clock()
+
+    def _refill(self, amount):
+        now = self.clock()
+        elapsed, self._updated = now - self._updated, now
+        self.tokens = min(self.cap,
+                          self.tokens + amount + elapsed * self.per_second)
+
+    def deposit(self):
+        self._refill(self.ratio)
+
+    def withdraw(self):
+        self._refill(0)
+        if self.tokens < 1:
+            self.exhausted += 1
+            return False
+        self.tokens -= 1
+        return True
+
+    def stats(self):
+        return {"tokens": self.tokens, "exhausted": self.exhausted}
+
+
+class LatencyWindow:
+    """
+    Latencies of the last `size` successful calls.
+    """
+
+    def __init__(self, size=200, min_samples=20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=size)
+
+    def add(self, seconds):
+        self._samples.append(seconds)
+
+    def quantile(self, q):
+        """
+        The `q` quantile, or None until there are enough samples.
+        """
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[int(q * (len(ordered) - 1))]
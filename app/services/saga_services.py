@@ -0,0 +1,146 @@
+import asyncio
+import time
+from collections import deque
+from fastapi.exceptions import HTTPException
+from app.config import env
+from app.services.resilience_services import budget
+
+SAGA_HISTORY = env("SAGA_HISTORY", 50, int)
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+COMPENSATED = "compensated"
+COMPENSATION_FAILED = "compensation-failed"
+
+
+def describe(error):
+    if isinstance(error, HTTPException):
+        return {"status_code": error.status_code, "detail": error.detail}
+    return {"detail": repr(error)}
+
+
+class SagaStep:
+    """
+    One write of a saga: `action()` and, if it can be undone,
+    `compensate()`. Both are called without arguments and awaited.
+    """
+
+    def __init__(self, name, action, compensate=None):
+        self.name = name
+        self.action = action
+        self.compensate = compensate
+        self.state = PENDING
+        self.error = None
+
+    async def run(self):
+        self.state = RUNNING
+        try:
+            result = await self.action()
+        except BaseException as e:
+            self.state = FAILED
+            self.error = e
+            raise
+        self.state = DONE
+        return result
+
+    async def undo(self):
+        if self.state != DONE or self.compensate is None:
+            return
+        try:
+            await self.compensate()
+        except Exception as e:
+            self.state = COMPENSATION_FAILED
+            self.error = e
+            return
+        self.state = COMPENSATED
+
+    def record(self):
+        record = {"step": self.name, "state": self.state}
+        if self.error is not None:
+            record["error"] = describe(self.error)
+        return record
+
+
+class SagaLog:
+    """
+    Outcome counters of every saga and the steps of the last failed ones.
+    """
+
+    def __init__(self, size=SAGA_HISTORY):
+        self.started = 0
+        self.completed = 0
+        self.compensated = 0
+        self.compensation_failures = 0
+        self.failures = deque(maxlen=size)
+
+    def failed(self, saga):
+        self.compensated += 1
+        if any(step.state == COMPENSATION_FAILED for step in saga.steps):
+            self.compensation_failures += 1
+        self.failures.append({"saga": saga.name, "at": time.time(),
+                              "steps": saga.records()})
+
+    def stats(self):
+        return {
+            "started": self.started,
+            "completed": self.completed,
+            "compensated": self.compensated,
+            "compensation_failures": self.compensation_failures,
+            "recent_failures": list(self.failures)
+        }
+
+
+saga_log = SagaLog()
+
+
+class Saga:
+    """
+    Writes across services that must all happen or be undone.
+
+    Steps are grouped in stages: the steps of a stage run concurrently
+    and the next stage starts once all of them succeeded. If any step
+    fails, the other steps of its stage are let finish, then every
+    completed step is compensated, latest stage first, and the error of
+    the first failed step is raised. Compensations run to the end even
+    past the request deadline or if the request is cancelled.
+    """
+
+    def __init__(self, name, log=saga_log):
+        self.name = name
+        self.log = log
+        self.steps = []
+        self._stages = []
+
+    def stage(self, *steps):
+        self._stages.append(steps)
+        self.steps.extend(steps)
+        return self
+
+    def records(self):
+        return [step.record() for step in self.steps]
+
+    async def run(self):
+        self.log.started += 1
+        for steps in self._stages:
+            try:
+                results = await asyncio.gather(
+                    *(step.run() for step in steps), return_exceptions=True)
+            except asyncio.CancelledError:
+                asyncio.ensure_future(self._compensate())
+                raise
+            errors = [result for result in results
+                      if isinstance(result, BaseException)]
+            if errors:
+                await asyncio.shield(asyncio.ensure_future(self._compensate()))
+                raise errors[0]
+        self.log.completed += 1
+        return self
+
+    async def _compensate(self):
+        # Only steps that completed are undone.
+        with budget(None):
+            for step in reversed(self.steps):
+                await step.undo()
+        self.log.failed(self)
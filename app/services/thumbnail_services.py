@@ -0,0 +1,149 @@
+import asyncio
+import base64
+import binascii
+import importlib.util
+import io
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from app.config import env, as_list
+
+THUMBNAIL_SIZES = sorted(int(size) for size in
+                         env("THUMBNAIL_SIZES", ["64", "128", "256"],
+                             as_list))
+THUMBNAIL_WORKERS = env("THUMBNAIL_WORKERS", 2, int)
+
+# Pillow is in requirements.txt; an install without it serves pictures
+# full size.
+THUMBNAILS_AVAILABLE = importlib.util.find_spec("PIL") is not None
+
+
+def snap_size(size):
+    """
+    Smallest fixed thumbnail size that covers `size`, or None for the
+    original picture.
+    """
+    if size is None or not THUMBNAILS_AVAILABLE:
+        return None
+    for fixed in THUMBNAIL_SIZES:
+        if size <= fixed:
+            return fixed
+    return None
+
+
+def resize(img, size):
+    """
+    Downscale a base64 picture, optionally a data URI, to fit in a
+    `size` square. Runs in a worker process.
+    """
+    from PIL import Image
+
+    prefix, _, payload = img.rpartition(",")
+    try:
+        raw = base64.b64decode(payload, validate=True)
+    except (binascii.Error, ValueError):
+        raise ValueError("picture is not base64")
+    with Image.open(io.BytesIO(raw)) as picture:
+        fmt = picture.format or "PNG"
+        picture.thumbnail((size, size))
+        if fmt == "JPEG" and picture.mode not in ("RGB", "L"):
+            picture = picture.convert("RGB")
+        out = io.BytesIO()
+        picture.save(out, fmt)
+    encoded = base64.b64encode(out.getvalue()).decode()
+    return prefix + "," + encoded if prefix else encoded
+
+
+def timed_call(func, *args):
+    started = time.time()
+    result = func(*args)
+    return result, started, time.time()
+
+
+class WorkerPool:
+    """
+    Process pool for CPU bound work, started on first use. Workers are
+    spawned rather than forked since the gateway already runs threads.
+
+    Records how long jobs wait for a worker and how busy the workers are.
+    A pool broken by a dying worker is dropped, failing the jobs it had,
+    and a new one is started by the next job.
+    """
+
+    def __init__(self, workers):
+        self.workers = max(1, workers)
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.busy = 0.0
+        self.queue_time = 0.0
+        self.max_queue_time = 0.0
+        self.restarts = 0
+        self._executor = None
+        self._started = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                self.workers, multiprocessing.get_context("spawn"))
+            self._started = time.monotonic()
+        return self._executor
+
+    async def run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        self.submitted += 1
+        submitted = time.time()
+        executor = self.executor
+        try:
+            result, started, finished = await loop.run_in_executor(
+                executor, timed_call, func, *args)
+        except BrokenProcessPool:
+            self.failed += 1
+            self._drop(executor)
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        self.completed += 1
+        waited = max(0.0, started - submitted)
+        self.queue_time += waited
+        self.max_queue_time = max(self.max_queue_time, waited)
+        self.busy += finished - started
+        return result
+
+    def _drop(self, executor):
+        if self._executor is executor:
+            self._executor = None
+            self.restarts += 1
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    def stats(self):
+        uptime = time.monotonic() - self._started if self._started else 0.0
+        finished = self.completed + self.failed
+        return {
+            "workers": self.workers,
+            "submitted": self.submitted,
+            "in_flight": self.submitted - finished,
+            "completed": self.completed,
+            "failed": self.failed,
+            "restarts": self.restarts,
+            "utilization": (self.busy / (uptime * self.workers)
+                            if uptime else 0.0),
+            "avg_queue_time": (self.queue_time / self.completed
+                               if self.completed else 0.0),
+            "max_queue_time": self.max_queue_time
+        }
+
+
+thumbnail_pool = WorkerPool(THUMBNAIL_WORKERS)
+
+
+async def make_thumbnail(img, size):
+    return await thumbnail_pool.run(resize, img, size)
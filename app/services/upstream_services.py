@@ -0,0 +1,337 @@
+import asyncio
+import time
+import httpx
+from fastapi.exceptions import HTTPException
+from app.config import as_bool, env
+from app.services.concurrency_services import SingleFlight
+from app.services.json_services import dumps
+from app.services.resilience_services import CircuitBreaker, check_deadline
+from app.services.resilience_services import OPEN, LatencyWindow
+from app.services.resilience_services import DeadlineExceeded
+from app.services.resilience_services import RetryBudget, backoff, remaining
+
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_MAX_KEEPALIVE = 20
+DEFAULT_KEEPALIVE_EXPIRY = 30.0
+DEFAULT_CONNECT_TIMEOUT = 2.0
+DEFAULT_READ_TIMEOUT = 10.0
+DEFAULT_BREAKER_FAILURES = 5
+DEFAULT_BREAKER_RESET = 30.0
+DEFAULT_RETRY_ATTEMPTS = 3
+DEFAULT_RETRY_BASE_DELAY = 0.05
+DEFAULT_RETRY_MAX_DELAY = 1.0
+DEFAULT_RETRY_BUDGET_RATIO = 0.1
+DEFAULT_RETRY_BUDGET_PER_SECOND = 1.0
+DEFAULT_HEDGE_QUANTILE = 0.95
+
+
+def _encode(kwargs):
+    """
+    Serialize a `json=` body with the gateway JSON backend.
+    """
+    if "json" in kwargs:
+        headers = dict(kwargs.pop("headers", None) or {})
+        headers["Content-Type"] = "application/json"
+        kwargs["content"] = dumps(kwargs.pop("json"))
+        kwargs["headers"] = headers
+    return kwargs
+
+
+def _flight_key(method, path, kwargs):
+    """
+    What makes two requests interchangeable: method, path, query and
+    every header, so callers with different credentials never share one.
+    None for requests that must not be shared.
+    """
+    if method != "GET" or set(kwargs) - {"params", "headers"}:
+        return None
+    params = kwargs.get("params")
+    headers = httpx.Headers(kwargs.get("headers"))
+    return (path, str(httpx.QueryParams(params)),
+            tuple(sorted(headers.multi_items())))
+
+
+def _env(name, prefix, default, cast):
+    """
+    Read a client setting, letting <PREFIX>_<NAME> override
+    UPSTREAM_<NAME>.
+    """
+    return env(prefix + "_" + name, env("UPSTREAM_" + name, default, cast),
+               cast)
+
+
+class Upstream:
+    """
+    Async client for one backend service.
+
+    Every service owns a keep-alive connection pool, created on first use
+    so it is bound to the running event loop. Pool limits are read from
+    the environment, e.g. VOYAGE_MAX_CONNECTIONS, falling back to
+    UPSTREAM_MAX_CONNECTIONS and then to the module defaults.
+
+    Calls get the service connect and read timeouts, both cut down to
+    what is left of the request deadline, and go through the service
+    circuit breaker. Timeouts answer 504 and unreachable or open-breaker
+    services 503, with the usual {"detail": ...} body. Only timeouts of
+    the service itself count as breaker failures.
+
+    GETs flagged `idempotent=True` are also retried with backoff and
+    hedged: once a call takes longer than HEDGE_QUANTILE of the recent
+    ones, a second copy is sent and the first good answer wins. Retries
+    and hedges both draw from a retry budget, so an outage is not
+    answered with extra load.
+
+    Identical GETs running at the same time share a single upstream call
+    unless SINGLE_FLIGHT is turned off. The call runs under the deadline
+    of the request that started it; if that deadline cuts it, the other
+    requests make the call again under their own.
+    """
+
+    def __init__(self, name, url_env, transport=None):
+        self.name = name
+        self.url_env = url_env
+        self.prefix = url_env[:-len("_URL")]
+        self.connect_timeout = _env("CONNECT_TIMEOUT", self.prefix,
+                                    DEFAULT_CONNECT_TIMEOUT, float)
+        self.read_timeout = _env("READ_TIMEOUT", self.prefix,
+                                 DEFAULT_READ_TIMEOUT, float)
+        self.breaker = CircuitBreaker(
+            name,
+            _env("BREAKER_FAILURES", self.prefix,
+                 DEFAULT_BREAKER_FAILURES, int),
+            _env("BREAKER_RESET", self.prefix, DEFAULT_BREAKER_RESET, float))
+        self.retry_attempts = _env("RETRY_ATTEMPTS", self.prefix,
+                                   DEFAULT_RETRY_ATTEMPTS, int)
+        self.retry_base_delay = _env("RETRY_BASE_DELAY", self.prefix,
+                                     DEFAULT_RETRY_BASE_DELAY, float)
+        self.retry_max_delay = _env("RETRY_MAX_DELAY", self.prefix,
+                                    DEFAULT_RETRY_MAX_DELAY, float)
+        self.hedge_quantile = _env("HEDGE_QUANTILE", self.prefix,
+                                   DEFAULT_HEDGE_QUANTILE, float)
+        self.retry_budget = RetryBudget(
+            _env("RETRY_BUDGET_RATIO", self.prefix,
+                 DEFAULT_RETRY_BUDGET_RATIO, float),
+            _env("RETRY_BUDGET_PER_SECOND", self.prefix,
+                 DEFAULT_RETRY_BUDGET_PER_SECOND, float))
+        self.latency = LatencyWindow()
+        self.single_flight = _env("SINGLE_FLIGHT", self.prefix, True,
+                                  as_bool)
+        self.flights = SingleFlight()
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.transport = transport
+        self._client = None
+
+    @property
+    def base_url(self):
+        return env(self.url_env, "")
+
+    def limits(self):
+        return httpx.Limits(
+            max_connections=_env("MAX_CONNECTIONS", self.prefix,
+                                 DEFAULT_MAX_CONNECTIONS, int),
+            max_keepalive_connections=_env("MAX_KEEPALIVE", self.prefix,
+                                           DEFAULT_MAX_KEEPALIVE, int),
+            keepalive_expiry=_env("KEEPALIVE_EXPIRY", self.prefix,
+                                  DEFAULT_KEEPALIVE_EXPIRY, float))
+
+    @property
+    def client(self):
+        if self._client is None or self._client.is_closed:
+            # Redirects are followed, as requests used to do.
+            self._client = httpx.AsyncClient(base_url=self.base_url,
+                                             limits=self.limits(),
+                                             timeout=None,
+                                             follow_redirects=True,
+                                             transport=self.transport)
+        return self._client
+
+    def timeout(self, left, stream=False):
+        connect, read = self.connect_timeout, self.read_timeout
+        if left is not None:
+            connect = min(connect, left)
+            if not stream:
+                read = min(read, left)
+        return httpx.Timeout(read, connect=connect)
+
+    def deadline_bound(self, error, left, stream):
+        """
+        Whether a timeout was set by the caller's request deadline rather
+        than by the service's own timeouts. Those don't count against the
+        service.
+        """
+        if left is None:
+            return False
+        if isinstance(error, httpx.ConnectTimeout):
+            return left < self.connect_timeout
+        if isinstance(error, httpx.TimeoutException):
+            return not stream and left < self.read_timeout
+        return True
+
+    async def send(self, method, path, stream=False, **kwargs):
+        left = check_deadline(self.name)
+        self.breaker.before()
+        request = self.client.build_request(
+            method, path, timeout=self.timeout(left, stream),
+            **_encode(kwargs))
+        try:
+            resp = await asyncio.wait_for(
+                self.client.send(request, stream=stream), left)
+        except (httpx.TimeoutException, asyncio.TimeoutError) as e:
+            detail = self.name + " service timed out"
+            if self.deadline_bound(e, left, stream):
+                self.breaker.abandon()
+                raise DeadlineExceeded(detail)
+            self.breaker.failure()
+            raise HTTPException(detail=detail, status_code=504)
+        except httpx.TransportError:
+            self.breaker.failure()
+            raise HTTPException(detail=self.name + " service unavailable",
+                                status_code=503)
+        except BaseException:
+            self.breaker.abandon()
+            raise
+        if resp.status_code // 100 == 5:
+            self.breaker.failure()
+        else:
+            self.breaker.success()
+        return resp
+
+    async def request(self, method, path, idempotent=False, **kwargs):
+        key = None
+        if self.single_flight:
+            key = _flight_key(method, path, kwargs)
+        if key is None:
+            return await self._request(method, path, idempotent, kwargs)
+        return await self.flights.do(
+            key, lambda: self._request(method, path, idempotent, kwargs),
+            shared=lambda error: not isinstance(error, DeadlineExceeded))
+
+    async def _request(self, method, path, idempotent, kwargs):
+        if idempotent and method == "GET":
+            return await self.read(path, **kwargs)
+        return await self.send(method, path, **kwargs)
+
+    def hedge_threshold(self):
+        if not 0 < self.hedge_quantile < 1:
+            return None
+        return self.latency.quantile(self.hedge_quantile)
+
+    async def read(self, path, **kwargs):
+        """
+        GET that is safe to repeat. 5xx answers, timeouts and unreachable
+        services are retried while attempts, deadline and budget allow.
+        """
+        self.retry_budget.deposit()
+        attempt = 0
+        while True:
+            error = None
+            try:
+                resp = await self._hedged(path, kwargs)
+                if resp.status_code // 100 != 5:
+                    return resp
+            except HTTPException as e:
+                if e.status_code not in (503, 504):
+                    raise
+                error = e
+            attempt += 1
+            delay = backoff(attempt, self.retry_base_delay,
+                            self.retry_max_delay)
+            left = remaining()
+            if (attempt >= self.retry_attempts or
+                    self.breaker.state == OPEN or
+                    (left is not None and left <= delay) or
+                    not self.retry_budget.withdraw()):
+                if error is not None:
+                    raise error
+                return resp
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+    async def _timed(self, path, kwargs):
+        start = time.monotonic()
+        resp = await self.send("GET", path, **dict(kwargs))
+        if resp.status_code // 100 != 5:
+            self.latency.add(time.monotonic() - start)
+        return resp
+
+    async def _hedged(self, path, kwargs):
+        threshold = self.hedge_threshold()
+        first = asyncio.ensure_future(self._timed(path, kwargs))
+        if threshold is None:
+            return await first
+        tasks = [first]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=threshold)
+            if done or not self.retry_budget.withdraw():
+                return await first
+            self.hedges += 1
+            second = asyncio.ensure_future(self._timed(path, kwargs))
+            tasks.append(second)
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if (task.exception() is None and
+                            task.result().status_code // 100 != 5):
+                        if task is second:
+                            self.hedge_wins += 1
+                        return task.result()
+            return await first
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def open(self, method, path, **kwargs):
+        """
+        Send a request without reading the body. The caller must close
+        the response. The read timeout applies to each chunk instead of
+        being cut to the request deadline.
+        """
+        return await self.send(method, path, stream=True, **kwargs)
+
+    async def get(self, path, **kwargs):
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request("POST", path, **kwargs)
+
+    async def put(self, path, **kwargs):
+        return await self.request("PUT", path, **kwargs)
+
+    async def delete(self, path, **kwargs):
+        return await self.request("DELETE", path, **kwargs)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self):
+        return {
+            "connect_timeout": self.connect_timeout,
+            "read_timeout": self.read_timeout,
+            "breaker": self.breaker.stats(),
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "hedge_threshold": self.hedge_threshold(),
+            "retry_budget": self.retry_budget.stats(),
+            "single_flight": self.flights.stats()
+        }
+
+
+users_api = Upstream("users", "USERS_URL")
+voyage_api = Upstream("voyage", "VOYAGE_URL")
+payments_api = Upstream("payments", "PAYMENTS_URL")
+pricing_api = Upstream("pricing", "PRICING_URL")
+metrics_api = Upstream("metrics", "METRICS_URL")
+
+UPSTREAMS = [users_api, voyage_api, payments_api, pricing_api, metrics_api]
+
+
+async def close_upstreams():
+    for upstream in UPSTREAMS:
+        await upstream.close()
@@ -1,53 +1,74 @@
-import requests
-import os
 from fastapi.exceptions import HTTPException
+from app.config import env
+from app.services.upstream_services import users_api
+from app.services.cache_services import TTLCache
 
-USERS_URL = os.getenv("USERS_URL")
+TOKEN_CACHE_TTL = env("TOKEN_CACHE_TTL", 60.0, float)
+TOKEN_CACHE_MAXSIZE = env("TOKEN_CACHE_MAXSIZE", 10000, int)
+
+token_cache = TTLCache(TOKEN_CACHE_MAXSIZE, TOKEN_CACHE_TTL)
 
 
 def is_status_correct(status_code):
     return status_code//100 == 2
 
 
-def validate_token(token):
+async def get_token_info(token):
+    """
+    Return uid, roles and is_blocked for a token, asking the users
+    service only when the token is not cached.
+    """
+    info = token_cache.get(token)
+    if info is not None:
+        return info
     params = {
         "token": token
     }
-    resp = requests.post(USERS_URL+"/validate/", json=params)
-    if (is_status_correct(resp.status_code)):
-        return resp.json()["uid"]
-    raise HTTPException(detail={
-                'message': resp.reason
+    resp = await users_api.post("/validate/", json=params)
+    if (not is_status_correct(resp.status_code)):
+        raise HTTPException(detail={
+                'message': resp.reason_phrase
             }, status_code=401)
+    data = resp.json()
+    info = {
+        "uid": data["uid"],
+        "roles": data.get("roles", []),
+        "is_blocked": data.get("is_blocked", False)
+    }
+    token_cache.set(token, info)
+    return info
 
 
-def validate_req_and_get_uid(token, role):
-    params = {
-        "token": token
-    }
-    resp0 = requests.post(USERS_URL+"/validate/", json=params)
-    if (is_status_correct(resp0.status_code)):
-        resp = resp0.json()
-        if (resp["is_blocked"] or role not in resp["roles"]):
-            raise HTTPException(detail={
-                'message': 'Error Permission Denied',
-                'is_blocked': resp["is_blocked"],
-                'roles': resp["roles"]
-            }, status_code=401)
-    else:
+def invalidate_user(uid):
+    """
+    Forget every cached token of a user, e.g. after a block change.
+    """
+    return token_cache.invalidate_if(lambda info: info["uid"] == uid)
+
+
+async def validate_token(token):
+    info = await get_token_info(token)
+    return info["uid"]
+
+
+async def validate_req_and_get_uid(token, role):
+    resp = await get_token_info(token)
+    if (resp["is_blocked"] or role not in resp["roles"]):
         raise HTTPException(detail={
-                'message': resp0.reason
-            }, status_code=401)
+            'message': 'Error Permission Denied',
+            'is_blocked': resp["is_blocked"],
+            'roles': resp["roles"]
+        }, status_code=401)
     return resp["uid"]
 
 
-def validate_req_driver_and_get_uid(token):
-    return validate_req_and_get_uid(token, "Driver")
+async def validate_req_driver_and_get_uid(token):
+    return await validate_req_and_get_uid(token, "Driver")
 
 
-def validate_req_passenger_and_get_uid(token):
-    return validate_req_and_get_uid(token, "Passenger")
+async def validate_req_passenger_and_get_uid(token):
+    return await validate_req_and_get_uid(token, "Passenger")
 
 
-def validate_req_admin_and_get_uid(token):
-    return validate_req_and_get_uid(token, "Admin")
+async def validate_req_admin_and_get_uid(token):
+    return await validate_req_and_get_uid(token, "Admin")
@@ -0,0 +1,96 @@
+"""
+Driver index benchmark on synthetic fleets.
+
+Drivers are spread around Buenos Aires with a denser downtown. For every
+fleet size it times bulk loading, location updates, radius and k-nearest
+queries on the grid index, next to a full scan of the same fleet.
+
+    python benchmarks/geo_index_benchmark.py --drivers 10000 50000 100000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.geo_services import DriverIndex, haversine  # noqa: E402
+
+CENTER = (-34.6037, -58.3816)
+
+
+def random_point(rng):
+    spread = 0.05 if rng.random() < 0.5 else 0.3
+    return (CENTER[0] + rng.gauss(0, spread),
+            CENTER[1] + rng.gauss(0, spread))
+
+
+def full_scan(positions, latitude, longitude, k):
+    distances = sorted(haversine(latitude, longitude, lat, lon)
+                       for lat, lon in positions.values())
+    return distances[:k]
+
+
+def timed(func, args_list):
+    samples = []
+    for args in args_list:
+        start = time.perf_counter()
+        func(*args)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def report(name, samples):
+    samples = sorted(samples)
+    p99 = samples[int(len(samples) * 0.99) - 1]
+    print(f"  {name:>12}: median {statistics.median(samples) * 1e6:9.1f} us"
+          f"  p99 {p99 * 1e6:9.1f} us")
+
+
+def run(drivers, queries, k, radius, cell, seed):
+    rng = random.Random(seed)
+    positions = {"driver-%d" % i: random_point(rng) for i in range(drivers)}
+    index = DriverIndex(cell=cell, ttl=float("inf"))
+
+    start = time.perf_counter()
+    for uid, (latitude, longitude) in positions.items():
+        index.update(uid, latitude, longitude)
+    load = time.perf_counter() - start
+
+    points = [random_point(rng) for _ in range(queries)]
+    moves = [(uid, *random_point(rng))
+             for uid in rng.sample(list(positions), queries)]
+
+    print(f"{drivers} drivers, {index.stats()['cells']} cells,"
+          f" loaded in {load * 1000:.0f} ms")
+    report("update", timed(index.update, moves))
+    report("within", timed(index.within,
+                           [(lat, lon, radius) for lat, lon in points]))
+    report("nearest", timed(index.nearest,
+                            [(lat, lon, k) for lat, lon in points]))
+    report("full scan", timed(full_scan,
+                              [(positions, lat, lon, k)
+                               for lat, lon in points[:20]]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--drivers", type=int, nargs="+",
+                        default=[10000, 50000, 100000])
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--radius", type=float, default=2000,
+                        help="radius query size in meters")
+    parser.add_argument("--cell", type=float, default=0.01,
+                        help="grid cell size in degrees")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    for drivers in args.drivers:
+        run(drivers, args.queries, args.k, args.radius, args.cell, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+JSON encode/decode micro-benchmark on gateway payload shapes.
+
+Compares the stdlib backend with orjson (when installed) on a search
+result, an admin user list and a complaint list.
+
+    python benchmarks/json_benchmark.py --drivers 20 --users 2000
+"""
+import argparse
+import json
+import random
+import timeit
+
+
+def search_result(drivers, rng):
+    return {"driver-%d" % i: {
+        "id": "driver-%d" % i,
+        "name": "Nombre %d" % i,
+        "last_name": "Apellido",
+        "roles": ["Driver"],
+        "is_blocked": False,
+        "car": {"model": "Fiat Cronos", "year": 2020,
+                "plaque": "AB123CD", "capacity": 4},
+        "profile_picture_url": "/users/driver-%d/profile/picture" % i,
+        "profile_picture_etag": "%032x" % rng.getrandbits(128),
+        "calification": round(rng.uniform(1, 5), 2),
+        "location": {"latitude": rng.uniform(-34.7, -34.5),
+                     "longitude": rng.uniform(-58.5, -58.3)},
+        "prices": {"final_price": round(rng.uniform(0.001, 0.01), 6)}
+    } for i in range(drivers)}
+
+
+def user_list(users, rng):
+    return [{"id": "user-%d" % i,
+             "name": "Nombre %d" % i,
+             "last_name": "Apellido",
+             "roles": rng.choice([["Passenger"], ["Driver"],
+                                  ["Passenger", "Driver"]]),
+             "address": "Av. Paseo Colón %d" % rng.randint(1, 2000),
+             "is_blocked": rng.random() < 0.05}
+            for i in range(users)]
+
+
+def complaint_list(complaints, rng):
+    return [{"id": "complaint-%d" % i,
+             "voyage_id": "voyage-%d" % rng.randint(1, 10 ** 6),
+             "complaint_type": rng.choice(["Driver", "Car", "Route"]),
+             "description": "El conductor tomó un camino más largo " * 3,
+             "status": rng.choice(["Open", "Closed"])}
+            for i in range(complaints)]
+
+
+def stdlib_dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, allow_nan=False,
+                      separators=(",", ":")).encode("utf-8")
+
+
+def backends():
+    found = [("stdlib", stdlib_dumps, json.loads)]
+    try:
+        import orjson
+    except ImportError:
+        return found
+    found.append(("orjson",
+                  lambda obj: orjson.dumps(obj,
+                                           option=orjson.OPT_NON_STR_KEYS),
+                  orjson.loads))
+    return found
+
+
+def throughput(func, arg, seconds):
+    timer = timeit.Timer(lambda: func(arg))
+    number, elapsed = timer.autorange()
+    runs = max(1, int(number * seconds / max(elapsed, 1e-9)))
+    return runs / timer.timeit(runs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--drivers", type=int, default=20)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--complaints", type=int, default=2000)
+    parser.add_argument("--seconds", type=float, default=0.5,
+                        help="time spent on each measurement")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    payloads = [("search", search_result(args.drivers, rng)),
+                ("users", user_list(args.users, rng)),
+                ("complaints", complaint_list(args.complaints, rng))]
+
+    for name, payload in payloads:
+        size = len(stdlib_dumps(payload))
+        print(f"{name} ({size / 1024:.1f} KiB)")
+        for backend, dumps, loads in backends():
+            encoded = dumps(payload)
+            encode = throughput(dumps, payload, args.seconds)
+            decode = throughput(loads, encoded, args.seconds)
+            print(f"  {backend:>7}: encode {encode:10.0f}/s"
+                  f" ({encode * size / 2 ** 20:7.1f} MiB/s)"
+                  f"  decode {decode:10.0f}/s"
+                  f" ({decode * size / 2 ** 20:7.1f} MiB/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+User lookup batching benchmark against a local stub users service.
+
+The stub answers /users/{id}/{caller_id} and a bulk /users/bulk/{caller_id}
+read after a fixed latency per call plus a small cost per user. Every
+round looks up the drivers of one search, some of them twice, one by
+one, through the loader with bounded single calls and through the loader
+with the bulk read.
+
+    python benchmarks/user_loader_benchmark.py --users 20 --rounds 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.upstream_services import users_api  # noqa: E402
+from app.services.loader_services import BatchLoader  # noqa: E402
+from app.services.loader_services import each_bounded, fetch_user  # noqa: E402
+
+
+class StubUsers:
+    def __init__(self, latency, per_user):
+        self.latency = latency
+        self.per_user = per_user
+        self.calls = 0
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                target = head.split(b" ", 2)[1].decode()
+                body = await self.answer(target)
+                writer.write(b"HTTP/1.1 200 OK\r\n"
+                             b"Content-Type: application/json\r\n"
+                             b"Content-Length: %d\r\n\r\n" % len(body) +
+                             body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+
+    async def answer(self, target):
+        self.calls += 1
+        url = urlsplit(target)
+        parts = url.path.strip("/").split("/")
+        if parts[1] == "bulk":
+            ids = parse_qs(url.query)["ids"][0].split(",")
+        else:
+            ids = [parts[1]]
+        await asyncio.sleep(self.latency + self.per_user * len(ids))
+        users = {uid: {"id": uid, "name": "Nombre", "roles": ["Driver"],
+                       "is_blocked": False} for uid in ids}
+        if parts[1] != "bulk":
+            return json.dumps(users[ids[0]]).encode()
+        return json.dumps(users).encode()
+
+
+async def fetch_users_bulk(keys):
+    by_caller = {}
+    for id_user, caller_id in keys:
+        by_caller.setdefault(caller_id, []).append(id_user)
+    found = {}
+    for caller_id, ids in by_caller.items():
+        resp = await users_api.get("/users/bulk/" + caller_id,
+                                   params={"ids": ",".join(ids)})
+        for id_user, user in resp.json().items():
+            found[(id_user, caller_id)] = user
+    return found
+
+
+async def one_by_one(keys):
+    for key in keys:
+        await fetch_user(key)
+
+
+async def with_loader(keys, batch):
+    users = BatchLoader("benchmark", batch, cache=True)
+    await asyncio.gather(*(users.load(key) for key in keys))
+
+
+async def bounded(keys):
+    return await each_bounded(fetch_user, keys)
+
+
+async def measure(stub, rounds, keys_of, run):
+    stub.calls = 0
+    start = time.perf_counter()
+    for index in range(rounds):
+        await run(keys_of(index))
+    elapsed = time.perf_counter() - start
+    return elapsed / rounds * 1000, stub.calls / rounds
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=20,
+                        help="distinct drivers per search")
+    parser.add_argument("--repeat", type=float, default=0.25,
+                        help="share of lookups asked for twice")
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.005,
+                        help="stub latency per call, in seconds")
+    parser.add_argument("--per-user", type=float, default=0.0002,
+                        help="stub cost per user read, in seconds")
+    args = parser.parse_args()
+
+    stub = StubUsers(args.latency, args.per_user)
+    server = await asyncio.start_server(stub.handle, "127.0.0.1", 0)
+    host, port = server.sockets[0].getsockname()[:2]
+    os.environ["USERS_URL"] = "http://%s:%d" % (host, port)
+    rng = random.Random(1)
+
+    def keys_of(index):
+        ids = ["driver-%d-%d" % (index, i) for i in range(args.users)]
+        ids += rng.sample(ids, int(len(ids) * args.repeat))
+        rng.shuffle(ids)
+        return [(uid, "passenger-%d" % index) for uid in ids]
+
+    print(f"{args.users} drivers per search, {args.repeat:.0%} repeated,"
+          f" stub latency {args.latency * 1000:.1f} ms")
+    for name, run in [
+            ("one by one", one_by_one),
+            ("loader, single calls",
+             lambda keys: with_loader(keys, bounded)),
+            ("loader, bulk read",
+             lambda keys: with_loader(keys, fetch_users_bulk))]:
+        per_round, calls = await measure(stub, args.rounds, keys_of, run)
+        print(f"  {name:>22}: {per_round:8.2f} ms/search"
+              f"  {calls:6.1f} upstream calls/search")
+
+    await users_api.close()
+    server.close()
+    await server.wait_closed()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,50 @@
+from app.services.aggregator_services import MetricsAggregator
+
+
+def test_identical_events_collapse_into_one_counter():
+    sent = []
+    aggregator = MetricsAggregator(sent.append)
+    for _ in range(3):
+        aggregator.add({"event": "Login", "is_federate": "false",
+                        "status": "True"})
+    aggregator.add({"event": "Login", "is_federate": "true",
+                    "status": "True"})
+
+    summary = aggregator.flush()
+
+    assert sent == [summary]
+    counts = {c["labels"]["is_federate"]: c["count"]
+              for c in summary["counters"]}
+    assert counts == {"false": 3, "true": 1}
+
+
+def test_value_fields_feed_a_histogram():
+    aggregator = MetricsAggregator(lambda summary: None, bounds=(1, 10))
+    for price in ("0.5", 2, 20):
+        aggregator.add({"event": "Payment", "status": "True",
+                        "price": price})
+
+    histogram = aggregator.flush()["histograms"][0]
+
+    assert histogram["labels"] == {"status": "True"}
+    assert histogram["count"] == 3
+    assert histogram["sum"] == 22.5
+    assert histogram["buckets"] == [1, 1, 1]
+
+
+def test_passthrough_events_are_not_folded():
+    aggregator = MetricsAggregator(lambda summary: None)
+
+    assert not aggregator.add({"event": "Voyage", "is_vip": "False"})
+    assert aggregator.flush() is None
+
+
+def test_summary_is_sent_when_max_events_is_reached():
+    sent = []
+    aggregator = MetricsAggregator(sent.append, max_events=2)
+    aggregator.add({"event": "Block"})
+    assert sent == []
+    aggregator.add({"event": "Block"})
+
+    assert sent[0]["counters"] == [
+        {"event": "Block", "labels": {}, "count": 2}]
@@ -0,0 +1,145 @@
+import asyncio
+import pytest
+from app.services.cache_services import TTLCache, RefreshingCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = TTLCache(maxsize=10, ttl=5, clock=clock)
+    cache.set("token", {"uid": "1"})
+
+    clock.now = 4
+    assert cache.get("token") == {"uid": "1"}
+    clock.now = 5
+    assert cache.get("token") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert "a" in cache
+    assert "b" not in cache
+    assert cache.stats()["evictions"] == 1
+
+
+def test_invalidate_if_drops_matching_values():
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set("t1", {"uid": "1"})
+    cache.set("t2", {"uid": "1"})
+    cache.set("t3", {"uid": "2"})
+
+    assert cache.invalidate_if(lambda info: info["uid"] == "1") == 2
+    assert len(cache) == 1
+
+
+def test_concurrent_misses_share_one_load():
+    loads = []
+
+    async def loader(key):
+        loads.append(key)
+        await asyncio.sleep(0.01)
+        return {"key": key}
+
+    async def scenario():
+        cache = RefreshingCache(ttl=60)
+        results = await asyncio.gather(
+            *(cache.get("/metrics/users", loader) for _ in range(5)))
+        return cache, results
+
+    cache, results = asyncio.run(scenario())
+
+    assert loads == ["/metrics/users"]
+    assert all(result == {"key": "/metrics/users"} for result in results)
+    assert cache.stats()["coalesced"] == 4
+
+
+def test_stale_value_is_served_while_reloading():
+    clock = FakeClock()
+    values = iter(["old", "new"])
+
+    async def loader(key):
+        return next(values)
+
+    async def scenario():
+        cache = RefreshingCache(ttl=10, stale_ttl=60, clock=clock)
+        first = await cache.get("k", loader)
+        clock.now = 20
+        stale = await cache.get("k", loader)
+        await asyncio.sleep(0)
+        fresh = await cache.get("k", loader)
+        return first, stale, fresh
+
+    assert asyncio.run(scenario()) == ("old", "old", "new")
+
+
+def test_failed_loads_are_not_cached():
+    calls = 0
+
+    async def loader(key):
+        nonlocal calls
+        calls += 1
+        raise RuntimeError("metrics down")
+
+    async def scenario():
+        cache = RefreshingCache(ttl=60)
+        for _ in range(2):
+            with pytest.raises(RuntimeError):
+                await cache.get("k", loader)
+
+    asyncio.run(scenario())
+    assert calls == 2
+
+
+def test_load_racing_an_invalidation_is_not_cached():
+    values = iter(["before", "after"])
+
+    async def loader(key):
+        await asyncio.sleep(0.01)
+        return next(values)
+
+    async def scenario():
+        cache = RefreshingCache(ttl=60, maxsize=1)
+        loading = asyncio.ensure_future(cache.get("k", loader))
+        await asyncio.sleep(0)
+        cache.invalidate("k")
+        stale = await loading
+        fresh = await cache.get("k", loader)
+        await cache.get("other", lambda key: asyncio.sleep(0, "x"))
+        return cache, stale, fresh
+
+    cache, stale, fresh = asyncio.run(scenario())
+    assert (stale, fresh) == ("before", "after")
+    assert cache.stats()["size"] == 1
+
+
+def test_refresh_running_during_a_write_does_not_overwrite_it():
+    clock = FakeClock()
+
+    async def loader(key):
+        await asyncio.sleep(0.01)
+        return "old"
+
+    async def scenario():
+        cache = RefreshingCache(ttl=10, stale_ttl=60, clock=clock)
+        cache.set("k", "old")
+        clock.now = 11
+        assert await cache.get("k", loader) == "old"
+        cache.set("k", "new")
+        await asyncio.sleep(0.02)
+        return await cache.get("k", loader)
+
+    assert asyncio.run(scenario()) == "new"
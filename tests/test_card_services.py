@@ -0,0 +1,27 @@
+import asyncio
+from app.services import card_services
+
+
+def test_cards_are_shared_until_invalidated(monkeypatch):
+    loads = []
+
+    async def load_driver_card(id_driver, caller_id):
+        loads.append((id_driver, caller_id))
+        return {"id": id_driver, "is_blocked": len(loads) > 1}
+
+    monkeypatch.setattr(card_services, "load_driver_card", load_driver_card)
+    monkeypatch.setattr(card_services, "driver_cards",
+                        card_services.RefreshingCache(15))
+
+    async def scenario():
+        first = await card_services.driver_card("d1", "p1")
+        first["prices"] = 10
+        second = await card_services.driver_card("d1", "p2")
+        card_services.invalidate_driver_card("d1")
+        third = await card_services.driver_card("d1", "p3")
+        return second, third
+
+    second, third = asyncio.run(scenario())
+    assert second == {"id": "d1", "is_blocked": False}
+    assert third["is_blocked"]
+    assert loads == [("d1", "p1"), ("d1", "p3")]
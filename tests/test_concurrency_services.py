@@ -0,0 +1,77 @@
+import asyncio
+import pytest
+from fastapi.exceptions import HTTPException
+from app.services.concurrency_services import map_bounded, Aggregation
+
+
+def test_slow_failed_and_empty_items_are_dropped():
+    async def work(item):
+        if item == "slow":
+            await asyncio.sleep(1)
+        if item == "fail":
+            raise ValueError(item)
+        if item == "none":
+            return None
+        return item.upper()
+
+    items = ["a", "slow", "fail", "none", "b"]
+    result = asyncio.run(map_bounded(work, items, limit=5, timeout=0.05))
+
+    assert result == [("a", "A"), ("b", "B")]
+
+
+def test_concurrency_never_exceeds_limit():
+    running = 0
+    peak = 0
+
+    async def work(item):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return item
+
+    result = asyncio.run(map_bounded(work, range(20), limit=3))
+
+    assert peak == 3
+    assert [item for item, _ in result] == list(range(20))
+
+
+class FakeResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+async def respond(status_code, body, delay=0):
+    await asyncio.sleep(delay)
+    return FakeResponse(status_code, body)
+
+
+def test_aggregation_merges_parts_in_order():
+    async def build():
+        return await (Aggregation()
+                      .required(respond(200, {"name": "a"}, delay=0.02))
+                      .optional(respond(404, {"detail": "no picture"}))
+                      .required(respond(200, {"name": "b", "count": 1}))
+                      .run())
+
+    assert asyncio.run(build()) == {"name": "b", "count": 1}
+
+
+def test_aggregation_raises_first_failing_required_part():
+    async def build():
+        return await (Aggregation()
+                      .required(respond(200, {"name": "a"}))
+                      .required(respond(404, {"detail": "no user"}))
+                      .required(respond(500, {"detail": "boom"}))
+                      .run())
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(build())
+    assert error.value.status_code == 404
+    assert error.value.detail == "no user"
@@ -0,0 +1,52 @@
+import random
+from app.services.geo_services import DriverIndex, haversine
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def brute_force(drivers, latitude, longitude):
+    return sorted(((uid, haversine(latitude, longitude, lat, lon))
+                   for uid, (lat, lon) in drivers.items()),
+                  key=lambda item: item[1])
+
+
+def test_queries_match_a_full_scan():
+    rng = random.Random(7)
+    index = DriverIndex(cell=0.01)
+    drivers = {}
+    for i in range(2000):
+        drivers["d%d" % i] = (-34.6 + rng.uniform(-0.2, 0.2),
+                              -58.4 + rng.uniform(-0.2, 0.2))
+        index.update("d%d" % i, *drivers["d%d" % i])
+
+    expected = brute_force(drivers, -34.61, -58.38)
+    assert [uid for uid, _ in index.nearest(-34.61, -58.38, 15)] == \
+        [uid for uid, _ in expected[:15]]
+    assert [uid for uid, _ in index.within(-34.61, -58.38, 2500)] == \
+        [uid for uid, distance in expected if distance <= 2500]
+
+
+def test_moves_removals_and_stale_drivers():
+    clock = Clock()
+    index = DriverIndex(cell=0.01, ttl=60, clock=clock)
+    index.update("d1", -34.6, -58.4)
+    index.update("d1", -34.7, -58.5)
+    index.update("d2", -34.6, -58.4)
+    assert index.point("d1") == {"longitude": -58.5, "latitude": -34.7}
+    assert index.stats()["cells"] == 2
+
+    index.remove("d2")
+    assert index.point("d2") is None
+    assert index.stats()["cells"] == 1
+
+    clock.now = 61
+    assert index.get("d1") is None
+    assert index.nearest(-34.7, -58.5, 1) == []
+    index.update("d3", 10, 10)
+    assert len(index) == 1
@@ -0,0 +1,80 @@
+import asyncio
+from app.services.ingestion_services import LocationBuffer
+
+
+def test_only_latest_location_per_driver_is_sent():
+    sent = []
+
+    async def send(uid, location):
+        sent.append((uid, location))
+
+    buffer = LocationBuffer(send)
+    buffer.put("d1", {"latitude": 1})
+    buffer.put("d1", {"latitude": 2})
+    buffer.put("d2", {"latitude": 5})
+
+    assert asyncio.run(buffer.flush()) == 2
+    assert sorted(sent) == [("d1", {"latitude": 2}), ("d2", {"latitude": 5})]
+    assert buffer.stats()["coalesced"] == 1
+    assert len(buffer) == 0
+
+
+def test_failed_location_is_retried_unless_superseded():
+    attempts = []
+
+    async def send(uid, location):
+        attempts.append((uid, location))
+        if len(attempts) == 1:
+            raise ConnectionError("voyage down")
+
+    buffer = LocationBuffer(send)
+    buffer.put("d1", {"latitude": 1})
+    asyncio.run(buffer.flush())
+    assert len(buffer) == 1
+
+    asyncio.run(buffer.flush())
+    assert attempts == [("d1", {"latitude": 1}), ("d1", {"latitude": 1})]
+    assert buffer.stats()["failed"] == 1
+    assert buffer.stats()["sent"] == 1
+
+
+def test_full_buffer_flushes_before_the_interval():
+    sent = []
+
+    async def send(uid, location):
+        sent.append(uid)
+
+    async def scenario():
+        buffer = LocationBuffer(send, interval=60, max_batch=2)
+        task = asyncio.ensure_future(buffer.run())
+        await asyncio.sleep(0)
+        buffer.put("d1", {})
+        buffer.put("d2", {})
+        await asyncio.sleep(0.05)
+        task.cancel()
+
+    asyncio.run(scenario())
+    assert sorted(sent) == ["d1", "d2"]
+
+
+def test_stop_finishes_the_flush_in_progress():
+    sent = []
+
+    async def send(uid, location):
+        await asyncio.sleep(0.02)
+        sent.append(uid)
+
+    async def scenario():
+        buffer = LocationBuffer(send, interval=0.01)
+        task = asyncio.ensure_future(buffer.run())
+        buffer.put("d1", {"latitude": 1})
+        await asyncio.sleep(0.015)
+        buffer.put("d2", {"latitude": 2})
+        buffer.stop()
+        await task
+        await buffer.flush()
+        return buffer
+
+    buffer = asyncio.run(scenario())
+    assert sorted(sent) == ["d1", "d2"]
+    assert len(buffer) == 0
@@ -0,0 +1,37 @@
+import asyncio
+import importlib
+import httpx
+from app.services import json_services
+from app.services.upstream_services import Upstream
+
+
+def test_backends_agree(monkeypatch):
+    payload = {"d1": {"name": "Ana", "calification": 4.5,
+                      "location": {"latitude": -34.6, "longitude": -58.4}},
+               "vacío": [1, None, True]}
+    fast = json_services.dumps(payload)
+    monkeypatch.setenv("JSON_BACKEND", "stdlib")
+    stdlib = importlib.reload(json_services)
+    try:
+        assert stdlib.BACKEND == "stdlib"
+        assert stdlib.loads(stdlib.dumps(payload)) == payload
+        assert stdlib.loads(fast) == payload
+        assert stdlib.FastJSONResponse(payload).body == stdlib.dumps(payload)
+    finally:
+        monkeypatch.delenv("JSON_BACKEND")
+        importlib.reload(json_services)
+
+
+def test_upstream_json_bodies_use_the_backend():
+    sent = []
+
+    def handler(request):
+        sent.append((request.headers["content-type"], request.content))
+        return httpx.Response(200, json={})
+
+    api = Upstream("voyage", "VOYAGE_URL")
+    api._client = httpx.AsyncClient(transport=httpx.MockTransport(handler),
+                                    base_url="http://voyage")
+    asyncio.run(api.post("/voyage/passenger/search", json={"is_vip": True}))
+    assert sent == [("application/json", json_services.dumps(
+        {"is_vip": True}))]
@@ -0,0 +1,73 @@
+import asyncio
+import httpx
+import pytest
+from app.services.json_services import loads
+from app.services.listing_services import iter_array, listing_page
+from app.services.listing_services import listing_export
+from app.services.upstream_services import Upstream
+
+USERS = [{"id": "u%d" % i, "name": 'a "quoted" [name], {x}\\\\',
+          "roles": ["Passenger"]} for i in range(7)]
+
+
+async def chunks(body, size):
+    for i in range(0, len(body), size):
+        yield body[i:i + size]
+
+
+def collect(body, size):
+    async def scenario():
+        return [item async for item in iter_array(chunks(body, size))]
+    return asyncio.run(scenario())
+
+
+def test_array_is_split_whatever_the_chunk_size():
+    body = b' [ ' + b' , '.join(
+        httpx.Response(200, json=user).content for user in USERS) + b' ]'
+    for size in (1, 2, 7, 64, len(body)):
+        assert [loads(item) for item in collect(body, size)] == USERS
+    assert collect(b'[]', 1) == []
+    assert collect(b'[1, "a,b", [2, 3]]', 3) == [b'1', b'"a,b"', b'[2, 3]']
+
+
+def test_truncated_or_non_array_listings_fail():
+    with pytest.raises(ValueError):
+        collect(b'[1, 2', 2)
+    with pytest.raises(ValueError):
+        collect(b'{"a": 1}', 2)
+
+
+def upstream():
+    def handler(request):
+        body = httpx.Response(200, json=USERS).content
+        return httpx.Response(200, stream=httpx.ByteStream(body))
+
+    api = Upstream("users", "USERS_URL")
+    api._client = httpx.AsyncClient(transport=httpx.MockTransport(handler),
+                                    base_url="http://users")
+    return api
+
+
+def test_pages_follow_the_cursor_to_the_end():
+    async def scenario():
+        pages, cursor = [], None
+        while True:
+            resp = await listing_page(upstream(), "/users/all/a1", cursor, 3)
+            page = loads(resp.body)
+            pages.append(page["items"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                return pages
+
+    pages = asyncio.run(scenario())
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert sum(pages, []) == USERS
+
+
+def test_export_is_one_user_per_line():
+    async def scenario():
+        resp = await listing_export(upstream(), "/users/all/a1")
+        return b"".join([line async for line in resp.body_iterator])
+
+    lines = asyncio.run(scenario()).splitlines()
+    assert [loads(line) for line in lines] == USERS
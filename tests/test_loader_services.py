@@ -0,0 +1,30 @@
+import asyncio
+from fastapi.exceptions import HTTPException
+from app.services.loader_services import BatchLoader, totals
+
+
+def test_keys_asked_together_are_loaded_in_one_batch():
+    batches = []
+
+    async def batch(keys):
+        batches.append(keys)
+        return {key: (HTTPException(detail="User Not Found", status_code=404)
+                      if key == "u3" else key.upper())
+                for key in keys}
+
+    async def scenario():
+        users = BatchLoader("test-users", batch, max_batch=2, cache=True)
+        found = await asyncio.gather(users.load("u1"), users.load("u2"),
+                                     users.load("u1"), users.load("u3"),
+                                     return_exceptions=True)
+        again = await users.load("u2")
+        with_error = await asyncio.gather(users.load("u3"),
+                                          return_exceptions=True)
+        return found, again, with_error
+
+    found, again, with_error = asyncio.run(scenario())
+    assert found[:3] == ["U1", "U2", "U1"]
+    assert found[3].status_code == with_error[0].status_code == 404
+    assert again == "U2"
+    assert batches == [["u1", "u2"], ["u3"], ["u3"]]
+    assert totals["test-users"] == {"loads": 6, "batches": 3, "keys": 4}
@@ -0,0 +1,44 @@
+import asyncio
+import json
+from fastapi.exceptions import HTTPException
+from app.services.location_services import LocationHub
+
+
+def parse(chunk):
+    event, data = chunk.strip().split("\n")
+    return event[len("event: "):], json.loads(data[len("data: "):])
+
+
+def test_subscribers_share_one_poller_and_get_deltas():
+    positions = [
+        {"latitude": 1, "longitude": 1},
+        {"latitude": 1, "longitude": 2},
+        {"latitude": 1, "longitude": 2},
+    ]
+    fetches = []
+
+    async def fetch(voyage_id, uid):
+        fetches.append(uid)
+        if len(fetches) > len(positions):
+            raise HTTPException(detail="Voyage finished", status_code=404)
+        return positions[len(fetches) - 1]
+
+    async def read(hub, uid):
+        first = {"latitude": 0, "longitude": 1}
+        return [parse(chunk) async for chunk in
+                hub.stream("v1", uid, first)]
+
+    async def scenario():
+        hub = LocationHub(fetch, interval=0.01, keepalive=5)
+        streams = await asyncio.gather(read(hub, "p1"), read(hub, "p2"))
+        return hub, streams
+
+    hub, streams = asyncio.run(scenario())
+
+    expected = [("location", {"latitude": 0, "longitude": 1}),
+                ("location", {"latitude": 1}),
+                ("location", {"longitude": 2}),
+                ("end", {"voyage_id": "v1"})]
+    assert streams == [expected, expected]
+    assert set(fetches) == {"p1"}
+    assert hub.stats()["voyages"] == 0
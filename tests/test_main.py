@@ -0,0 +1,16 @@
+from fastapi.testclient import TestClient
+from app.main import app
+from app.services.rabbit_services import publisher
+from app.services.upstream_services import UPSTREAMS
+
+
+def test_import_opens_no_external_resources():
+    assert all(upstream._client is None for upstream in UPSTREAMS)
+    assert not publisher.stats()["connected"]
+
+
+def test_lifespan_releases_resources_on_shutdown():
+    with TestClient(app):
+        assert publisher._thread.is_alive()
+    assert publisher._thread is None
+    assert all(upstream._client is None for upstream in UPSTREAMS)
@@ -0,0 +1,55 @@
+from app.services.outbox_services import Outbox
+
+
+def fill(outbox, count, start=0):
+    for i in range(start, start + count):
+        outbox.append('{"n": %d}' % i)
+
+
+def test_read_does_not_advance_until_commit(tmp_path):
+    outbox = Outbox(str(tmp_path))
+    fill(outbox, 3)
+
+    assert outbox.read(2) == ['{"n": 0}', '{"n": 1}']
+    assert outbox.read(2) == ['{"n": 0}', '{"n": 1}']
+    outbox.commit(2)
+    assert outbox.read(2) == ['{"n": 2}']
+    assert len(outbox) == 1
+
+
+def test_committed_segments_are_compacted(tmp_path):
+    outbox = Outbox(str(tmp_path), segment_bytes=18)
+    fill(outbox, 6)
+    assert outbox.stats()["segments"] == 3
+
+    outbox.read(4)
+    outbox.commit(4)
+
+    assert outbox.stats()["segments"] == 1
+    assert outbox.read(10) == ['{"n": 4}', '{"n": 5}']
+
+
+def test_disk_usage_is_bounded_by_dropping_oldest(tmp_path):
+    outbox = Outbox(str(tmp_path), segment_bytes=18, max_bytes=36)
+    fill(outbox, 4)
+    assert outbox.full()
+
+    assert outbox.drop_oldest() == 2
+    fill(outbox, 1, start=4)
+
+    assert outbox.read(10) == ['{"n": 2}', '{"n": 3}', '{"n": 4}']
+    assert outbox.stats()["dropped"] == 2
+
+
+def test_half_written_record_is_discarded_on_recovery(tmp_path):
+    outbox = Outbox(str(tmp_path))
+    fill(outbox, 2)
+    outbox.close()
+    segment = next(tmp_path.glob("*.log"))
+    with open(segment, "ab") as f:
+        f.write(b'{"n": 2')
+
+    outbox = Outbox(str(tmp_path))
+    fill(outbox, 1, start=3)
+
+    assert outbox.read(10) == ['{"n": 0}', '{"n": 1}', '{"n": 3}']
@@ -0,0 +1,97 @@
+import asyncio
+from concurrent.futures.process import BrokenProcessPool
+from app.services.picture_services import PictureCache, etag_of, matches
+
+
+def test_pictures_are_shared_by_hash_and_evicted_by_size():
+    fetched = []
+    images = {"u1": "a" * 40, "u2": "a" * 40, "u3": "b" * 40}
+
+    async def fetch(uid):
+        fetched.append(uid)
+        return images[uid]
+
+    async def scenario(cache):
+        return [await cache.get(uid) for uid in ("u1", "u2", "u1", "u3",
+                                                 "u1")]
+
+    cache = PictureCache(fetch, max_bytes=60)
+    results = asyncio.run(scenario(cache))
+
+    assert results[0] == (etag_of("a" * 40), "a" * 40)
+    assert results[0] == results[1] == results[2]
+    assert fetched == ["u1", "u2", "u3", "u1"]
+    assert cache.stats()["bytes"] <= 60
+    assert cache.stats()["evictions"] == 2
+
+
+def test_invalidate_fetches_the_new_picture():
+    images = {"u1": "old"}
+
+    async def fetch(uid):
+        return images[uid]
+
+    cache = PictureCache(fetch, max_bytes=100)
+    asyncio.run(cache.get("u1"))
+    images["u1"] = "new"
+    assert asyncio.run(cache.get("u1"))[1] == "old"
+    cache.invalidate("u1")
+    assert asyncio.run(cache.get("u1"))[1] == "new"
+
+
+def test_if_none_match():
+    assert matches('"abc"', "abc")
+    assert matches('W/"xyz", "abc"', "abc")
+    assert matches("*", "abc")
+    assert not matches('"xyz"', "abc")
+    assert not matches(None, "abc")
+
+
+def test_thumbnails_are_cached_and_bad_pictures_served_as_is():
+    resized = []
+
+    async def fetch(uid):
+        return {"u1": "picture", "u2": "https://not/base64"}[uid]
+
+    async def resize(img, size):
+        resized.append((img, size))
+        if img.startswith("https"):
+            raise ValueError("picture is not base64")
+        return img[:size]
+
+    async def scenario(cache):
+        return [await cache.get("u1", 3), await cache.get("u1", 3),
+                await cache.get("u2", 3), await cache.get("u2", 3)]
+
+    cache = PictureCache(fetch, max_bytes=100, resize=resize)
+    results = asyncio.run(scenario(cache))
+
+    etag = etag_of("picture")
+    assert results[0] == results[1] == (etag + "-3", "pic")
+    assert results[2] == results[3] == (etag_of("https://not/base64"),
+                                        "https://not/base64")
+    assert len(resized) == 2
+    assert cache.stats()["resize_errors"] == 1
+
+
+def test_broken_pool_does_not_mark_the_picture_unresizable():
+    calls = []
+
+    async def fetch(uid):
+        return "picture"
+
+    async def resize(img, size):
+        calls.append(size)
+        if len(calls) == 1:
+            raise BrokenProcessPool("worker died")
+        return img[:size]
+
+    async def scenario(cache):
+        return [await cache.get("u1", 3), await cache.get("u1", 3)]
+
+    cache = PictureCache(fetch, max_bytes=100, resize=resize)
+    first, second = asyncio.run(scenario(cache))
+
+    assert first == (etag_of("picture"), "picture")
+    assert second == (etag_of("picture") + "-3", "pic")
+    assert cache.stats()["resize_errors"] == 0
@@ -0,0 +1,29 @@
+import asyncio
+import json
+from app.services import pricing_services
+
+
+def test_constants_are_written_through_without_reloading(monkeypatch):
+    loads = []
+
+    async def fetch_constants(path):
+        loads.append(path)
+        return {"price_meter": 1.0}
+
+    monkeypatch.setattr(pricing_services, "fetch_constants", fetch_constants)
+    monkeypatch.setattr(pricing_services, "constants_cache",
+                        pricing_services.RefreshingCache(600, float("inf")))
+
+    async def scenario():
+        first = await pricing_services.get_pricing_constants()
+        pricing_services.set_pricing_constants({"price_meter": 2.0})
+        second = await pricing_services.get_pricing_constants()
+        return first, second
+
+    assert asyncio.run(scenario()) == ({"price_meter": 1.0},
+                                       {"price_meter": 2.0})
+    assert loads == ["/admin"]
+
+
+def test_stats_are_json_serializable():
+    json.dumps(pricing_services.constants_cache.stats(), allow_nan=False)
@@ -0,0 +1,45 @@
+import asyncio
+import httpx
+import pytest
+from fastapi.exceptions import HTTPException
+from app.services.proxy_services import proxy
+from app.services.upstream_services import Upstream
+
+
+def upstream(handler):
+    api = Upstream("voyage", "VOYAGE_URL")
+    api._client = httpx.AsyncClient(transport=httpx.MockTransport(handler),
+                                    base_url="http://voyage")
+    return api
+
+
+def test_body_is_relayed_untouched_with_content_headers():
+    body = b'[{"id": "v1", "price": 1.50}]'
+
+    def handler(request):
+        assert request.headers["accept-encoding"] == "identity"
+        return httpx.Response(200, stream=httpx.ByteStream(body),
+                              headers={"content-type": "application/json",
+                                       "x-upstream-secret": "1"})
+
+    async def scenario():
+        resp = await proxy(upstream(handler), "GET", "/voyage/last/u1/true")
+        chunks = [chunk async for chunk in resp.body_iterator]
+        await resp.background()
+        return resp, b"".join(chunks)
+
+    resp, relayed = asyncio.run(scenario())
+    assert relayed == body
+    assert resp.status_code == 200
+    assert resp.headers["content-type"] == "application/json"
+    assert "x-upstream-secret" not in resp.headers
+
+
+def test_errors_keep_the_detail_translation():
+    def handler(request):
+        return httpx.Response(404, json={"detail": "Voyage Not Found"})
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(proxy(upstream(handler), "GET", "/voyage/info/v1/u1"))
+    assert error.value.status_code == 404
+    assert error.value.detail == "Voyage Not Found"
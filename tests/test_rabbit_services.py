@@ -0,0 +1,135 @@
+import asyncio
+import json
+import time
+from app.services.rabbit_services import MetricsPublisher
+from app.services.outbox_services import Outbox
+
+
+class FakeTransport:
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.connects = 0
+        self.batches = []
+
+    def connect(self):
+        self.connects += 1
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("broker down")
+
+    def publish(self, bodies):
+        self.batches.append(list(bodies))
+
+    def idle(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def published(transport):
+    return [json.loads(body) for batch in transport.batches
+            for body in batch]
+
+
+def wait_until(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_events_are_published_in_batches():
+    transport = FakeTransport()
+    publisher = MetricsPublisher(transport, batch_size=3,
+                                 flush_interval=0.01)
+    for i in range(7):
+        publisher.put({"event": "Login", "n": i})
+    publisher.stop()
+
+    assert [event["n"] for event in published(transport)] == list(range(7))
+    assert all(len(batch) <= 3 for batch in transport.batches)
+
+
+def test_publisher_reconnects_after_broker_failure():
+    transport = FakeTransport(failures=2)
+    publisher = MetricsPublisher(transport, flush_interval=0.01,
+                                 retry_delay=0.01)
+    publisher.put({"event": "Signup"})
+
+    assert wait_until(lambda: publisher.published == 1)
+    publisher.stop()
+    assert transport.connects == 3
+    assert publisher.stats()["failures"] == 2
+
+
+def test_drop_oldest_keeps_newest_events():
+    transport = FakeTransport()
+    publisher = MetricsPublisher(transport, maxsize=2,
+                                 overflow="drop-oldest")
+    publisher.start = lambda: None
+    for i in range(4):
+        publisher.put({"n": i})
+
+    assert publisher.dropped == 2
+    bodies = publisher.buffer.read(5)
+    assert [json.loads(body)["n"] for body in bodies] == [2, 3]
+
+
+def test_block_policy_drops_new_event_after_timeout():
+    transport = FakeTransport()
+    publisher = MetricsPublisher(transport, maxsize=1, overflow="block",
+                                 block_timeout=0.01)
+    publisher.start = lambda: None
+
+    assert publisher.put({"n": 0})
+    assert not publisher.put({"n": 1})
+    assert publisher.dropped == 1
+
+
+def test_outbox_backlog_is_replayed_in_order_after_restart(tmp_path):
+    down = FakeTransport(failures=100)
+    publisher = MetricsPublisher(down, buffer=Outbox(str(tmp_path)),
+                                 flush_interval=0.01, retry_delay=0.01)
+    for i in range(5):
+        publisher.put({"n": i})
+    assert wait_until(lambda: down.connects >= 2)
+    publisher.stop()
+    assert publisher.dropped == 0
+
+    up = FakeTransport()
+    publisher = MetricsPublisher(up, buffer=Outbox(str(tmp_path)),
+                                 flush_interval=0.01)
+    assert publisher.pending() == 5
+    publisher.put({"n": 5})
+    assert wait_until(lambda: publisher.published == 6)
+    publisher.stop()
+
+    assert [event["n"] for event in published(up)] == list(range(6))
+    assert Outbox(str(tmp_path)).stats()["pending"] == 0
+
+
+def test_outbox_disk_errors_drop_the_event_instead_of_raising(tmp_path):
+    blocker = tmp_path / "not-a-directory"
+    blocker.write_text("")
+    publisher = MetricsPublisher(FakeTransport(),
+                                 buffer=Outbox(str(blocker / "outbox")))
+    publisher.start = lambda: None
+
+    assert not publisher.put({"event": "Login"})
+    assert (publisher.disk_errors, publisher.dropped) == (1, 1)
+
+
+def test_block_policy_never_waits_on_the_event_loop():
+    publisher = MetricsPublisher(FakeTransport(), maxsize=1, overflow="block",
+                                 block_timeout=5)
+    publisher.start = lambda: None
+
+    async def push():
+        start = time.monotonic()
+        results = [publisher.put({"n": i}) for i in range(2)]
+        return results, time.monotonic() - start
+
+    results, elapsed = asyncio.run(push())
+    assert results == [True, False]
+    assert elapsed < 1
@@ -0,0 +1,32 @@
+from app.services.ranking_services import rank, price_of
+
+
+def at(latitude, longitude):
+    return {"latitude": latitude, "longitude": longitude}
+
+
+def test_closest_drivers_are_kept_first():
+    candidates = [("far", at(-34.70, -58.40), None, None),
+                  ("near", at(-34.60, -58.40), None, None),
+                  ("middle", at(-34.65, -58.40), None, None),
+                  ("unknown", None, None, None)]
+    assert rank(candidates, -34.60, -58.40, k=2,
+                weights=(1, 0, 0)) == ["near", "middle"]
+    assert rank(candidates, -34.60, -58.40, k=0,
+                weights=(1, 0, 0)) == ["near", "middle", "unknown", "far"]
+
+
+def test_calification_and_price_break_distance_ties():
+    candidates = [("cheap", at(0, 0), 4.0, 100.0),
+                  ("good", at(0, 0), 5.0, 300.0),
+                  ("bad", at(0, 0), 3.0, 300.0)]
+    assert rank(candidates, 0, 0, k=3, weights=(1, 1, 0)) == \
+        ["good", "cheap", "bad"]
+    assert rank(candidates, 0, 0, k=1, weights=(1, 0, 1)) == ["cheap"]
+
+
+def test_price_of_known_shapes():
+    assert price_of(12) == 12.0
+    assert price_of({"final_price": "7.5"}) == 7.5
+    assert price_of({"vip": 9, "normal": 6}) == 6.0
+    assert price_of(None) is None
@@ -0,0 +1,177 @@
+import asyncio
+import httpx
+import pytest
+from fastapi.exceptions import HTTPException
+from app.services.resilience_services import CircuitBreaker, budget
+from app.services.resilience_services import RetryBudget, remaining
+from app.services.upstream_services import Upstream
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_breaker_opens_then_lets_one_trial_through():
+    clock = FakeClock()
+    breaker = CircuitBreaker("voyage", failures=2, reset=30, clock=clock)
+    for _ in range(2):
+        breaker.before()
+        breaker.failure()
+    assert breaker.state == "open"
+    with pytest.raises(HTTPException) as error:
+        breaker.before()
+    assert error.value.status_code == 503
+
+    clock.now = 30
+    breaker.before()
+    assert breaker.state == "half-open"
+    with pytest.raises(HTTPException):
+        breaker.before()
+    breaker.success()
+    assert breaker.stats() == {"state": "closed", "consecutive_failures": 0,
+                               "opened": 1, "rejected": 2}
+
+
+def test_inner_budget_never_outlives_the_outer_one():
+    with budget(1):
+        with budget(60):
+            assert remaining() <= 1
+        with budget(None):
+            assert remaining() is None
+    assert remaining() is None
+
+
+def upstream(handler):
+    api = Upstream("payments", "PAYMENTS_URL")
+    api._client = httpx.AsyncClient(transport=httpx.MockTransport(handler),
+                                    base_url="http://payments")
+    return api
+
+
+def test_slow_upstream_is_cut_at_the_request_deadline():
+    async def handler(request):
+        await asyncio.sleep(1)
+        return httpx.Response(200, json={})
+
+    async def scenario(api):
+        with budget(0.05):
+            try:
+                await api.get("/balance/u1")
+            except HTTPException as e:
+                error = e
+            with pytest.raises(HTTPException) as late:
+                await asyncio.sleep(0.05)
+                await api.get("/balance/u1")
+        return error, late.value
+
+    error, late = asyncio.run(scenario(upstream(handler)))
+    assert (error.status_code, error.detail) == (504,
+                                                 "payments service timed out")
+    assert late.status_code == 504
+
+
+def test_unreachable_upstream_trips_the_breaker():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        raise httpx.ConnectError("connection refused")
+
+    api = upstream(handler)
+    api.breaker.threshold = 2
+
+    async def scenario():
+        statuses = []
+        for _ in range(3):
+            try:
+                await api.get("/balance/u1")
+            except HTTPException as e:
+                statuses.append(e.status_code)
+        return statuses
+
+    assert asyncio.run(scenario()) == [503, 503, 503]
+    assert len(calls) == 2
+    assert api.stats()["breaker"]["state"] == "open"
+
+
+def test_retry_budget_refills_with_calls_and_time():
+    clock = FakeClock()
+    retries = RetryBudget(ratio=0.5, per_second=1, cap=2, clock=clock)
+    assert retries.withdraw() and retries.withdraw()
+    assert not retries.withdraw()
+    retries.deposit()
+    retries.deposit()
+    assert retries.withdraw()
+    clock.now = 1
+    assert retries.withdraw()
+    assert retries.stats() == {"tokens": 0, "exhausted": 1}
+
+
+def test_idempotent_get_is_retried_within_the_budget():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        if len(calls) == 1:
+            return httpx.Response(502, json={"detail": "Bad Gateway"})
+        return httpx.Response(200, json=4.5)
+
+    api = upstream(handler)
+    api.retry_base_delay = 0
+    resp = asyncio.run(api.get("/voyage/calification/u1/true",
+                               idempotent=True))
+    assert (resp.status_code, len(calls), api.retries) == (200, 2, 1)
+
+    calls.clear()
+    api.retry_budget.tokens = 0
+    api.retry_budget.per_second = 0
+    resp = asyncio.run(api.get("/voyage/calification/u1/true",
+                               idempotent=True))
+    assert (resp.status_code, len(calls)) == (502, 1)
+    resp = asyncio.run(api.get("/voyage/calification/u1/true"))
+    assert len(calls) == 2
+
+
+def test_slow_idempotent_get_is_hedged():
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        if len(calls) == 1:
+            await asyncio.sleep(1)
+        return httpx.Response(200, json=len(calls))
+
+    api = upstream(handler)
+    for _ in range(api.latency.min_samples):
+        api.latency.add(0.01)
+
+    async def scenario():
+        with budget(0.5):
+            return await api.get("/voyage/count/u1/true", idempotent=True)
+
+    resp = asyncio.run(scenario())
+    assert resp.json() == 2
+    assert (api.hedges, api.hedge_wins, api.retries) == (1, 1, 0)
+
+
+def test_timeouts_from_the_caller_deadline_do_not_open_the_breaker():
+    async def handler(request):
+        await asyncio.sleep(0.2)
+        return httpx.Response(200, json={"balance": 1})
+
+    api = upstream(handler)
+
+    async def scenario():
+        for _ in range(api.breaker.threshold + 1):
+            with budget(0.05):
+                with pytest.raises(HTTPException) as error:
+                    await api.get("/balance/u1")
+            assert error.value.status_code == 504
+        return await api.get("/balance/u1")
+
+    assert asyncio.run(scenario()).status_code == 200
+    assert api.stats()["breaker"]["state"] == "closed"
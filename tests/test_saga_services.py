@@ -0,0 +1,57 @@
+import asyncio
+import pytest
+from fastapi.exceptions import HTTPException
+from app.services.saga_services import Saga, SagaLog, SagaStep
+
+
+def test_independent_steps_run_together():
+    async def slow():
+        await asyncio.sleep(0.05)
+
+    async def scenario():
+        saga = (Saga("signup", SagaLog())
+                .stage(SagaStep("user", slow))
+                .stage(SagaStep("voyage", slow), SagaStep("wallet", slow)))
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await saga.run()
+        return saga, loop.time() - start
+
+    saga, elapsed = asyncio.run(scenario())
+    assert elapsed < 0.14
+    assert [record["state"] for record in saga.records()] == ["done"] * 3
+    assert saga.log.stats()["completed"] == 1
+
+
+def test_failed_step_undoes_the_completed_ones():
+    undone = []
+
+    async def ok():
+        return None
+
+    async def wallet():
+        raise HTTPException(detail="Wallet Error", status_code=500)
+
+    def undo(name):
+        async def compensate():
+            undone.append(name)
+        return compensate
+
+    log = SagaLog()
+    saga = (Saga("signup", log)
+            .stage(SagaStep("user", ok, undo("user")))
+            .stage(SagaStep("voyage", ok, undo("voyage")),
+                   SagaStep("wallet", wallet, undo("wallet")))
+            .stage(SagaStep("never", ok, undo("never"))))
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(saga.run())
+    assert error.value.detail == "Wallet Error"
+    assert undone == ["voyage", "user"]
+    assert saga.records() == [
+        {"step": "user", "state": "compensated"},
+        {"step": "voyage", "state": "compensated"},
+        {"step": "wallet", "state": "failed",
+         "error": {"status_code": 500, "detail": "Wallet Error"}},
+        {"step": "never", "state": "pending"}]
+    assert log.stats()["compensated"] == 1
+    assert log.stats()["recent_failures"][0]["saga"] == "signup"
@@ -0,0 +1,59 @@
+import asyncio
+import base64
+import io
+import os
+import pytest
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image
+from app.services.thumbnail_services import WorkerPool, resize
+
+
+def png(width, height):
+    out = io.BytesIO()
+    Image.new("RGB", (width, height), "red").save(out, "PNG")
+    return base64.b64encode(out.getvalue()).decode()
+
+
+def test_resize_keeps_data_uri_and_aspect_ratio():
+    img = "data:image/png;base64," + png(400, 200)
+    thumbnail = resize(img, 64)
+    prefix, _, payload = thumbnail.partition(",")
+    assert prefix == "data:image/png;base64"
+    with Image.open(io.BytesIO(base64.b64decode(payload))) as picture:
+        assert picture.size == (64, 32)
+
+
+def test_resize_rejects_what_is_not_a_picture():
+    with pytest.raises(Exception):
+        resize("https://storage.example/picture.png", 64)
+
+
+def test_pool_runs_jobs_in_workers_and_reports_usage():
+    pool = WorkerPool(1)
+
+    async def scenario():
+        return await asyncio.gather(pool.run(pow, 2, 10), pool.run(pow, 3, 2))
+
+    try:
+        assert asyncio.run(scenario()) == [1024, 9]
+    finally:
+        pool.close()
+    stats = pool.stats()
+    assert stats["completed"] == 2
+    assert stats["in_flight"] == 0
+    assert stats["max_queue_time"] >= 0
+
+
+def test_pool_is_restarted_after_a_worker_dies():
+    pool = WorkerPool(1)
+
+    async def scenario():
+        with pytest.raises(BrokenProcessPool):
+            await pool.run(os._exit, 1)
+        return await pool.run(pow, 2, 3)
+
+    try:
+        assert asyncio.run(scenario()) == 8
+    finally:
+        pool.close()
+    assert pool.stats()["restarts"] == 1
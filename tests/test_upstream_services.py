@@ -0,0 +1,88 @@
+import asyncio
+import httpx
+from app.services.resilience_services import budget
+from app.services.upstream_services import Upstream
+
+
+def test_pool_limits_fall_back_to_global_settings(monkeypatch):
+    monkeypatch.setenv("UPSTREAM_MAX_CONNECTIONS", "50")
+    monkeypatch.setenv("VOYAGE_MAX_CONNECTIONS", "10")
+    monkeypatch.delenv("USERS_MAX_CONNECTIONS", raising=False)
+
+    assert Upstream("voyage", "VOYAGE_URL").limits().max_connections == 10
+    assert Upstream("users", "USERS_URL").limits().max_connections == 50
+
+
+def test_base_url_is_read_from_environment(monkeypatch):
+    monkeypatch.setenv("PRICING_URL", "http://pricing:8004")
+
+    assert Upstream("pricing", "PRICING_URL").base_url == \
+        "http://pricing:8004"
+
+
+def test_identical_concurrent_gets_share_one_call():
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, json={"id": request.url.path})
+
+    api = Upstream("users", "USERS_URL")
+    api._client = httpx.AsyncClient(transport=httpx.MockTransport(handler),
+                                    base_url="http://users")
+
+    async def scenario():
+        return await asyncio.gather(
+            api.get("/users/d1/p1"), api.get("/users/d1/p1"),
+            api.get("/users/d1/p1", idempotent=True),
+            api.get("/users/d1/p1", headers={"token": "other"}),
+            api.get("/users/d2/p1"), api.post("/users/d1/p1"))
+
+    responses = asyncio.run(scenario())
+    assert len(calls) == 4
+    assert responses[0].json() == responses[2].json() == {"id": "/users/d1/p1"}
+    assert api.stats()["single_flight"] == {"calls": 3, "collapsed": 2,
+                                            "in_flight": 0}
+
+
+def test_followers_do_not_share_the_leader_deadline():
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        await asyncio.sleep(0.1)
+        return httpx.Response(200, json={"id": "d1"})
+
+    api = Upstream("users", "USERS_URL")
+    api._client = httpx.AsyncClient(transport=httpx.MockTransport(handler),
+                                    base_url="http://users")
+
+    async def leader():
+        with budget(0.05):
+            return await api.get("/users/d1/p1")
+
+    async def scenario():
+        return await asyncio.gather(leader(), api.get("/users/d1/p1"),
+                                    return_exceptions=True)
+
+    late, found = asyncio.run(scenario())
+    assert late.status_code == 504
+    assert found.json() == {"id": "d1"}
+    assert len(calls) == 2
+
+
+def test_redirects_are_followed(monkeypatch):
+    monkeypatch.setenv("USERS_URL", "http://users")
+
+    def handler(request):
+        if request.url.path == "/users":
+            return httpx.Response(307, headers={"Location": "/users/"})
+        return httpx.Response(201, json={"id": "u1"})
+
+    api = Upstream("users", "USERS_URL",
+                   transport=httpx.MockTransport(handler))
+    resp = asyncio.run(api.post("/users", json={"id": "u1"}))
+
+    assert resp.status_code == 201
+    assert resp.json() == {"id": "u1"}